@@ -0,0 +1,221 @@
+"""
+Offline benchmark of the BI agent against the bundled chinook.db.
+
+The agent runs end to end, with its tools, caches, memory and chart workers,
+but the chat model is a ScriptedChatModel that replays the recorded
+trajectories of a corpus of questions, so a run costs nothing and is
+repeatable. The report gives latency percentiles per stage, the throughput of
+N concurrent sessions, the peak RSS and the bytes moved between tools. Passing
+a previous report as --baseline exits with status 1 when a stage got slower or
+the throughput dropped by more than the tolerance, which is how CI catches
+regressions in the hot paths.
+
+Usage:
+    python -m benchmarks.run_benchmark --sessions 4 --iterations 3 --output report.json
+"""
+import argparse
+import json
+import logging
+import os
+import pathlib
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from benchmarks.scripted_llm import ScriptedChatModel
+from core.chart_pool import chart_pool
+from core.gen_bi_react_agent import GenBIReactAgent
+from core.question_cache import question_cache
+from core.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORPUS = pathlib.Path(__file__).parent / "corpus.json"
+DEFAULT_DB_URI = "sqlite:///" + str(pathlib.Path(__file__).parent.parent.resolve() / "chinook.db")
+
+
+class BenchmarkCallbackHandler:
+    """Collects the trace summary of a request."""
+
+    def __init__(self):
+        self.summary: Optional[Dict[str, Any]] = None
+
+    def process_trace_summary(self, summary: Dict[str, Any]) -> None:
+        self.summary = summary
+
+
+def load_corpus(path: str = None) -> List[Dict[str, Any]]:
+    """Load the questions and their recorded trajectories from a JSON file."""
+    with open(path or DEFAULT_CORPUS, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Return the p50, p90, p99 and maximum of a list of values using the nearest rank."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))], 1)
+
+    return {"p50": rank(0.5), "p90": rank(0.9), "p99": rank(0.99), "max": round(ordered[-1], 1)}
+
+
+def run_benchmark(corpus: List[Dict[str, Any]], sessions: int = 1, iterations: int = 1,
+                  db_uri: str = None, latency_seconds: float = 0.0, answer_cache: bool = False,
+                  warmup: bool = True) -> Dict[str, Any]:
+    """Run the corpus in concurrent sessions and report latency, throughput, memory and bytes.
+
+    Args:
+        corpus: The questions with their trajectories
+        sessions: The number of concurrent conversations, each asks every question
+        iterations: The number of times each session asks the corpus
+        db_uri: The database to query, defaults to the bundled chinook.db
+        latency_seconds: The simulated generation time of each model response
+        answer_cache: Whether repeated questions may be replayed from the answer cache
+        warmup: Whether to run the corpus once before measuring, e.g. to start the chart workers
+
+    Returns:
+        Dict[str, Any]: The benchmark report
+    """
+    llm = ScriptedChatModel(trajectories={item["question"]: item["steps"] for item in corpus},
+                            latency_seconds=latency_seconds)
+    agent = GenBIReactAgent(db_uri=db_uri or DEFAULT_DB_URI, llm=llm,
+                            answer_cache=question_cache if answer_cache else None)
+    if warmup:
+        for item in corpus:
+            agent.stream(item["question"], "benchmark-warmup")
+
+    def run_session(session: int) -> List[Dict[str, Any]]:
+        results = []
+        for _ in range(iterations):
+            for item in corpus:
+                handler = BenchmarkCallbackHandler()
+                start = time.perf_counter()
+                try:
+                    agent.stream(item["question"], f"benchmark-{session}", handler)
+                    error = None
+                except Exception as e:
+                    logger.warning("Benchmark question failed: %s", e)
+                    error = str(e)
+                results.append({"question": item["question"], "ms": (time.perf_counter() - start) * 1000,
+                                "summary": handler.summary, "error": error})
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = [result for session in executor.map(run_session, range(sessions)) for result in session]
+    wall_seconds = time.perf_counter() - start
+
+    stage_ms: Dict[str, List[float]] = {}
+    tokens_in = tokens_out = 0
+    tool_bytes = []
+    for result in results:
+        summary = result["summary"]
+        if summary is None:
+            continue
+        for kind, stage in summary["stages"].items():
+            stage_ms.setdefault(kind, []).append(stage["ms"])
+        tokens_in += summary["stages"].get("llm", {}).get("tokens_in", 0)
+        tokens_out += summary["stages"].get("llm", {}).get("tokens_out", 0)
+        # Arguments written by the model into the tools and outputs the tools hand back
+        tool_bytes.append(sum(span.attributes.get("input_bytes", 0) + span.attributes.get("bytes", 0)
+                              for span in tracer.collector.spans(summary["trace_id"]) if span.kind == "tool"))
+
+    return {
+        "requests": len(results),
+        "errors": sum(1 for result in results if result["error"] is not None),
+        "sessions": sessions,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(results) / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_ms": {"total": percentiles([result["ms"] for result in results]),
+                       **{kind: percentiles(values) for kind, values in sorted(stage_ms.items())}},
+        "tokens": {"in": tokens_in, "out": tokens_out},
+        "tool_bytes": {"total": sum(tool_bytes), "per_request": percentiles(tool_bytes)},
+        "peak_rss_mb": {"server": _max_rss_mb(resource.RUSAGE_SELF)},
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """List the regressions of a report against a baseline report.
+
+    A stage regresses when its p50 latency grew by more than the tolerance and
+    one millisecond, the run regresses when its throughput fell by more than the
+    tolerance.
+
+    Args:
+        report: The report of the current run
+        baseline: The report of a reference run
+        tolerance: The allowed relative change
+
+    Returns:
+        List[str]: A description of each regression, empty if there is none
+    """
+    regressions = []
+    for stage, latency in baseline.get("latency_ms", {}).items():
+        current = report["latency_ms"].get(stage)
+        if not latency or not current:
+            continue
+        if current["p50"] > latency["p50"] * (1 + tolerance) + 1:
+            regressions.append(f"{stage} p50 {current['p50']} ms, baseline {latency['p50']} ms")
+    if report["throughput_rps"] < baseline.get("throughput_rps", 0) * (1 - tolerance):
+        regressions.append(f"throughput {report['throughput_rps']} rps, baseline {baseline['throughput_rps']} rps")
+    return regressions
+
+
+def _max_rss_mb(who: int) -> float:
+    max_rss = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def main(argv: List[str] = None) -> int:
+    """Run the benchmark from the command line and print the report."""
+    parser = argparse.ArgumentParser(description="Benchmark the BI agent offline with a scripted chat model")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS), help="The JSON file of questions and trajectories")
+    parser.add_argument("--db", default=DEFAULT_DB_URI, help="The database URI")
+    parser.add_argument("--sessions", type=int, default=1, help="The number of concurrent sessions")
+    parser.add_argument("--iterations", type=int, default=3, help="The number of passes over the corpus per session")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per model response")
+    parser.add_argument("--answer-cache", action="store_true", help="Replay repeated questions from the answer cache")
+    parser.add_argument("--no-warmup", action="store_true", help="Measure the first pass over the corpus as well")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument("--baseline", help="A previous report to compare against, regressions exit with status 1")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="The allowed relative change to the baseline")
+    parser.add_argument("--rollups", action="store_true", help="Answer repeated aggregations from rollups")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+    # Rollups, column profiles and LLM responses persist below ~/.cache, a run starts without them to stay
+    # comparable and keeps the scripted responses out of the user's cache
+    workdir = tempfile.TemporaryDirectory(prefix="benchmark-")
+    os.environ["PROFILE_CATALOG_PATH"] = os.path.join(workdir.name, "profiles.sqlite")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir.name, "llm_cache.sqlite")
+    os.environ["ROLLUP_DIR"] = os.path.join(workdir.name, "rollups")
+    os.environ["ROLLUPS"] = "1" if args.rollups else "0"
+
+    report = run_benchmark(load_corpus(args.corpus), sessions=args.sessions, iterations=args.iterations,
+                           db_uri=args.db, latency_seconds=args.latency, answer_cache=args.answer_cache,
+                           warmup=not args.no_warmup)
+    # The peak RSS of the chart workers is known once they have exited
+    chart_pool.close()
+    report["peak_rss_mb"]["chart_worker"] = _max_rss_mb(resource.RUSAGE_CHILDREN)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from benchmarks.run_benchmark import compare, percentiles, run_benchmark
+from benchmarks.scripted_llm import ScriptedChatModel
+
+CORPUS = [{
+    "question": "How many customers are there per country?",
+    "steps": [
+        {"tool_calls": [{"name": "sql_db_query", "args": {
+            "query": "SELECT Country, COUNT(*) AS Customers FROM Customer GROUP BY Country"}}]},
+        {"tool_calls": [{"name": "convert_to_pandas", "args": {
+            "prompt": "customers per country", "sql_query_result": "{last_tool_output}"}}]},
+        {"content": "The USA has the most customers."},
+    ],
+}]
+
+
+def test_scripted_model_replays_the_trajectory_of_the_latest_question():
+    """The step follows the model turns of the current question and fills in the last tool output."""
+    llm = ScriptedChatModel(trajectories={item["question"]: item["steps"] for item in CORPUS})
+    question = HumanMessage(CORPUS[0]["question"])
+
+    first = llm.invoke([HumanMessage("an earlier question"), AIMessage("an earlier answer"), question])
+    assert first.tool_calls[0]["name"] == "sql_db_query"
+
+    tool_output = ToolMessage("result_handle: df_0123456789ab", tool_call_id=first.tool_calls[0]["id"])
+    second = llm.invoke([question, first, tool_output])
+    assert second.tool_calls[0]["args"]["sql_query_result"] == "result_handle: df_0123456789ab"
+    assert second.usage_metadata["input_tokens"] > 0
+
+    assert llm.invoke([question, first, tool_output, second]).content == "The USA has the most customers."
+    assert llm.invoke("Analyze the following data").content == llm.default_response
+
+
+def test_benchmark_runs_offline_and_reports_stages():
+    report = run_benchmark(CORPUS, sessions=2, iterations=2, warmup=False)
+
+    assert (report["requests"], report["errors"]) == (4, 0)
+    assert {"total", "llm", "tool", "sql"} <= set(report["latency_ms"])
+    assert report["tool_bytes"]["total"] > 0
+    assert report["peak_rss_mb"]["server"] > 0
+
+    slower = {**report, "latency_ms": {"total": {"p50": report["latency_ms"]["total"]["p50"] * 2 + 10}}}
+    assert compare(report, report) == []
+    assert compare(slower, report)[0].startswith("total p50")
+
+
+def test_percentiles_use_the_nearest_rank():
+    assert percentiles(list(range(1, 101))) == {"p50": 50, "p90": 90, "p99": 99, "max": 100}
+    assert percentiles([]) == {}
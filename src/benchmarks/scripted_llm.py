@@ -0,0 +1,73 @@
+"""
+A deterministic chat model that replays recorded tool-call trajectories.
+
+A trajectory is the list of steps the model takes to answer one question:
+each step is either tool calls or the final answer. The step to replay is the
+number of model turns already taken since the question was asked, so one model
+can serve many concurrent conversations. String arguments may reference the
+output of the latest tool call as {last_tool_output}, which is how a recorded
+trajectory passes a result handle from sql_db_query to the chart tools.
+"""
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+class ScriptedChatModel(BaseChatModel):
+    """A chat model that answers known questions by replaying their trajectories."""
+
+    trajectories: Dict[str, List[Dict[str, Any]]]
+    # The answer to prompts that are not a known question, e.g. the prompts of the analysis tools
+    default_response: str = "The data answers the question."
+    # Simulated generation time of each response
+    latency_seconds: float = 0.0
+    model_name: str = "scripted"
+    temperature: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs) -> "ScriptedChatModel":
+        """The tools are named in the trajectories, binding them is a no-op."""
+        return self
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        message = self._next_message(messages)
+        chars_in = sum(len(str(m.content)) for m in messages)
+        chars_out = len(str(message.content)) + sum(len(str(c["args"])) for c in message.tool_calls)
+        # Roughly four characters per token, enough to compare runs
+        message.usage_metadata = {"input_tokens": chars_in // 4, "output_tokens": chars_out // 4,
+                                  "total_tokens": (chars_in + chars_out) // 4}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _next_message(self, messages: List[BaseMessage]) -> AIMessage:
+        """Return the next step of the trajectory of the latest question."""
+        question_index = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=None)
+        steps = self.trajectories.get(str(messages[question_index].content).strip()) \
+            if question_index is not None else None
+        if steps is None:
+            return AIMessage(content=self.default_response)
+
+        turn = messages[question_index + 1:]
+        step = sum(1 for m in turn if isinstance(m, AIMessage))
+        if step >= len(steps):
+            return AIMessage(content=steps[-1].get("content", self.default_response))
+        last_tool_output = next((str(m.content) for m in reversed(turn) if isinstance(m, ToolMessage)), "")
+        tool_calls = [{"name": call["name"], "args": self._fill(call.get("args", {}), last_tool_output),
+                       "id": f"call_{uuid.uuid4().hex[:12]}", "type": "tool_call"}
+                      for call in steps[step].get("tool_calls", [])]
+        return AIMessage(content=steps[step].get("content", ""), tool_calls=tool_calls)
+
+    @staticmethod
+    def _fill(args: Dict[str, Any], last_tool_output: str) -> Dict[str, Any]:
+        return {key: value.replace("{last_tool_output}", last_tool_output) if isinstance(value, str) else value
+                for key, value in args.items()}
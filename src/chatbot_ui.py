@@ -1,5 +1,9 @@
+import asyncio
+import logging
+import os
 import streamlit as st
 import uuid
+from core.agent_registry import agent_registry
 from core.gen_bi_react_agent import GenBIReactAgent
 from ui.ui_helper import StreamlitBIMessageRenderer
 
@@ -7,36 +11,74 @@ from ui.ui_helper import StreamlitBIMessageRenderer
 # Load environment variables from .env file
 from dotenv import load_dotenv
 load_dotenv()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 st.set_page_config(page_title="BI Assistant", layout="wide")
 
 st.title("🧠 Conversational Business Intelligence Assistant")
 
+
+@st.cache_resource
+def get_agent_executor() -> GenBIReactAgent:
+    """Return the agent shared by all sessions, conversations are separated by session_id."""
+    return agent_registry.get_agent()
+
+
 # Initialize session state variables
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-if "agent_executor" not in st.session_state:
-    st.session_state.agent_executor = GenBIReactAgent()
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+
+# The number of latest turns shown expanded, older turns are rendered only when opened
+EXPANDED_TURNS = int(os.getenv("UI_EXPANDED_TURNS", "3"))
+
+
+def group_turns(messages: list) -> list:
+    """Split the chat history into turns, each starting with a user message."""
+    turns = []
+    for msg in messages:
+        if msg["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(msg)
+    return turns
+
+
+def render_turn(turn: list, renderer: StreamlitBIMessageRenderer) -> None:
+    for msg in turn:
+        if msg["role"] == "user":
+            with st.chat_message("user"):
+                st.markdown(msg["content"])
+        else:
+            renderer.process_message(msg["content"], msg["type"], msg.get("id"))
+
 
 # Display chat history
 renderer = StreamlitBIMessageRenderer(False)
-for msg in st.session_state.messages:
-    if msg["role"] == "user":
-        with st.chat_message("user"):
-            st.markdown(msg["content"])
-    else:
-       renderer.process_message(msg["content"], msg["type"])
+turns = group_turns(st.session_state.messages)
+for index, turn in enumerate(turns):
+    if index >= len(turns) - EXPANDED_TURNS:
+        render_turn(turn, renderer)
+        continue
+    # A collapsed turn costs a line of text, its charts and tables are not loaded until it is opened
+    question = turn[0]["content"] if turn[0]["role"] == "user" else "Earlier messages"
+    turn_id = turn[0].get("id", index)
+    if st.toggle(f"🗨️ {question}", key=f"turn-{turn_id}"):
+        render_turn(turn, renderer)
 
 # Chat input
 prompt = st.chat_input("Ask me a question...")
 if prompt:
-    st.session_state.messages.append({"role": "user", "type": "text", "content": prompt})
+    st.session_state.messages.append({"id": uuid.uuid4().hex[:12], "role": "user", "type": "text", "content": prompt})
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Generate or retrieve session ID
-    if 'session_id' not in st.session_state:
-        st.session_state.session_id = str(uuid.uuid4())
-    
-    st.session_state.agent_executor.stream(prompt, st.session_state.session_id, StreamlitBIMessageRenderer(True))
+    agent = get_agent_executor()
+    # Streamlit stops this run when the user asks again or presses Stop, which abandons the request
+    st.button("Stop", key="stop_request")
+    try:
+        asyncio.run(agent.astream(prompt, st.session_state.session_id, StreamlitBIMessageRenderer(True)))
+    finally:
+        # Cancel the statement and chart work an abandoned request would otherwise leave running
+        agent.cancel(st.session_state.session_id)
 
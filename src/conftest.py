@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(monkeypatch, tmp_path):
+    """Keep the tests off the rollups, column profiles and LLM responses the agent persists below ~/.cache."""
+    monkeypatch.setenv("ROLLUPS", "0")
+    monkeypatch.setenv("PROFILE_CATALOG_PATH", str(tmp_path / "profiles.sqlite"))
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
@@ -0,0 +1,77 @@
+import os
+import threading
+from typing import Dict, Tuple
+
+from langchain_community.utilities.sql_database import SQLDatabase
+
+from core.gen_bi_react_agent import GenBIReactAgent, default_db_uri
+from core.question_cache import question_cache
+from core.sql_engine import create_database
+
+
+class AgentRegistry:
+    """
+    A process-wide, thread-safe registry of agents and database connections.
+
+    Building a GenBIReactAgent reflects the database schema, creates a connection
+    pool, sets up the chat model and compiles the agent graph. The registry does
+    this once per (database, model) pair and hands the same instance to every
+    caller. Conversations are kept apart by the thread_id passed to stream.
+    Answered questions are replayed from the question cache only when the
+    QUESTION_CACHE environment variable is 1.
+    """
+
+    def __init__(self):
+        """Initialize the AgentRegistry with no agents or databases."""
+        self._agents: Dict[Tuple[str, str], GenBIReactAgent] = {}
+        self._databases: Dict[str, SQLDatabase] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    def get_agent(self, db_uri: str = None, model_name: str = "openai:gpt-4.1") -> GenBIReactAgent:
+        """
+        Return the shared agent for a database and model, creating it on first use.
+
+        Args:
+            db_uri: The database URI to connect to, defaults to the DB_* environment variables
+            model_name: The name of the language model to use
+
+        Returns:
+            GenBIReactAgent: The shared agent
+        """
+        db_uri = db_uri or default_db_uri()
+        key = (db_uri, model_name)
+        agent = self._agents.get(key)
+        if agent is not None:
+            return agent
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Build outside the registry lock so agents for other keys are not blocked
+        with key_lock:
+            agent = self._agents.get(key)
+            if agent is None:
+                answer_cache = question_cache if os.getenv("QUESTION_CACHE", "0") == "1" else None
+                agent = GenBIReactAgent(model_name=model_name, db=self.get_database(db_uri),
+                                        answer_cache=answer_cache)
+                self._agents[key] = agent
+        return agent
+
+    def get_database(self, db_uri: str) -> SQLDatabase:
+        """
+        Return the shared database connection for a URI, creating it on first use.
+
+        Args:
+            db_uri: The database URI to connect to
+
+        Returns:
+            SQLDatabase: The shared database with its engine, connection pool and statement timeout
+        """
+        with self._lock:
+            db = self._databases.get(db_uri)
+            if db is None:
+                db = create_database(db_uri)
+                self._databases[db_uri] = db
+            return db
+
+agent_registry = AgentRegistry()
@@ -0,0 +1,248 @@
+"""
+Headless batch mode: answer a file of questions and write the artifacts to disk.
+
+Questions are read from a JSONL file, one object per line with a "question"
+and an optional "id". They are answered concurrently, each in its own
+conversation, with at most --concurrency questions in flight. For every
+question the SQL, the result table, the chart and its code, and the answer are
+written to a directory named after its id, and a record with the status,
+attempts and timing is appended to results.jsonl in the output directory.
+Questions already answered in results.jsonl are skipped, so an interrupted run
+resumes where it stopped.
+
+Usage:
+    python -m core.batch_runner questions.jsonl --output out --concurrency 4 --retries 2
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from core.gen_bi_react_agent import GenBIReactAgent
+from core.image_manager import image_manager
+from core.result_store import result_store
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FILE = "results.jsonl"
+
+
+class BatchCallbackHandler:
+    """Collects the artifacts of one answered question."""
+
+    def __init__(self):
+        self.sql: List[str] = []
+        self.result_handle: Optional[str] = None
+        self.chart_image_id: Optional[str] = None
+        self.chart_code: Optional[str] = None
+        self.answer: Optional[str] = None
+        self.summary: Optional[Dict[str, Any]] = None
+
+    def process_sql(self, sql_query: str) -> None:
+        self.sql.append(sql_query)
+
+    def process_data(self, data_content: str) -> None:
+        self.result_handle = result_store.find_handle(data_content) or self.result_handle
+
+    def process_chart(self, image_id: str) -> None:
+        self.chart_image_id = image_id
+
+    def process_chart_code(self, chart_code: str) -> None:
+        self.chart_code = chart_code
+
+    def process_last_message(self, message_content: str) -> None:
+        self.answer = message_content
+
+    def process_trace_summary(self, summary: Dict[str, Any]) -> None:
+        self.summary = summary
+
+
+def load_questions(path: str) -> List[Dict[str, str]]:
+    """Read the questions of a JSONL file, giving each an id if it has none.
+
+    Args:
+        path: The JSONL file, one {"question": ..., "id": ...} object per line
+
+    Returns:
+        List[Dict[str, str]]: The questions with their ids
+    """
+    questions = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            question = item["question"].strip()
+            question_id = safe_id(str(item.get("id") or hashlib.sha256(question.encode("utf-8")).hexdigest()[:12]))
+            if question_id in seen:
+                raise ValueError(f"Duplicate question id {question_id} on line {line_number}")
+            seen.add(question_id)
+            questions.append({"id": question_id, "question": question})
+    return questions
+
+
+def safe_id(question_id: str) -> str:
+    """Make a question id usable as a directory name."""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", question_id).strip("._") or "question"
+
+
+def completed_ids(output_dir: str) -> Set[str]:
+    """Return the ids of the questions answered in an earlier run, the last record of a question wins."""
+    path = os.path.join(output_dir, RESULTS_FILE)
+    if not os.path.exists(path):
+        return set()
+    statuses = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A record cut short by an interrupted run
+                continue
+            statuses[record["id"]] = record["status"]
+    return {question_id for question_id, status in statuses.items() if status == "ok"}
+
+
+def write_artifacts(directory: pathlib.Path, question: str, handler: BatchCallbackHandler) -> List[str]:
+    """Write the artifacts of an answered question and return their file names."""
+    directory.mkdir(parents=True, exist_ok=True)
+    files = {"question.txt": question}
+    if handler.sql:
+        files["query.sql"] = "\n\n".join(handler.sql) + "\n"
+    if handler.answer is not None:
+        files["answer.md"] = handler.answer + "\n"
+    if handler.chart_code:
+        files["chart.py"] = handler.chart_code
+    for name, content in files.items():
+        (directory / name).write_text(content, encoding="utf-8")
+
+    written = list(files)
+    data = result_store.load(handler.result_handle) if handler.result_handle else None
+    if data is not None:
+        data.to_csv(directory / "result.csv", index=False)
+        written.append("result.csv")
+    image = image_manager.load_bytes(handler.chart_image_id) if handler.chart_image_id else None
+    if image is not None:
+        (directory / "chart.png").write_bytes(image)
+        written.append("chart.png")
+    return sorted(written)
+
+
+async def answer_question(agent: GenBIReactAgent, item: Dict[str, str], output_dir: str,
+                          retries: int = 1, timeout_seconds: float = None) -> Dict[str, Any]:
+    """Answer one question with retries and write its artifacts.
+
+    Every attempt runs in a fresh conversation so a failed attempt does not
+    leave messages behind for the next one. Attempts that raise or time out are
+    retried after an exponential backoff.
+
+    Args:
+        agent: The agent answering the question
+        item: The question and its id
+        output_dir: The directory the artifacts are written below
+        retries: The number of times a failed question is retried
+        timeout_seconds: The time an attempt may take, unbounded if None
+
+    Returns:
+        Dict[str, Any]: The record of the question for results.jsonl
+    """
+    start = time.perf_counter()
+    error = None
+    for attempt in range(1, retries + 2):
+        handler = BatchCallbackHandler()
+        session_id = f"batch-{item['id']}-{attempt}"
+        try:
+            await asyncio.wait_for(agent.astream(item["question"], session_id, handler), timeout_seconds)
+            files = write_artifacts(pathlib.Path(output_dir) / item["id"], item["question"], handler)
+            return {"id": item["id"], "question": item["question"], "status": "ok", "attempts": attempt,
+                    "seconds": round(time.perf_counter() - start, 3), "files": files,
+                    "stages": (handler.summary or {}).get("stages", {})}
+        except asyncio.TimeoutError:
+            # Stop the statement and chart the abandoned attempt may still be running
+            agent.cancel(session_id)
+            error = f"Timed out after {timeout_seconds:g} seconds"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        logger.warning("Question %s failed on attempt %d: %s", item["id"], attempt, error)
+        if attempt <= retries:
+            await asyncio.sleep(min(2 ** (attempt - 1), 30))
+    return {"id": item["id"], "question": item["question"], "status": "error", "attempts": retries + 1,
+            "seconds": round(time.perf_counter() - start, 3), "error": error}
+
+
+async def run_batch(agent: GenBIReactAgent, questions: List[Dict[str, str]], output_dir: str,
+                    concurrency: int = 4, retries: int = 1, timeout_seconds: float = None,
+                    resume: bool = True) -> List[Dict[str, Any]]:
+    """Answer questions concurrently and record each outcome as it finishes.
+
+    Args:
+        agent: The agent answering the questions
+        questions: The questions with their ids, see load_questions
+        output_dir: The directory the artifacts and results.jsonl are written to
+        concurrency: The maximum number of questions answered at the same time
+        retries: The number of times a failed question is retried
+        timeout_seconds: The time an attempt may take, unbounded if None
+        resume: Whether to skip the questions answered in an earlier run
+
+    Returns:
+        List[Dict[str, Any]]: The records of the questions answered in this run
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    done = completed_ids(output_dir) if resume else set()
+    pending = [item for item in questions if item["id"] not in done]
+    if done:
+        logger.info("Resuming, %d of %d questions are already answered", len(questions) - len(pending),
+                    len(questions))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results_path = os.path.join(output_dir, RESULTS_FILE)
+
+    async def run(item: Dict[str, str]) -> Dict[str, Any]:
+        async with semaphore:
+            record = await answer_question(agent, item, output_dir, retries, timeout_seconds)
+        # The records are the checkpoint of the run, each is written as soon as its question finishes
+        with open(results_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        logger.info("%s %s in %.1f s", record["status"], item["id"], record["seconds"])
+        return record
+
+    return list(await asyncio.gather(*(run(item) for item in pending)))
+
+
+def main(argv: List[str] = None) -> int:
+    """Run a batch of questions from the command line."""
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions and write the artifacts")
+    parser.add_argument("questions", help="The JSONL file of questions, one {\"question\", \"id\"} object per line")
+    parser.add_argument("--output", default="batch_output", help="The output directory")
+    parser.add_argument("--db", help="The database URI, defaults to the bundled chinook.db")
+    parser.add_argument("--model", default="openai:gpt-4.1", help="The chat model")
+    parser.add_argument("--concurrency", type=int, default=4, help="The number of questions answered at once")
+    parser.add_argument("--retries", type=int, default=1, help="The number of retries of a failed question")
+    parser.add_argument("--timeout", type=float, help="The seconds an attempt may take")
+    parser.add_argument("--no-resume", action="store_true", help="Answer every question again")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    db_uri = args.db or "sqlite:///" + str(pathlib.Path(__file__).parent.parent.resolve() / "chinook.db")
+    agent = GenBIReactAgent(db_uri=db_uri, model_name=args.model)
+
+    records = asyncio.run(run_batch(agent, load_questions(args.questions), args.output, args.concurrency,
+                                    args.retries, args.timeout, resume=not args.no_resume))
+    failed = [record for record in records if record["status"] != "ok"]
+    print(f"Answered {len(records) - len(failed)} of {len(records)} questions, results in "
+          f"{os.path.join(args.output, RESULTS_FILE)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,61 @@
+import asyncio
+import json
+import pathlib
+
+from benchmarks.scripted_llm import ScriptedChatModel
+from core.batch_runner import load_questions, run_batch
+from core.gen_bi_react_agent import GenBIReactAgent
+
+DB_URI = "sqlite:///" + str(pathlib.Path(__file__).parent.parent.resolve() / "chinook.db")
+TRAJECTORIES = {
+    "How many tracks are there per media type?": [
+        {"tool_calls": [{"name": "sql_db_query_checker", "args": {
+            "query": "SELECT MediaTypeId, COUNT(*) AS Tracks FROM Track GROUP BY MediaTypeId"}}]},
+        {"tool_calls": [{"name": "sql_db_query", "args": {
+            "query": "SELECT MediaTypeId, COUNT(*) AS Tracks FROM Track GROUP BY MediaTypeId"}}]},
+        {"tool_calls": [{"name": "convert_to_pandas", "args": {
+            "prompt": "tracks per media type", "sql_query_result": "{last_tool_output}"}}]},
+        {"content": "Most tracks are MPEG audio files."},
+    ],
+    "Which customer spent the most?": [
+        {"tool_calls": [{"name": "sql_db_query", "args": {
+            "query": "SELECT CustomerId, SUM(Total) AS Spent FROM Invoice GROUP BY CustomerId "
+                     "ORDER BY Spent DESC LIMIT 1"}}]},
+        {"content": "Customer 6 spent the most."},
+    ],
+}
+
+
+class FlakyAgent(GenBIReactAgent):
+    """Fails the first attempt of every question."""
+    failed = set()
+
+    async def astream(self, query, session_id=None, bi_agent_callback_handler=None):
+        if query not in self.failed:
+            self.failed.add(query)
+            raise ConnectionError("The model is unavailable")
+        return await super().astream(query, session_id, bi_agent_callback_handler)
+
+
+def test_batch_writes_artifacts_retries_and_resumes(tmp_path):
+    questions_file = tmp_path / "questions.jsonl"
+    questions_file.write_text("\n".join([json.dumps({"id": "media types", "question": question})
+                                         if i == 0 else json.dumps({"question": question})
+                                         for i, question in enumerate(TRAJECTORIES)]) + "\n")
+    questions = load_questions(str(questions_file))
+    assert questions[0]["id"] == "media_types"
+
+    agent = FlakyAgent(db_uri=DB_URI, llm=ScriptedChatModel(trajectories=TRAJECTORIES), answer_cache=None)
+    output = tmp_path / "out"
+    records = asyncio.run(run_batch(agent, questions, str(output), concurrency=2, retries=1))
+
+    assert [record["status"] for record in records] == ["ok", "ok"]
+    assert all(record["attempts"] == 2 for record in records)
+    media_types = output / "media_types"
+    assert (media_types / "answer.md").read_text().strip() == "Most tracks are MPEG audio files."
+    assert "GROUP BY MediaTypeId" in (media_types / "query.sql").read_text()
+    assert (media_types / "result.csv").read_text().splitlines()[0] == "MediaTypeId,Tracks"
+
+    # Answered questions are skipped when the run is repeated
+    assert asyncio.run(run_batch(agent, questions, str(output))) == []
+    assert len((output / "results.jsonl").read_text().splitlines()) == 2
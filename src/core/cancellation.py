@@ -0,0 +1,134 @@
+"""
+Cancellation of running requests.
+
+A request runs within a CancellationToken that is registered under its
+session id and is the current token of its context, so the tools it calls can
+find it. Cancelling the session sets the token and runs the callbacks
+registered by the running stages, e.g. to cancel the statement executing on a
+database connection or to stop a chart from rendering.
+"""
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# The token of the request running in the current context
+_current_token: contextvars.ContextVar[Optional["CancellationToken"]] = contextvars.ContextVar(
+    "current_cancellation_token", default=None)
+
+
+class RequestCancelled(Exception):
+    """Raised when a stage notices that its request was cancelled."""
+
+
+class CancellationToken:
+    """Signals the cancellation of one request to the stages running it."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self) -> None:
+        """Cancel the request and run the registered callbacks once."""
+        with self._lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Cancellation callback failed: %s", e)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Register a callback to run on cancellation, it runs at once if the request is already cancelled.
+
+        Args:
+            callback: The function to call
+
+        Returns:
+            Callable[[], None]: A function that unregisters the callback
+        """
+        with self._lock:
+            if not self.event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def raise_if_cancelled(self) -> None:
+        if self.event.is_set():
+            raise RequestCancelled("The request was cancelled")
+
+    def _remove(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class CancellationRegistry:
+    """Keeps the tokens of the running requests by session id."""
+
+    def __init__(self):
+        self._tokens: Dict[str, CancellationToken] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def request(self, session_id: Optional[str]) -> Iterator[CancellationToken]:
+        """Run a block as a cancellable request of a session.
+
+        A new request of the session replaces the token of the previous one, a
+        request without a session id can only be cancelled through its token.
+        The request is cancelled when the block exits with an exception.
+        """
+        token = CancellationToken()
+        if session_id is not None:
+            with self._lock:
+                self._tokens[session_id] = token
+        context_token = _current_token.set(token)
+        try:
+            yield token
+        except BaseException:
+            # Stages of an abandoned request may still run in worker threads, e.g. when the
+            # coroutine was cancelled or the UI stopped the script
+            token.cancel()
+            raise
+        finally:
+            _current_token.reset(context_token)
+            if session_id is not None:
+                with self._lock:
+                    if self._tokens.get(session_id) is token:
+                        del self._tokens[session_id]
+
+    def cancel(self, session_id: str) -> bool:
+        """Cancel the running request of a session.
+
+        Args:
+            session_id: The session whose request to cancel
+
+        Returns:
+            bool: True if a request was running
+        """
+        with self._lock:
+            token = self._tokens.get(session_id)
+        if token is None:
+            return False
+        logger.info("Cancelling the request of session %s", session_id)
+        token.cancel()
+        return True
+
+    @staticmethod
+    def current() -> Optional[CancellationToken]:
+        """Return the token of the request running in the current context, if any."""
+        return _current_token.get()
+
+cancellation = CancellationRegistry()
@@ -0,0 +1,278 @@
+"""
+A pool of warm worker processes that render chart code to PNG images.
+
+Drawing with matplotlib is CPU bound and holds the GIL, so charts rendered in
+the server process stall every other session. The pool runs chart code in
+separate processes that import matplotlib and seaborn and build the font cache
+once at start-up. The data is passed to a worker as an Arrow IPC stream in a
+shared memory block. A job that runs past its timeout or is cancelled kills its
+worker, which is replaced by a fresh one.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+from core.cancellation import cancellation
+
+logger = logging.getLogger(__name__)
+
+# pyplot keeps global state, charts drawn in the same process are drawn one at a time
+_render_lock = threading.Lock()
+
+
+class ChartRenderError(Exception):
+    """Raised when chart code fails, times out or is cancelled."""
+
+
+def execute_chart_code(code: str, data: pd.DataFrame) -> bytes:
+    """Execute chart code in the current process and return the PNG image.
+
+    The code gets the dataframe as data and pd, np, plt and sns in its namespace.
+    The figure is taken from the chart variable if it holds one, otherwise the
+    current pyplot figure is saved.
+
+    Args:
+        code: The chart code
+        data: The data to chart
+
+    Returns:
+        bytes: The PNG image
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import seaborn as sns
+    from matplotlib.figure import Figure
+
+    namespace: Dict[str, Any] = {"data": data, "pd": pd, "np": np, "plt": plt, "sns": sns}
+    buffer = io.BytesIO()
+    with _render_lock, sns.axes_style("whitegrid"):
+        try:
+            exec(compile(code, "<chart>", "exec"), namespace)
+            chart = namespace.get("chart")
+            figure = chart if isinstance(chart, Figure) else getattr(chart, "figure", None)
+            figure = figure if isinstance(figure, Figure) else plt.gcf()
+            figure.savefig(buffer, format="png", dpi=100, bbox_inches="tight", pad_inches=0.2)
+        finally:
+            plt.close("all")
+    return buffer.getvalue()
+
+
+def _warm_up() -> None:
+    """Import the plotting libraries and build the font cache by drawing a small chart."""
+    execute_chart_code("import matplotlib.pyplot as plt\nplt.plot(data['x'], data['y'])\nplt.title('warm up')",
+                       pd.DataFrame({"x": [0, 1], "y": [0, 1]}))
+
+
+def _worker_main(conn) -> None:
+    """Render the jobs received on a pipe until None is received."""
+    _warm_up()
+    conn.send("ready")
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+        code, name, size = job
+        try:
+            # Spawned workers share the parent's resource tracker, which unlinks the block
+            shm = SharedMemory(name=name)
+            try:
+                # Copy the stream out so no view of the block outlives it
+                payload = bytes(shm.buf[:size])
+            finally:
+                shm.close()
+            data = pa.ipc.open_stream(pa.py_buffer(payload)).read_all().to_pandas()
+            image = execute_chart_code(code, data)
+            conn.send(("ok", image))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """A worker process and the parent end of its pipe."""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True,
+                                       name="chart-worker")
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self, deadline: float) -> None:
+        if self.ready:
+            return
+        while not self.conn.poll(0.05):
+            if time.monotonic() > deadline or not self.process.is_alive():
+                raise ChartRenderError("The chart worker did not start")
+        self.conn.recv()
+        self.ready = True
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ChartPool:
+    """
+    A pool of warm processes that render chart code.
+
+    Jobs wait for an idle worker, so at most `workers` charts render at the same
+    time and throughput scales with the number of cores. A pool with no workers
+    renders in the calling process.
+    """
+
+    def __init__(self, workers: int = None, timeout_seconds: float = None):
+        """Initialize the ChartPool, the workers are started on first use or by start().
+
+        Args:
+            workers: The number of worker processes, defaults to the CHART_POOL_WORKERS environment
+                variable or the number of cores up to 4, 0 renders in the calling process
+            timeout_seconds: The default time a job may take, defaults to the CHART_TIMEOUT_SECONDS
+                environment variable or 30 seconds
+        """
+        if workers is None:
+            workers = int(os.getenv("CHART_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+        if timeout_seconds is None:
+            timeout_seconds = float(os.getenv("CHART_TIMEOUT_SECONDS", "30"))
+        self.workers = workers
+        self.timeout_seconds = timeout_seconds
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._all = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> None:
+        """Start the worker processes, they warm up in the background."""
+        with self._lock:
+            if self._started or self.workers <= 0:
+                return
+            for _ in range(self.workers):
+                self._spawn()
+            self._started = True
+
+    def render(self, code: str, data: pd.DataFrame, timeout: float = None,
+               cancel_event: threading.Event = None) -> bytes:
+        """Render chart code in a worker process.
+
+        Args:
+            code: The chart code, it gets the dataframe as data
+            data: The data to chart
+            timeout: The time the job may take including waiting for a worker, defaults to timeout_seconds
+            cancel_event: An event that cancels the job when set, defaults to the cancellation
+                of the current request
+
+        Returns:
+            bytes: The PNG image
+
+        Raises:
+            ChartRenderError: If the code fails, the job times out or it is cancelled
+        """
+        if self.workers <= 0:
+            try:
+                return execute_chart_code(code, data)
+            except Exception as e:
+                raise ChartRenderError(f"{type(e).__name__}: {e}") from e
+        if cancel_event is None and cancellation.current() is not None:
+            cancel_event = cancellation.current().event
+        self.start()
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout_seconds)
+
+        worker = self._acquire(deadline, cancel_event)
+        shm, size = self._share(data)
+        healthy = True
+        try:
+            worker.wait_ready(deadline)
+            worker.conn.send((code, shm.name, size))
+            while not worker.conn.poll(0.05):
+                if cancel_event is not None and cancel_event.is_set():
+                    healthy = False
+                    raise ChartRenderError("Chart rendering was cancelled")
+                if time.monotonic() > deadline:
+                    healthy = False
+                    raise ChartRenderError("Chart rendering timed out")
+            status, result = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            healthy = False
+            raise ChartRenderError(f"The chart worker failed: {e}")
+        finally:
+            shm.close()
+            shm.unlink()
+            self._release(worker, healthy)
+
+        if status != "ok":
+            raise ChartRenderError(result)
+        return result
+
+    def close(self) -> None:
+        """Stop all worker processes."""
+        with self._lock:
+            workers, self._all = self._all, set()
+            self._started = False
+        self._idle = queue.Queue()
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.kill()
+
+    def _spawn(self) -> None:
+        worker = _Worker(self._context)
+        self._all.add(worker)
+        self._idle.put(worker)
+
+    def _acquire(self, deadline: float, cancel_event: Optional[threading.Event]) -> _Worker:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ChartRenderError("Chart rendering was cancelled")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ChartRenderError("Timed out waiting for a chart worker")
+            try:
+                return self._idle.get(timeout=min(remaining, 0.1))
+            except queue.Empty:
+                continue
+
+    def _release(self, worker: _Worker, healthy: bool) -> None:
+        if healthy and worker.process.is_alive():
+            self._idle.put(worker)
+            return
+        # The worker may still be running the job, replace it with a fresh one
+        logger.warning("Replacing chart worker %s", worker.process.pid)
+        worker.kill()
+        with self._lock:
+            self._all.discard(worker)
+            if self._started:
+                self._spawn()
+
+    @staticmethod
+    def _share(data: pd.DataFrame) -> Tuple[SharedMemory, int]:
+        """Write the data as an Arrow IPC stream to a new shared memory block and return it with its size."""
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        payload = sink.getvalue()
+        shm = SharedMemory(create=True, size=max(payload.size, 1))
+        shm.buf[:payload.size] = memoryview(payload).cast("B")
+        return shm, payload.size
+
+chart_pool = ChartPool()
@@ -0,0 +1,45 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from core.chart_pool import ChartPool, ChartRenderError
+
+CODE = """
+import matplotlib.pyplot as plt
+
+def plot(data):
+    fig, ax = plt.subplots()
+    ax.bar(data["name"], data["value"])
+    return fig
+
+chart = plot(data)
+"""
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = ChartPool(workers=1, timeout_seconds=60)
+    yield pool
+    pool.close()
+
+
+def test_renders_in_a_worker(pool):
+    image = pool.render(CODE, pd.DataFrame({"name": ["a", "b"], "value": [1.0, 2.0]}))
+    assert image.startswith(b"\x89PNG")
+
+
+def test_errors_and_timeouts_keep_the_pool_usable(pool):
+    with pytest.raises(ChartRenderError, match="KeyError"):
+        pool.render(CODE, pd.DataFrame({"other": [1]}))
+
+    with pytest.raises(ChartRenderError, match="timed out"):
+        pool.render("import time\ntime.sleep(30)", pd.DataFrame({"a": [1]}), timeout=1)
+
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(ChartRenderError, match="cancelled"):
+        pool.render(CODE, pd.DataFrame({"a": [1]}), cancel_event=cancel)
+
+    image = pool.render(CODE, pd.DataFrame({"name": ["a"], "value": [1.0]}))
+    assert image.startswith(b"\x89PNG")
@@ -0,0 +1,188 @@
+"""
+Deterministic chart rendering for the common chart shapes.
+
+The chart type is inferred from the dtypes of the result and keywords in the
+user's request: a time or ordinal column with a measure, including dates and
+years returned as strings, is drawn as a line,
+categories with a measure as bars or a pie, two measures as a scatter plot and a
+single measure as a histogram. The chart is drawn by executing generated
+seaborn code in the chart pool, and the code is returned with the image like
+the LIDA charts. Requests
+that match none of the templates return None and are left to LIDA.
+"""
+import re
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from core.chart_pool import chart_pool
+from core.downsampling import is_additive, time_axis, top_categories
+
+# Keywords of the requested chart type, checked in order
+INTENT_KEYWORDS = [
+    ("unsupported", r"\b(heat ?map|choropleth|map chart|box ?plot|violin|area chart|stacked|bubble|radar|"
+                    r"treemap|funnel|sankey|network|diagram|3d|multiple charts|subplots?|dashboard)\b"),
+    ("pie", r"\b(pie|donut|doughnut|shares?|proportions?|percentages?|composition|breakdown)\b"),
+    ("line", r"\b(line|trends?|over time|timeline|time series|monthly|daily|weekly|yearly|annual|growth)\b"),
+    ("scatter", r"\b(scatter|relationship|correlat\w*|versus|vs\.?)\b"),
+    ("hist", r"\b(histogram|distribution)\b"),
+    ("bar", r"\b(bar|column chart|compare|comparison|ranking|top|bottom|by)\b"),
+]
+# Integer columns with these names are treated as an ordered x axis
+ORDINAL_NAME_PATTERN = re.compile(r"(year|quarter|month|week|day|hour|period)", re.IGNORECASE)
+PIE_MAX_SLICES = 8
+BAR_MAX_CATEGORIES = 30
+
+
+@dataclass
+class ChartSpec:
+    """A chart drawn by a template."""
+    kind: str
+    x: Optional[str]
+    y: Optional[str]
+    title: str
+
+
+def infer_chart(data: pd.DataFrame, prompt: str) -> Tuple[Optional[ChartSpec], pd.DataFrame]:
+    """Choose a template chart for a result and a request.
+
+    Several categorical columns, such as first and last names, are joined into
+    a single label column. Repeated categories of additive measures are summed
+    and long tails folded into "Other", other measures are drawn unfolded.
+
+    Args:
+        data: The result to chart
+        prompt: The user's request
+
+    Returns:
+        Tuple[Optional[ChartSpec], pd.DataFrame]: The chart and the data prepared for it,
+        or None and the unchanged data if no template fits
+    """
+    if data.empty or len(data.columns) > 4:
+        return None, data
+    intent = _intent(prompt)
+    if intent == "unsupported":
+        return None, data
+    original = data
+
+    # Dates returned as strings, e.g. by SQLite strftime, are parsed, years become numbers
+    parsed = {c: time_axis(data[c]) for c in data.columns}
+    years = [c for c, values in parsed.items() if values is not None and pd.api.types.is_numeric_dtype(values)]
+    data = data.assign(**{c: values for c, values in parsed.items() if values is not None})
+
+    numeric = [c for c in data.columns
+               if pd.api.types.is_numeric_dtype(data[c]) and not pd.api.types.is_bool_dtype(data[c])]
+    temporal = [c for c in data.columns if pd.api.types.is_datetime64_any_dtype(data[c])]
+    ordinal = [c for c in numeric if c in years or
+               (ORDINAL_NAME_PATTERN.search(str(c)) and pd.api.types.is_integer_dtype(data[c]))]
+    # Labels of periods such as month names keep the order of the query
+    labels = [c for c in data.columns if c not in numeric and c not in temporal and ORDINAL_NAME_PATTERN.search(str(c))]
+    categorical = [c for c in data.columns if c not in numeric and c not in temporal and c not in labels]
+    measures = [c for c in numeric if c not in ordinal]
+
+    # A time or ordinal axis with one measure, never folded into "Other"
+    if (temporal or ordinal or labels) and not categorical and len(measures) == 1 and \
+            intent in (None, "line", "bar"):
+        x, y = (temporal or ordinal or labels)[0], measures[0]
+        if data[x].duplicated().any() and not is_additive(y):
+            return None, original
+        kind = "bar" if intent == "bar" and not temporal else "line"
+        if x in labels:
+            prepared = data.groupby(x, as_index=False, sort=False)[y].sum()
+        else:
+            prepared = data.groupby(x, as_index=False)[y].sum().sort_values(x)
+        return ChartSpec(kind, x, y, f"{y} by {x}"), prepared
+
+    # Categories with one measure, a line over categories is left to LIDA
+    if categorical and not temporal and not ordinal and not labels and len(measures) == 1 and \
+            intent not in ("scatter", "line"):
+        y = measures[0]
+        if len(categorical) > 1:
+            x = " ".join(str(c) for c in categorical)
+            data = data.assign(**{x: data[categorical].astype(str).agg(" ".join, axis=1)})
+        else:
+            x = categorical[0]
+        kind = "pie" if intent == "pie" else "bar"
+        if kind == "pie" and (data[y] < 0).any():
+            return None, original
+        max_categories = PIE_MAX_SLICES if kind == "pie" else BAR_MAX_CATEGORIES
+        prepared = top_categories(data[[x, y]], x, max_categories)
+        if prepared is None:
+            # Averages, ratios and prices cannot be summed, only unique categories are drawn as they are
+            if kind == "pie" or data[x].duplicated().any():
+                return None, original
+            prepared = data[[x, y]].sort_values(y, ascending=False)
+        return ChartSpec(kind, x, y, f"{y} by {x}"), prepared
+
+    # Two measures
+    if len(measures) == 2 and not categorical and not temporal and intent in (None, "scatter"):
+        x, y = measures
+        return ChartSpec("scatter", x, y, f"{y} vs {x}"), data
+
+    # One measure on its own
+    if len(measures) == 1 and len(data.columns) == 1 and intent in (None, "hist"):
+        return ChartSpec("hist", measures[0], None, f"Distribution of {measures[0]}"), data
+
+    return None, original
+
+
+def chart_code(spec: ChartSpec) -> str:
+    """Generate the seaborn code that draws a chart from a dataframe named data."""
+    x, y, title = repr(spec.x), repr(spec.y), repr(spec.title)
+    if spec.kind == "bar":
+        body = [f"horizontal = len(data) > 10 or data[{x}].astype(str).str.len().max() > 12",
+                "if horizontal:",
+                f"    sns.barplot(data=data, x={y}, y=data[{x}].astype(str), ax=ax, color='#4c72b0', orient='h')",
+                f"    ax.set_ylabel({x})",
+                "else:",
+                f"    sns.barplot(data=data, x=data[{x}].astype(str), y={y}, ax=ax, color='#4c72b0')",
+                f"    ax.set_xlabel({x})"]
+    elif spec.kind == "line":
+        body = [f"sns.lineplot(data=data, x={x}, y={y}, ax=ax, sort=False, marker='o' if len(data) <= 50 else None)",
+                "fig.autofmt_xdate()"]
+    elif spec.kind == "pie":
+        body = [f"ax.pie(data[{y}], labels=data[{x}].astype(str), autopct='%1.1f%%', startangle=90)",
+                "ax.axis('equal')"]
+    elif spec.kind == "scatter":
+        body = [f"sns.scatterplot(data=data, x={x}, y={y}, ax=ax, alpha=0.7 if len(data) > 200 else 1.0)"]
+    else:
+        body = [f"sns.histplot(data=data, x={x}, ax=ax, bins='auto')"]
+    lines = ["import matplotlib.pyplot as plt",
+             "import seaborn as sns",
+             "",
+             "def plot(data):",
+             "    fig, ax = plt.subplots(figsize=(10, 6))"]
+    lines += ["    " + line for line in body]
+    lines += [f"    ax.set_title({title})",
+              "    fig.tight_layout()",
+              "    return fig",
+              "",
+              "chart = plot(data)"]
+    return "\n".join(lines)
+
+
+def render(data: pd.DataFrame, spec: ChartSpec) -> Tuple[str, bytes]:
+    """Draw a template chart.
+
+    Args:
+        data: The data prepared by infer_chart
+        spec: The chart to draw
+
+    Returns:
+        Tuple[str, bytes]: The code that was executed and the PNG image
+
+    Raises:
+        ChartRenderError: If the chart cannot be drawn in time
+    """
+    code = chart_code(spec)
+    return code, chart_pool.render(code, data)
+
+
+def _intent(prompt: str) -> Optional[str]:
+    """Return the chart type requested by keywords in the prompt, if any."""
+    text = (prompt or "").lower()
+    for intent, pattern in INTENT_KEYWORDS:
+        if re.search(pattern, text):
+            return intent
+    return None
@@ -0,0 +1,87 @@
+import pandas as pd
+
+from core import chart_templates
+from core.chart_templates import infer_chart, render
+
+
+def test_infers_common_chart_shapes():
+    sales = pd.DataFrame({"Country": ["USA", "Canada", "France"], "Sales": [523.06, 303.96, 195.1]})
+    assert infer_chart(sales, "total sales by country")[0].kind == "bar"
+    assert infer_chart(sales, "show the share of sales per country as a pie")[0].kind == "pie"
+
+    monthly = pd.DataFrame({"Month": pd.date_range("2021-01-01", periods=12, freq="MS"), "Sales": range(12)})
+    assert infer_chart(monthly, "sales over time")[0].kind == "line"
+
+    yearly = pd.DataFrame({"Year": [2021, 2022, 2023], "Sales": [1.0, 2.0, 3.0]})
+    assert infer_chart(yearly, "how did sales develop")[0].kind == "line"
+
+    tracks = pd.DataFrame({"Milliseconds": [1, 2, 3], "Bytes": [4, 5, 6]})
+    assert infer_chart(tracks, "relationship between track length and size")[0].kind == "scatter"
+
+
+def test_string_time_axes_are_drawn_as_lines():
+    # SQLite strftime returns strings, in whatever order the query produced them
+    yearly = pd.DataFrame({"Year": ["2022", "2024", "2023", "2025", "2021"], "Sales": [2.0, 4.0, 3.0, 5.0, 1.0]})
+    spec, prepared = infer_chart(yearly, "line chart of yearly sales")
+    assert spec.kind == "line"
+    assert prepared["Year"].tolist() == [2021, 2022, 2023, 2024, 2025]
+    assert infer_chart(yearly, "bar chart of sales per year")[0].kind == "bar"
+
+    months = pd.date_range("2021-01-01", periods=60, freq="MS").strftime("%Y-%m")
+    monthly = pd.DataFrame({"Month": months[::-1], "Sales": range(60)})
+    spec, prepared = infer_chart(monthly, "monthly sales")
+    assert spec.kind == "line"
+    assert len(prepared) == 60
+    assert prepared["Month"].is_monotonic_increasing
+
+    names = pd.DataFrame({"MonthName": ["Jan", "Feb", "Mar"], "Sales": [3.0, 1.0, 2.0]})
+    spec, prepared = infer_chart(names, "sales trend by month")
+    assert spec.kind == "line"
+    assert prepared["MonthName"].tolist() == ["Jan", "Feb", "Mar"]
+    spec, prepared = infer_chart(names, "sales by month")
+    assert spec.kind == "bar"
+    assert prepared["MonthName"].tolist() == ["Jan", "Feb", "Mar"]
+
+
+def test_line_requests_over_categories_are_left_to_lida():
+    sales = pd.DataFrame({"Country": ["USA", "Canada"], "Sales": [523.06, 303.96]})
+    assert infer_chart(sales, "line chart of sales by country")[0] is None
+
+
+def test_unusual_requests_are_left_to_lida():
+    sales = pd.DataFrame({"Country": ["USA", "Canada"], "Sales": [523.06, 303.96]})
+    assert infer_chart(sales, "draw a heatmap of sales")[0] is None
+
+    wide = pd.DataFrame({"Year": [2021], "Country": ["USA"], "Genre": ["Rock"], "Sales": [1.0]})
+    assert infer_chart(wide, "sales by year, country and genre")[0] is None
+
+
+def test_names_are_joined_and_tail_folded():
+    people = pd.DataFrame({"First": [f"f{i}" for i in range(20)], "Last": [f"l{i}" for i in range(20)],
+                           "Sales": range(20)})
+    spec, prepared = infer_chart(people, "pie chart of sales per employee")
+
+    assert spec.kind == "pie"
+    assert len(prepared) == chart_templates.PIE_MAX_SLICES
+    assert prepared[spec.x].iloc[0] == "f19 l19"
+    assert prepared[spec.y].sum() == sum(range(20))
+
+
+def test_averages_are_not_summed_or_folded():
+    averages = pd.DataFrame({"Country": [f"c{i}" for i in range(40)], "AvgTotal": [float(i) for i in range(40)]})
+    spec, prepared = infer_chart(averages, "average invoice total by country")
+    assert spec.kind == "bar"
+    assert len(prepared) == 40 and prepared["AvgTotal"].iloc[0] == 39.0
+
+    assert infer_chart(averages, "pie chart of the average total per country")[0] is None
+    repeated = pd.DataFrame({"Country": ["USA", "USA", "Canada"], "AvgTotal": [5.0, 7.0, 6.0]})
+    assert infer_chart(repeated, "average invoice total by country")[0] is None
+
+
+def test_render_returns_code_and_png():
+    sales = pd.DataFrame({"Country": ["USA", "Canada", "France"], "Sales": [523.06, 303.96, 195.1]})
+    spec, prepared = infer_chart(sales, "bar chart of sales by country")
+    code, image = render(prepared, spec)
+
+    assert "sns.barplot" in code
+    assert image.startswith(b"\x89PNG")
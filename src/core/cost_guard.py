@@ -0,0 +1,319 @@
+"""
+A pre-execution cost guard for the queries written by the model.
+
+Before a query runs, the database is asked to EXPLAIN it and the plan is
+turned into an estimate of the rows returned and the work done. PostgreSQL and
+MySQL report both in their JSON plans. SQLite only reports which tables are
+scanned, so its cost is the number of rows visited by the nested scans, taken
+from the table sizes. The sizes come from sqlite_stat1 when the database was
+ANALYZEd, otherwise from a count that stops above COST_GUARD_MAX_COST rows,
+and are counted again after COST_GUARD_TABLE_ROWS_TTL_SECONDS.
+
+A query that lists more rows than COST_GUARD_MAX_ROWS is rewritten with a
+LIMIT, which lets the database stop early. The result is only reported as
+limited when the limit was reached, estimates of filtered scans are often far
+too high. A query whose cost is still above
+COST_GUARD_MAX_COST is not run; the agent gets a structured observation with
+the estimate and suggestions instead, so it can reformulate the query.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import text
+from sqlglot import exp
+
+from core import sql_parsing
+from core.sql_engine import statement_connection
+
+logger = logging.getLogger(__name__)
+
+# SQLite plan lines that visit every row of a table or view, searches without a constraint included
+SQLITE_SCAN_PATTERN = re.compile(r"^(?:SCAN (\S+)|SEARCH (\S+)(?:(?!\().)*$)")
+
+
+@dataclass
+class CostEstimate:
+    """The planner's estimate for a query."""
+    rows: Optional[float]
+    cost: Optional[float]
+    full_scans: List[str] = field(default_factory=list)
+
+
+@dataclass
+class GuardDecision:
+    """What the cost guard does with a query."""
+    sql: str
+    action: str
+    estimate: Optional[CostEstimate] = None
+    message: str = ""
+    # The rows a limited result is cut to, the statement fetches one more to tell a truncated result apart
+    limit: Optional[int] = None
+
+    @property
+    def allowed(self) -> bool:
+        return self.action != "reject"
+
+
+class CostGuard:
+    """
+    Estimates the cost of queries with EXPLAIN and limits or rejects expensive ones.
+
+    The thresholds are in the planner's units: estimated rows for max_rows, and
+    for max_cost the total cost of PostgreSQL and MySQL plans or the rows
+    visited on SQLite. Dialects without a supported plan are not guarded.
+    """
+
+    def __init__(self, db: SQLDatabase, max_rows: int = None, max_cost: float = None, mode: str = None,
+                 table_rows_ttl_seconds: float = None):
+        """Initialize the CostGuard.
+
+        Args:
+            db: The database the queries run against
+            max_rows: The estimated rows above which a listing query gets a LIMIT, defaults to the
+                COST_GUARD_MAX_ROWS environment variable or 5000
+            max_cost: The estimated cost above which a query is rejected, defaults to the
+                COST_GUARD_MAX_COST environment variable or 10000000
+            mode: "rewrite" to limit and reject queries, "reject" to only reject them and "off",
+                defaults to the COST_GUARD_MODE environment variable or "rewrite"
+            table_rows_ttl_seconds: How long the SQLite table sizes are reused, defaults to the
+                COST_GUARD_TABLE_ROWS_TTL_SECONDS environment variable or 600
+        """
+        self.db = db
+        self.max_rows = max_rows if max_rows is not None else int(os.getenv("COST_GUARD_MAX_ROWS", "5000"))
+        self.max_cost = max_cost if max_cost is not None else float(os.getenv("COST_GUARD_MAX_COST", "10000000"))
+        self.mode = mode or os.getenv("COST_GUARD_MODE", "rewrite")
+        self.table_rows_ttl_seconds = table_rows_ttl_seconds if table_rows_ttl_seconds is not None else \
+            float(os.getenv("COST_GUARD_TABLE_ROWS_TTL_SECONDS", "600"))
+        self._table_rows: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def check(self, sql: str) -> GuardDecision:
+        """Decide whether a query runs as written, with a LIMIT, or not at all.
+
+        Args:
+            sql: The query written by the model
+
+        Returns:
+            GuardDecision: The query to run and the action taken, "run", "limit" or "reject"
+        """
+        if self.mode == "off":
+            return GuardDecision(sql, "run")
+        parsed = sql_parsing.parse(sql, self.db.dialect)
+        if parsed is None or not sql_parsing.is_read_only(parsed):
+            return GuardDecision(sql, "run")
+        try:
+            estimate = self.estimate(sql, parsed)
+        except Exception as e:
+            # The query itself reports the problem when it runs
+            logger.debug("EXPLAIN failed: %s", e)
+            return GuardDecision(sql, "run")
+        if estimate is None:
+            return GuardDecision(sql, "run")
+
+        decision = GuardDecision(sql, "run", estimate)
+        if (self.mode == "rewrite" and estimate.rows is not None and estimate.rows > self.max_rows
+                and is_listing(parsed)):
+            limited = sql_parsing.limit_rows(parsed, self.db.dialect, self.max_rows + 1)
+            if limited is not None:
+                limited_estimate = self.estimate(limited, sql_parsing.parse(limited, self.db.dialect))
+                decision = GuardDecision(limited, "limit", limited_estimate or estimate,
+                                         f"The query was estimated to return {estimate.rows:,.0f} rows and was "
+                                         f"limited to the first {self.max_rows} rows.", limit=self.max_rows)
+
+        cost = decision.estimate.cost
+        if cost is not None and cost > self.max_cost:
+            return GuardDecision(sql, "reject", decision.estimate, self._too_expensive(decision.estimate, parsed))
+        return decision
+
+    def estimate(self, sql: str, parsed: exp.Expression = None) -> Optional[CostEstimate]:
+        """Estimate the rows and cost of a query from its plan.
+
+        Args:
+            sql: The query
+            parsed: The parsed query, used to resolve SQLite table aliases
+
+        Returns:
+            Optional[CostEstimate]: The estimate, or None if the dialect is not supported
+        """
+        dialect = self.db.dialect
+        if dialect == "postgresql":
+            return parse_postgres_plan(self._explain(f"EXPLAIN (FORMAT JSON) {sql}"))
+        if dialect in ("mysql", "mariadb"):
+            return parse_mysql_plan(self._explain(f"EXPLAIN FORMAT=JSON {sql}"))
+        if dialect == "sqlite":
+            return self._estimate_sqlite(self._explain(f"EXPLAIN QUERY PLAN {sql}", all_rows=True), parsed)
+        return None
+
+    def _explain(self, statement: str, all_rows: bool = False) -> Any:
+        with statement_connection(self.db) as connection:
+            rows = connection.execute(text(statement)).fetchall()
+        if all_rows:
+            return [tuple(row) for row in rows]
+        plan = rows[0][0]
+        return json.loads(plan) if isinstance(plan, (str, bytes)) else plan
+
+    def _estimate_sqlite(self, plan: List[tuple], parsed: Optional[exp.Expression]) -> CostEstimate:
+        """Estimate the rows visited by the nested scans of an EXPLAIN QUERY PLAN.
+
+        Scans under the same parent are nested loops and multiply, separate
+        subplans add up. Index searches are counted as one row.
+        """
+        aliases = table_aliases(parsed) if parsed is not None else {}
+        largest = max((self._rows(table) for table in set(aliases.values())), default=0)
+        loops: Dict[int, List[float]] = {}
+        full_scans = []
+        for row in plan:
+            parent, detail = row[1], str(row[-1])
+            match = SQLITE_SCAN_PATTERN.match(detail)
+            if match is None:
+                continue
+            name = (match.group(1) or match.group(2)).lower()
+            table = aliases.get(name, name)
+            if table in self._known_tables():
+                rows = self._rows(table)
+                full_scans.append(table)
+            else:
+                # Views, CTEs and subqueries are estimated as the largest table of the query
+                rows = largest
+            loops.setdefault(parent, []).append(max(rows, 1))
+        cost = float(sum(math.prod(scans) for scans in loops.values()))
+
+        limit = literal_limit(parsed) if parsed is not None else None
+        if limit is not None and is_listing(parsed) and not parsed.args.get("order"):
+            # Without sorting, the scans stop after the first rows
+            cost = min(cost, float(limit))
+        rows = cost if parsed is not None and is_listing(parsed) else None
+        return CostEstimate(rows=rows, cost=cost, full_scans=sorted(set(full_scans)))
+
+    def _known_tables(self) -> set:
+        return {name.lower() for name in self.db.get_usable_table_names()}
+
+    def _rows(self, table: str) -> int:
+        """Return the row count of a table, reused for table_rows_ttl_seconds.
+
+        The count is read from sqlite_stat1 when the database was ANALYZEd.
+        Otherwise the rows are counted up to max_cost, a scan of more rows
+        makes any query that visits it too expensive anyway.
+        """
+        with self._lock:
+            count, counted_at = self._table_rows.get(table, (0, None))
+            if counted_at is not None and time.monotonic() - counted_at < self.table_rows_ttl_seconds:
+                return count
+        if table not in self._known_tables():
+            return 0
+        quote = self.db._engine.dialect.identifier_preparer.quote
+        prefix = f"{quote(self.db._schema)}." if self.db._schema else ""
+        with statement_connection(self.db) as connection:
+            has_stats = connection.execute(
+                text(f"SELECT 1 FROM {prefix}sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")).first()
+            stat = connection.execute(
+                text(f"SELECT stat FROM {prefix}sqlite_stat1 WHERE lower(tbl) = :table LIMIT 1"),
+                {"table": table}).scalar() if has_stats else None
+            if stat:
+                count = int(str(stat).split()[0])
+            else:
+                count = connection.execute(
+                    text(f"SELECT COUNT(*) FROM (SELECT 1 FROM {prefix}{quote(table)} LIMIT :limit)"),
+                    {"limit": int(self.max_cost) + 1}).scalar() or 0
+        with self._lock:
+            self._table_rows[table] = (count, time.monotonic())
+        return count
+
+    def _too_expensive(self, estimate: CostEstimate, parsed: exp.Expression) -> str:
+        """Build the observation returned to the agent for a rejected query."""
+        suggestions = ["Filter the large tables with a WHERE clause on indexed columns"]
+        if is_listing(parsed):
+            suggestions.append("Aggregate the rows with GROUP BY instead of listing them")
+        if len(estimate.full_scans) > 1:
+            suggestions.append("Check that every joined table has a join condition")
+        suggestions.append("Add a LIMIT if only the first rows are needed")
+        observation = {
+            "error": "QUERY_TOO_EXPENSIVE",
+            "estimated_rows": round(estimate.rows) if estimate.rows is not None else None,
+            "estimated_cost": round(estimate.cost),
+            "max_cost": round(self.max_cost),
+            "full_scans": estimate.full_scans,
+            "suggestions": suggestions,
+        }
+        return "The query was not run because it is too expensive. Rewrite it and try again.\n" + \
+            json.dumps(observation)
+
+
+def parse_postgres_plan(plan: Any) -> CostEstimate:
+    """Read the estimate of an EXPLAIN (FORMAT JSON) plan of PostgreSQL."""
+    root = plan[0]["Plan"]
+    full_scans = []
+
+    def walk(node: Dict[str, Any]) -> None:
+        if node.get("Node Type") == "Seq Scan" and node.get("Relation Name"):
+            full_scans.append(node["Relation Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(root)
+    return CostEstimate(rows=float(root.get("Plan Rows", 0)), cost=float(root.get("Total Cost", 0)),
+                        full_scans=sorted(set(full_scans)))
+
+
+def parse_mysql_plan(plan: Any) -> CostEstimate:
+    """Read the estimate of an EXPLAIN FORMAT=JSON plan of MySQL."""
+    block = plan["query_block"]
+    tables = []
+
+    def walk(node: Any) -> None:
+        if isinstance(node, dict):
+            if "table_name" in node and "access_type" in node:
+                tables.append(node)
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(block)
+    rows = max((float(table.get("rows_produced_per_join", 0)) for table in tables), default=None)
+    cost = float(block.get("cost_info", {}).get("query_cost", 0))
+    full_scans = sorted({table["table_name"] for table in tables if table.get("access_type") == "ALL"})
+    return CostEstimate(rows=rows, cost=cost, full_scans=full_scans)
+
+
+def is_listing(expression: exp.Expression) -> bool:
+    """Return True if a query returns table rows rather than aggregates."""
+    select = expression if isinstance(expression, exp.Select) else expression.find(exp.Select)
+    if select is None:
+        return False
+    if select.args.get("group") or select.args.get("distinct"):
+        return False
+    return not any(projection.find(exp.AggFunc) for projection in select.expressions)
+
+
+def literal_limit(expression: exp.Expression) -> Optional[int]:
+    """Return the row count of a literal LIMIT of a query, if any."""
+    limit = expression.args.get("limit")
+    count = limit.expression if isinstance(limit, exp.Limit) else None
+    return int(count.name) if isinstance(count, exp.Literal) and count.is_int else None
+
+
+def table_aliases(expression: exp.Expression) -> Dict[str, str]:
+    """Map the lower-cased aliases and names of the tables of a query to their table names."""
+    aliases = {}
+    for table in expression.find_all(exp.Table):
+        if table.name:
+            aliases[table.name.lower()] = table.name.lower()
+            aliases[table.alias_or_name.lower()] = table.name.lower()
+    return aliases
+
+
+def decision_summary(decision: GuardDecision) -> Dict[str, Any]:
+    """Return the attributes of a decision recorded on the query span."""
+    estimate = asdict(decision.estimate) if decision.estimate is not None else {}
+    return {"guard_action": decision.action, "estimated_rows": estimate.get("rows"),
+            "estimated_cost": estimate.get("cost")}
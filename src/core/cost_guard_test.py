@@ -0,0 +1,99 @@
+import json
+import pathlib
+import sqlite3
+
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import create_engine, event
+
+from core.cost_guard import CostGuard, parse_postgres_plan
+from core.result_store import result_store
+from core.sql_engine import create_database
+from core.sql_tools import QueryResultSQLDatabaseTool
+
+DB_URI = "sqlite:///" + str(pathlib.Path(__file__).parent.parent.resolve() / "chinook.db")
+
+
+def test_large_listings_are_limited_and_cartesian_aggregates_rejected():
+    guard = CostGuard(create_database(DB_URI), max_rows=1000, max_cost=1_000_000)
+
+    listing = guard.check("SELECT * FROM InvoiceLine")
+    assert listing.action == "limit"
+    assert listing.sql == "SELECT * FROM InvoiceLine LIMIT 1001"
+    assert listing.limit == 1000
+    assert "2,240 rows" in listing.message
+
+    aggregate = guard.check("SELECT BillingCountry, SUM(Total) FROM Invoice GROUP BY BillingCountry")
+    assert aggregate.action == "run"
+    assert aggregate.estimate.cost == 412
+
+    cartesian = guard.check("SELECT COUNT(*) FROM InvoiceLine il, Track t")
+    assert not cartesian.allowed
+    observation = json.loads(cartesian.message.splitlines()[-1])
+    assert observation["error"] == "QUERY_TOO_EXPENSIVE"
+    assert observation["estimated_cost"] == 2240 * 3503
+    assert observation["full_scans"] == ["invoiceline", "track"]
+
+
+def test_query_tool_returns_the_observation_instead_of_running_the_query():
+    tool = QueryResultSQLDatabaseTool(db=create_database(DB_URI),
+                                      cost_guard=CostGuard(create_database(DB_URI), max_rows=100, max_cost=1_000_000))
+    # Sorting the cartesian product is expensive even with a LIMIT
+    assert tool.invoke({"query": "SELECT t.Name FROM Track t, InvoiceLine il ORDER BY t.Name"}).startswith(
+        "Error: The query was not run because it is too expensive")
+
+    output = tool.invoke({"query": "SELECT Name FROM Track"})
+    assert "limited to the first 100 rows" in output
+    assert result_store.num_rows(result_store.find_handle(output)) == 100
+
+
+def test_results_below_the_limit_are_not_reported_as_limited():
+    """Filters on unindexed columns are estimated at the table size on SQLite."""
+    guard = CostGuard(create_database(DB_URI), max_rows=1000, max_cost=1_000_000)
+    tool = QueryResultSQLDatabaseTool(db=create_database(DB_URI), cost_guard=guard)
+    query = "SELECT Name, Milliseconds FROM Track WHERE Milliseconds > 5000000"
+    assert guard.check(query).action == "limit"
+
+    output = tool.invoke({"query": query})
+    assert "limited" not in output
+    assert result_store.num_rows(result_store.find_handle(output)) == 2
+
+
+def test_postgres_plans_report_rows_cost_and_sequential_scans():
+    plan = [{"Plan": {"Node Type": "Hash Join", "Plan Rows": 120000, "Total Cost": 5400.5, "Plans": [
+        {"Node Type": "Seq Scan", "Relation Name": "invoice_line", "Plan Rows": 120000},
+        {"Node Type": "Index Scan", "Relation Name": "track", "Plan Rows": 1}]}}]
+    estimate = parse_postgres_plan(plan)
+    assert (estimate.rows, estimate.cost, estimate.full_scans) == (120000, 5400.5, ["invoice_line"])
+
+
+def _sales_database(tmp_path, rows):
+    """A database whose tables live in the attached schema sales."""
+    sales = sqlite3.connect(tmp_path / "sales.db")
+    sales.execute("create table invoice (id integer, total real)")
+    sales.executemany("insert into invoice values (?, ?)", [(i, i) for i in range(rows)])
+    sales.commit()
+    engine = create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+    event.listen(engine, "connect", lambda connection, record: connection.execute(
+        f"ATTACH DATABASE '{tmp_path / 'sales.db'}' AS sales"))
+    return SQLDatabase(engine, schema="sales"), sales
+
+
+def test_table_sizes_are_read_from_the_schema_and_bounded(tmp_path):
+    db, sales = _sales_database(tmp_path, rows=50)
+    # Tables above max_cost are only counted up to it
+    assert CostGuard(db, max_cost=10)._rows("invoice") == 11
+    assert CostGuard(db, max_cost=10).check("SELECT SUM(total) FROM invoice").action == "reject"
+
+    guard = CostGuard(db)
+    assert guard._rows("invoice") == 50
+    sales.execute("insert into invoice values (50, 50)")
+    sales.commit()
+    assert guard._rows("invoice") == 50
+    guard.table_rows_ttl_seconds = 0
+    assert guard._rows("invoice") == 51
+
+    # The statistics of an ANALYZEd database are used instead of counting
+    sales.execute("analyze")
+    sales.execute("update sqlite_stat1 set stat = '1000' where tbl = 'invoice'")
+    sales.commit()
+    assert guard._rows("invoice") == 1000
@@ -0,0 +1,200 @@
+"""
+Reduction of large query results before they are charted or shown to the model.
+
+Charts never need more points than pixels, so results above a point budget are
+reduced with vectorized pandas and NumPy operations: ordered series are
+downsampled with Largest-Triangle-Three-Buckets (LTTB), which keeps the visual
+shape, categorical results with additive measures are aggregated per category
+with the long tail folded into "Other", and anything else is sampled uniformly.
+"""
+import os
+import re
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# The maximum number of rows passed to the chart renderer
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "2000"))
+# The maximum number of categories shown before the rest is folded into "Other"
+CHART_MAX_CATEGORIES = int(os.getenv("CHART_MAX_CATEGORIES", "25"))
+OTHER_LABEL = "Other"
+# Words in the names of measures that cannot be summed across rows, e.g. AvgTotal or share_pct
+NON_ADDITIVE_WORDS = {"avg", "average", "mean", "median", "ratio", "rate", "percent", "percentage", "pct",
+                      "share", "price", "min", "max", "minimum", "maximum"}
+
+
+# Formats of the dates SQL returns as strings, e.g. from SQLite strftime('%Y-%m'), None for bare years
+ISO_TIME_FORMATS = [(r"\d{4}", None), (r"\d{4}-\d{2}", "%Y-%m"), (r"\d{4}-\d{2}-\d{2}", "%Y-%m-%d"),
+                    (r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?", "ISO8601")]
+
+
+def time_axis(values: pd.Series) -> Optional[pd.Series]:
+    """Parse a string column holding ISO dates or years.
+
+    Args:
+        values: The column
+
+    Returns:
+        Optional[pd.Series]: The years as numbers or the dates as datetimes, None if the column holds other values
+    """
+    if pd.api.types.is_numeric_dtype(values) or not pd.api.types.is_string_dtype(values):
+        return None
+    text = values.dropna().astype(str)
+    if text.empty:
+        return None
+    for pattern, time_format in ISO_TIME_FORMATS:
+        if not text.str.fullmatch(pattern).all():
+            continue
+        if time_format is None:
+            years = pd.to_numeric(values)
+            return years if years.between(1800, 2200).all() else None
+        try:
+            return pd.to_datetime(values, format=time_format)
+        except (ValueError, TypeError):
+            return None
+    return None
+
+
+def is_additive(column: str) -> bool:
+    """Return False for measures whose name says they are averages, ratios, percentages, prices or extremes."""
+    words = [word.lower() for word in re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])", str(column))]
+    return not NON_ADDITIVE_WORDS.intersection(words)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Select the indices of the points that best keep the shape of a series.
+
+    Args:
+        x: The x values, sorted ascending
+        y: The y values
+        threshold: The number of points to keep
+
+    Returns:
+        np.ndarray: The sorted indices of the selected points, including the first and last point
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1])
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Bucket boundaries for the points between the first and the last one
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        next_end = max(next_end, next_start + 1)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Twice the area of the triangles formed with the previous point and the next bucket's average
+        areas = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def top_categories(data: pd.DataFrame, category: str, max_categories: int = None) -> Optional[pd.DataFrame]:
+    """Aggregate the numeric columns per category and fold the smallest categories into "Other".
+
+    Only additive measures are summed, see is_additive. Data with other measures
+    cannot be aggregated and is not folded.
+
+    Args:
+        data: The data to aggregate
+        category: The categorical column
+        max_categories: The number of categories to keep, defaults to CHART_MAX_CATEGORIES
+
+    Returns:
+        Optional[pd.DataFrame]: One row per kept category plus an "Other" row, largest first,
+        or None if a measure is not additive
+    """
+    max_categories = max_categories or CHART_MAX_CATEGORIES
+    numeric = [column for column in data.columns
+               if column != category and pd.api.types.is_numeric_dtype(data[column])]
+    if not all(is_additive(column) for column in numeric):
+        return None
+    if numeric:
+        grouped = data.groupby(category, sort=False, dropna=False)[numeric].sum()
+    else:
+        grouped = data.groupby(category, sort=False, dropna=False).size().to_frame("count")
+    grouped = grouped.sort_values(grouped.columns[0], ascending=False)
+    if len(grouped) > max_categories:
+        kept = grouped.iloc[:max_categories - 1]
+        other = grouped.iloc[max_categories - 1:].sum().to_frame(OTHER_LABEL).T
+        grouped = pd.concat([kept, other])
+    return grouped.rename_axis(category).reset_index()
+
+
+def reduce_for_chart(data: pd.DataFrame, max_points: int = None) -> Tuple[pd.DataFrame, Optional[str]]:
+    """Reduce a result to at most max_points rows for charting.
+
+    Args:
+        data: The result to reduce
+        max_points: The point budget, defaults to CHART_MAX_POINTS
+
+    Returns:
+        Tuple[pd.DataFrame, Optional[str]]: The reduced data and a description of the reduction,
+        or the data unchanged and None if it is within the budget
+    """
+    max_points = max_points or CHART_MAX_POINTS
+    if len(data) <= max_points:
+        return data, None
+
+    # Dates returned as strings are a time axis, not categories
+    parsed = {column: time_axis(data[column]) for column in data.columns}
+    data = data.assign(**{column: values for column, values in parsed.items() if values is not None})
+    numeric = [column for column in data.columns if pd.api.types.is_numeric_dtype(data[column])]
+    temporal = [column for column in data.columns if pd.api.types.is_datetime64_any_dtype(data[column])]
+    categorical = [column for column in data.columns if column not in numeric and column not in temporal]
+
+    x = temporal[0] if temporal else (numeric[0] if len(numeric) > 1 and not categorical else None)
+    y = next((column for column in numeric if column != x), None)
+    if x is not None and y is not None:
+        ordered = data.dropna(subset=[x, y]).sort_values(x, kind="stable").reset_index(drop=True)
+        x_values = ordered[x].to_numpy(dtype=np.int64) if x in temporal else ordered[x].to_numpy()
+        indices = lttb(x_values, ordered[y].to_numpy(), max_points)
+        return (ordered.iloc[indices].reset_index(drop=True),
+                f"downsampled from {len(data)} to {len(indices)} rows with LTTB on {x} and {y}")
+
+    if len(categorical) == 1:
+        reduced = top_categories(data, categorical[0])
+        if reduced is not None and len(reduced) <= max_points:
+            return reduced, f"aggregated {len(data)} rows by {categorical[0]} into {len(reduced)} rows"
+
+    reduced = data.sample(n=max_points, random_state=0).sort_index()
+    return reduced, f"uniformly sampled {max_points} of {len(data)} rows"
+
+
+def preview(data: pd.DataFrame, sample_rows: int = 20) -> str:
+    """Describe a large result for the model with a sample of rows and summary statistics.
+
+    Args:
+        data: The result
+        sample_rows: The number of leading rows to include
+
+    Returns:
+        str: The row count, the sample as CSV and per-column statistics
+    """
+    lines = [f"The query returned {len(data)} rows, only the first {sample_rows} are shown.",
+             data.head(sample_rows).to_csv(index=False).strip(), "", "Column statistics:"]
+    for column in data.columns:
+        values = data[column]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            lines.append(f"{column}: min={values.min()}, max={values.max()}, mean={values.mean():.4g}, "
+                         f"sum={values.sum():.6g}, nulls={int(values.isna().sum())}")
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            lines.append(f"{column}: min={values.min()}, max={values.max()}, nulls={int(values.isna().sum())}")
+        else:
+            top = values.value_counts().head(5)
+            common = ", ".join(f"{value} ({count})" for value, count in top.items())
+            lines.append(f"{column}: {values.nunique()} distinct, most common: {common}, "
+                         f"nulls={int(values.isna().sum())}")
+    return "\n".join(lines)
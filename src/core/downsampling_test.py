@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from core.downsampling import OTHER_LABEL, is_additive, lttb, preview, reduce_for_chart, top_categories
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(10000)
+    y = np.zeros(10000)
+    y[5000] = 100.0
+    indices = lttb(x, y, 100)
+
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 9999
+    assert 5000 in indices
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_time_series_is_downsampled():
+    data = pd.DataFrame({"day": pd.date_range("2020-01-01", periods=50000, freq="min"),
+                         "value": np.sin(np.arange(50000) / 100)})
+    reduced, reduction = reduce_for_chart(data, max_points=500)
+
+    assert len(reduced) == 500
+    assert "LTTB" in reduction
+    assert reduced["day"].is_monotonic_increasing
+
+
+def test_categories_are_aggregated_with_other():
+    data = pd.DataFrame({"country": [f"c{i % 100}" for i in range(5000)], "total": 1.0})
+    reduced, reduction = reduce_for_chart(data, max_points=1000)
+
+    assert len(reduced) == 25
+    assert reduced["country"].iloc[-1] == OTHER_LABEL
+    assert reduced["total"].sum() == 5000
+
+
+def test_non_additive_measures_are_not_folded():
+    assert is_additive("Total") and is_additive("InvoiceCount")
+    assert not any(is_additive(name) for name in ["AvgTotal", "average_sales", "UnitPrice", "share_pct"])
+
+    data = pd.DataFrame({"country": [f"c{i % 100}" for i in range(5000)], "AvgTotal": 1.0})
+    assert top_categories(data, "country") is None
+    reduced, reduction = reduce_for_chart(data, max_points=500)
+    assert "sampled" in reduction
+    assert OTHER_LABEL not in set(reduced["country"])
+
+
+def test_string_dates_are_downsampled_as_time_series():
+    days = pd.date_range("2020-01-01", periods=5000, freq="D").strftime("%Y-%m-%d")
+    data = pd.DataFrame({"day": days, "value": np.sin(np.arange(5000) / 100)})
+    reduced, reduction = reduce_for_chart(data, max_points=500)
+
+    assert "LTTB" in reduction
+    assert OTHER_LABEL not in set(reduced["day"].astype(str))
+
+
+def test_small_results_are_unchanged():
+    data = pd.DataFrame({"a": [1, 2, 3]})
+    assert reduce_for_chart(data) == (data, None)
+
+
+def test_preview_shows_sample_and_statistics():
+    data = pd.DataFrame({"country": ["USA", "Canada"] * 500, "total": range(1000)})
+    text = preview(data, sample_rows=5)
+
+    assert text.startswith("The query returned 1000 rows, only the first 5 are shown.")
+    assert "total: min=0, max=999" in text
+    assert "country: 2 distinct" in text
+    assert len(text.splitlines()) < 15
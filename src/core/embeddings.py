@@ -0,0 +1,63 @@
+import hashlib
+import re
+from typing import List
+
+import numpy as np
+
+# Words that do not change what a BI question asks for
+STOPWORDS = {
+    "a", "an", "the", "of", "by", "per", "for", "each", "every", "in", "on", "to", "and", "with",
+    "me", "show", "give", "list", "display", "what", "which", "is", "are", "was", "were", "please",
+    "can", "you", "i", "want", "see", "get", "find", "tell", "how", "do", "does", "all", "across",
+}
+
+
+class HashingEmbedder:
+    """
+    A local, dependency-free text embedder based on hashed word and character n-grams.
+
+    Texts are lower-cased, stop words are removed and the remaining words and
+    their character trigrams are hashed into a fixed size vector that is L2
+    normalized, so the dot product of two embeddings is their cosine similarity.
+    It implements the embed_query/embed_documents interface of LangChain
+    embeddings, which can be used instead where a model is available.
+    """
+
+    def __init__(self, dimensions: int = 1024):
+        """Initialize the HashingEmbedder.
+
+        Args:
+            dimensions: The size of the embedding vectors
+        """
+        self.dimensions = dimensions
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single text."""
+        return self._embed(text).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts."""
+        return [self._embed(text).tolist() for text in texts]
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Split a text into lower-cased words without stop words, splitting camel and snake case."""
+        text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+        words = re.findall(r"[a-z0-9]+", text.lower())
+        return [word for word in words if word not in STOPWORDS]
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in self.tokenize(text):
+            self._add(vector, "w:" + word, 1.0)
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                self._add(vector, "c:" + padded[i:i + 3], 0.5)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _add(self, vector: np.ndarray, feature: str, weight: float) -> None:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        sign = 1.0 if value & 1 else -1.0
+        vector[(value >> 1) % self.dimensions] += sign * weight
@@ -2,18 +2,39 @@
 #Name the employees and their total sales across years.  draw a bar chart of the results
 import os
 import json
+import logging
 import pathlib
-from typing import Dict, Any, List, Optional, Iterator
+import threading
+from typing import Dict, Any, List, Optional, Iterator, Set
 
 from dotenv import load_dotenv
-from langchain import hub
 from langchain.chat_models.base import BaseChatModel
 from langchain_community.utilities.sql_database import SQLDatabase
 from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
-from langgraph.checkpoint.memory import InMemorySaver
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from langgraph.prebuilt import create_react_agent
+from core import sql_parsing
+from core.cancellation import cancellation
+from core.chart_pool import chart_pool
+from core.memory import ConversationMemory, conversation_memory, create_checkpointer
+from core.parallel_tools import TOOL_RESULT_KEY, ParallelToolNode
+from core.profile_catalog import ProfileCatalog, use_catalog
+from core.prompt_cache import format_system_prompt
+from core.question_cache import AnsweredQuestion, QuestionCache
+from core.result_store import result_store
+from core.schema_index import SchemaIndex
+from core.sql_engine import create_database, database_namespace
+from core.sql_tools import QueryResultSQLDatabaseTool, SQLTools
+from core.tracing import TracingCallbackHandler, tracer
 from core.viz_tools import VizTools
 
+logger = logging.getLogger(__name__)
+
+# The analysis and visualization tools only depend on the query result and run concurrently when called together
+PARALLEL_TOOLS_INSTRUCTIONS = (" analyze_data, convert_to_pandas and visualize_pandas_dataframe only depend on the "
+                               "output of sql_db_query and not on each other, call the ones the question needs "
+                               "together in one step, passing each the output of sql_db_query.")
+
 
 class GenBIReactAgent:
     """A class representing a Generative BI React Agent.
@@ -22,39 +43,69 @@ class GenBIReactAgent:
     executes them, and provides visualizations when appropriate.
     """
     
-    def __init__(self, db_uri: str = None, model_name: str = "openai:gpt-4.1"):
+    def __init__(self, db_uri: str = None, model_name: str = "openai:gpt-4.1", db: SQLDatabase = None,
+                 top_k: int = 30, answer_cache: Optional[QuestionCache] = None,
+                 schema_top_k: Optional[int] = 5,
+                 memory: Optional[ConversationMemory] = conversation_memory, llm: BaseChatModel = None,
+                 engine_options: Optional[Dict[str, Any]] = None, profile_columns: bool = True):
         """Initialize the GenBIReactAgent.
         
         Args:
             db_uri: The database URI to connect to
             model_name: The name of the language model to use
+            db: An existing database connection to share, takes precedence over db_uri
+            top_k: The default maximum number of rows the agent's queries should return
+            answer_cache: The cache of answered questions to replay, e.g. question_cache, None to always
+                run the agent
+            schema_top_k: The number of relevant tables whose schema is put in the prompt for each
+                question, None to let the agent discover the schema with its tools
+            memory: The policy bounding the messages each conversation keeps, None to keep them all
+            llm: An existing chat model to use, takes precedence over model_name
+            engine_options: Options of the engine created for db_uri, e.g. pool_size or
+                statement_timeout_seconds, see core.sql_engine.create_database
+            profile_columns: Whether to describe columns with the profiles of the column profile
+                catalog, profiled by `python -m core.profile_catalog`. With PROFILE_ON_START=1 stale
+                tables are also profiled in the background on start
         """
         # Initialize database connection
-        if db_uri is None:
-            DB_USER = os.getenv("DB_USER", "postgres")
-            DB_PASSWORD = os.getenv("DB_PASSWORD", "password12")
-            DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
-            DB_PORT = os.getenv("DB_PORT", "5432")
-            DB_NAME = os.getenv("DB_NAME", "postgres")
-            db_uri = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-        print(db_uri)
-        self.db = SQLDatabase.from_uri(db_uri)
+        if db is None:
+            db_uri = db_uri or default_db_uri()
+            db = create_database(db_uri, **(engine_options or {}))
+        self.db = db
+        logger.info("Connected to %s", self.db._engine.url.render_as_string(hide_password=True))
         
+        self.answer_cache = answer_cache
+        self.memory = memory
+
         # Initialize language model
-        self.llm = self._init_chat_model(model_name)
+        self.llm = llm if llm is not None else self._init_chat_model(model_name)
         
         # Initialize SQL toolkit
         self.toolkit = SQLDatabaseToolkit(db=self.db, llm=self.llm)
         
-        # Set up the agent prompt
-        prompt_template = hub.pull("langchain-ai/sql-agent-system-prompt")
-        assert len(prompt_template.messages) == 1
+        # Set up the agent prompt from the local prompt cache
         suffix = " Do not attempt to integrate any images or charts generated into your final response."
-        self.system_message = prompt_template.format(dialect="PostgreSQL", top_k=30) + suffix
-        print(self.system_message)
+        self.system_message = format_system_prompt(self.db.dialect, top_k, schema_in_prompt=bool(schema_top_k)) + \
+            suffix + PARALLEL_TOOLS_INSTRUCTIONS
+        logger.debug(self.system_message)
         
-        # Initialize visualization tools
+        # Index the schema so that only the relevant tables are described in the prompt
+        self.schema_top_k = schema_top_k
+        self.schema_index = None
+        if schema_top_k:
+            self.schema_index = SchemaIndex(self.db)
+            self.schema_index.build()
+
+        # Column profiles replace sample rows and LLM enrichment, see core.profile_catalog
+        self.profile_catalog = None
+        if profile_columns:
+            self.profile_catalog = ProfileCatalog(self.db)
+            if os.getenv("PROFILE_ON_START", "0") == "1":
+                threading.Thread(target=self.profile_catalog.refresh, name="profile-refresh", daemon=True).start()
+
+        # Initialize visualization tools, the chart workers warm up in the background
         VizTools.init(self.llm)
+        chart_pool.start()
         
         # Create agent executor
         self.react_agent = self._create_react_agent()
@@ -65,10 +116,30 @@ class GenBIReactAgent:
         return init_chat_model(model_name)
     
     def _create_react_agent(self):
-        """Create and return the agent executor with all necessary tools."""
-        tools = self.toolkit.get_tools() + VizTools.get_tools()
-        return create_react_agent(self.llm, tools, prompt=self.system_message,
-                                  checkpointer=(InMemorySaver()), debug=False)
+        """Create and return the agent executor with all necessary tools.
+
+        The tool calls of a step run concurrently, see core.parallel_tools.
+        """
+        tools = ParallelToolNode(SQLTools.get_tools(self.toolkit, self.schema_index, self.profile_catalog) +
+                                 VizTools.get_tools())
+        prompt = self._build_prompt if self.schema_index is not None else self.system_message
+        return create_react_agent(self.llm, tools, prompt=prompt, pre_model_hook=self.memory,
+                                  checkpointer=create_checkpointer(), debug=False)
+
+    def _build_prompt(self, state: Dict[str, Any]) -> List[Any]:
+        """Build the model input with the schema of the tables relevant to the latest question."""
+        messages = state["messages"]
+        question = next((m.content for m in reversed(messages) if getattr(m, 'type', None) == 'human'), "")
+        tables = self.schema_index.retrieve(str(question), k=self.schema_top_k)
+        system_message = (self.system_message +
+                          "\n\nThe tables most relevant to the question are listed below as "
+                          "table(column type, ...) with primary keys (PK) and foreign keys (->).\n" +
+                          self.schema_index.describe(tables))
+        hints = self.profile_catalog.hints(tables) if self.profile_catalog is not None else ""
+        if hints:
+            system_message += ("\n\nColumn profiles of these tables, with value ranges, distinct counts and "
+                               "frequent values to use in filters:\n" + hints)
+        return [SystemMessage(content=system_message)] + list(messages)
     
     def _process_message(self, message, bi_agent_callback_handler):
         """Process a tool message and invoke appropriate callbacks.
@@ -92,12 +163,15 @@ class GenBIReactAgent:
                 self._process_data(bi_agent_callback_handler, message)
                         
         except Exception as e:
-            print(f"Error processing message: {e}")
+            logger.exception(f"Error processing message: {e}")
 
     def _process_data(self, bi_agent_callback_handler, message):
         if hasattr(bi_agent_callback_handler, 'process_data'):
             if hasattr(message, 'content') and message.content is not None:
-                bi_agent_callback_handler.process_data(str(message.content))
+                # Hand over the result handle, the rows stay in the result store
+                handle = result_store.find_handle(str(message.content))
+                content = f"result_handle: {handle}" if handle is not None else str(message.content)
+                bi_agent_callback_handler.process_data(content)
 
     def _process_chart(self, bi_agent_callback_handler, message):
         try:
@@ -107,9 +181,11 @@ class GenBIReactAgent:
             if 'code' in content_dict and hasattr(bi_agent_callback_handler, 'process_chart_code'):
                 bi_agent_callback_handler.process_chart_code(str(content_dict['code']))
         except json.JSONDecodeError:
-            print("Failed to decode message content as JSON")
+            logger.warning("Failed to decode message content as JSON")
 
     def _process_sql(self, bi_agent_callback_handler, message):
+        if str(message.content).startswith("Error:"):
+            return
         if hasattr(bi_agent_callback_handler, 'process_sql'):
             bi_agent_callback_handler.process_sql(str(message.content))
 
@@ -127,37 +203,271 @@ class GenBIReactAgent:
         input_dict = {"messages": [("user", query)]}
         last_message = None
 
-        # Run the agent
-        config = {
+        with tracer.span("agent.request", "request", question=query, thread_id=session_id) as root, \
+                cancellation.request(session_id) as token, use_catalog(self.profile_catalog):
+            config = self._config(session_id, root)
+            self._close_interrupted_turn(config)
+            namespace = database_namespace(self.db)
+            cached = self.answer_cache.lookup(namespace, query) if self.answer_cache is not None else None
+            root.set(answer_cache_hit=cached is not None)
+            if cached is not None:
+                answer = self._replay(cached, query, config, bi_agent_callback_handler)
+            else:
+                turn = AnsweredQuestion(namespace=namespace, question=query, sql="", answer="")
+                handled: Set[str] = set()
+                # Only the messages added by each step are emitted, not the whole history
+                for mode, event in self.react_agent.stream(input_dict, config=config,
+                                                           stream_mode=["updates", "custom"]):
+                    if token.cancelled:
+                        break
+                    for message in self._stream_messages(mode, event, handled):
+                        last_message = message
+                        self._handle_message(message, turn, bi_agent_callback_handler)
+                answer = self._cancelled(config, root) if token.cancelled else \
+                    self._finish(last_message, turn, bi_agent_callback_handler)
+
+        self._report(root, bi_agent_callback_handler)
+        return answer
+
+    async def astream(self, query: str, session_id: str = None, bi_agent_callback_handler=None) -> str:
+        """Process a query asynchronously, emitting the answer token by token.
+
+        New messages are handled once, as each graph step completes. Tokens of the
+        model's answers are passed with their message id to the process_token
+        method of the callback handler as they are generated, before the complete
+        message is processed.
+
+        Args:
+            query: The natural language query to process
+            session_id: Optional session ID for conversation tracking
+            bi_agent_callback_handler: Optional callback handler for BI agent events
+
+        Returns:
+            str: The content of the last message, or an empty string if no message or content
+        """
+        input_dict = {"messages": [("user", query)]}
+        last_message = None
+        handler = bi_agent_callback_handler
+
+        with tracer.span("agent.request", "request", question=query, thread_id=session_id) as root, \
+                cancellation.request(session_id) as token, use_catalog(self.profile_catalog):
+            config = self._config(session_id, root)
+            self._close_interrupted_turn(config)
+            namespace = database_namespace(self.db)
+            cached = self.answer_cache.lookup(namespace, query) if self.answer_cache is not None else None
+            root.set(answer_cache_hit=cached is not None)
+            if cached is not None:
+                answer = self._replay(cached, query, config, handler)
+            else:
+                turn = AnsweredQuestion(namespace=namespace, question=query, sql="", answer="")
+                handled: Set[str] = set()
+                async for mode, event in self.react_agent.astream(input_dict, config=config,
+                                                                  stream_mode=["updates", "messages", "custom"]):
+                    if token.cancelled:
+                        break
+                    if mode == "messages":
+                        chunk, metadata = event
+                        if (handler is not None and hasattr(handler, 'process_token') and
+                                metadata.get("langgraph_node") == "agent" and
+                                isinstance(chunk.content, str) and chunk.content):
+                            handler.process_token(chunk.content, chunk.id)
+                        continue
+                    for message in self._stream_messages(mode, event, handled):
+                        last_message = message
+                        self._handle_message(message, turn, handler)
+                answer = self._cancelled(config, root) if token.cancelled else \
+                    self._finish(last_message, turn, handler)
+
+        self._report(root, handler)
+        return answer
+
+    def cancel(self, session_id: str) -> bool:
+        """Cancel the running request of a session, e.g. when the user abandons it.
+
+        The statement running for the request is cancelled on its connection, a
+        chart being rendered is stopped, and the agent stops at its next step.
+
+        Args:
+            session_id: The session whose request to cancel
+
+        Returns:
+            bool: True if a request of the session was running
+        """
+        return cancellation.cancel(session_id)
+
+    def _cancelled(self, config: Dict[str, Any], root) -> str:
+        """Close the conversation turn of a cancelled request so the thread stays valid."""
+        root.set(cancelled=True)
+        logger.info("The request was cancelled")
+        self._close_interrupted_turn(config, force=True)
+        return ""
+
+    def _close_interrupted_turn(self, config: Dict[str, Any], force: bool = False) -> None:
+        """Answer the pending tool calls of an interrupted turn and end it.
+
+        A turn is interrupted when its request is cancelled, or when the run is
+        abandoned mid-step, e.g. by a Streamlit rerun. Tool calls without results
+        would be rejected by the model on the next question.
+
+        Args:
+            config: The run configuration of the thread
+            force: Whether to end the turn even if no tool call is pending
+        """
+        if config["configurable"].get("thread_id") is None:
+            return
+        messages = self.react_agent.get_state(config).values.get("messages", [])
+        last_message = messages[-1] if messages else None
+        closing = [ToolMessage(content="Cancelled", tool_call_id=tool_call["id"])
+                   for tool_call in getattr(last_message, "tool_calls", None) or []]
+        if not closing and not force:
+            return
+        self.react_agent.update_state({"configurable": config["configurable"]},
+                                      {"messages": closing + [AIMessage(content="The request was cancelled.")]},
+                                      as_node="agent")
+
+    def _config(self, session_id: Optional[str], root) -> Dict[str, Any]:
+        """Build the run configuration of a request traced under the root span."""
+        return {
             "configurable": {
                 "thread_id": session_id
-            }
+            },
+            "callbacks": [TracingCallbackHandler(tracer, root)]
         }
 
-        for event in self.react_agent.stream(input_dict, config=config, stream_mode="values"):
-            if "messages" in event and event["messages"]:
-                print(f"Received {len(event['messages'])} messages:")
-                last_message = event["messages"][-1]
-                
-                # Process the message with callback handler if available
-                if bi_agent_callback_handler is not None and hasattr(last_message, 'type') and last_message.type == 'tool':
-                    self._process_message(last_message, bi_agent_callback_handler)
-                    
-                last_message.pretty_print()
-        
+    @staticmethod
+    def _new_messages(event: Dict[str, Any]) -> List[Any]:
+        """Return the messages added by the nodes of a graph update."""
+        messages = []
+        for node, update in event.items():
+            # The memory hook rewrites existing messages, it does not add any
+            if node != "pre_model_hook" and isinstance(update, dict):
+                messages.extend(update.get("messages") or [])
+        return messages
+
+    def _stream_messages(self, mode: str, event: Any, handled: Set[str]) -> List[Any]:
+        """Return the messages of a stream event that were not handled yet.
+
+        Tool results arrive on the custom stream as each tool call finishes, and
+        again in the update of the tools step once all of its calls are done.
+
+        Args:
+            mode: The stream mode of the event, "updates" or "custom"
+            event: The event
+            handled: The ids of the tool calls whose results were handled, updated in place
+
+        Returns:
+            List[Any]: The new messages
+        """
+        if mode == "custom":
+            result = event.get(TOOL_RESULT_KEY) if isinstance(event, dict) else None
+            messages = [result] if result is not None else []
+        else:
+            messages = self._new_messages(event)
+        new_messages = [message for message in messages
+                        if getattr(message, 'type', None) != 'tool' or message.tool_call_id not in handled]
+        handled.update(message.tool_call_id for message in new_messages if getattr(message, 'type', None) == 'tool')
+        return new_messages
+
+    def _handle_message(self, message, turn: AnsweredQuestion, bi_agent_callback_handler=None) -> None:
+        """Record a new message of the current turn and pass tool results to the callback handler."""
+        self._record(message, turn)
+
+        # Process the message with callback handler if available
+        if bi_agent_callback_handler is not None and getattr(message, 'type', None) == 'tool':
+            self._process_message(message, bi_agent_callback_handler)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(message.pretty_repr())
+
+    def _finish(self, last_message, turn: AnsweredQuestion, bi_agent_callback_handler=None) -> str:
+        """Pass the final answer to the callback handler and add the turn to the answer cache."""
         # Safely return the content of the last message or an empty string
-        if hasattr(last_message, 'content') and last_message.content is not None:
-            if bi_agent_callback_handler is not None and hasattr(bi_agent_callback_handler, 'process_last_message'):
-                bi_agent_callback_handler.process_last_message(last_message.content)
-            return str(last_message.content)
-        return ""
+        if not hasattr(last_message, 'content') or last_message.content is None:
+            return ""
+        if bi_agent_callback_handler is not None and hasattr(bi_agent_callback_handler, 'process_last_message'):
+            bi_agent_callback_handler.process_last_message(last_message.content)
+        answer = str(last_message.content)
+        if self.answer_cache is not None:
+            turn.answer = answer
+            self.answer_cache.add(turn)
+        return answer
+
+    @staticmethod
+    def _report(root, bi_agent_callback_handler=None) -> None:
+        """Log the stage summary of a finished request and pass it to the callback handler."""
+        summary = tracer.summarize(root.trace_id)
+        logger.info("Request finished in %.0f ms: %s", summary["total_ms"], summary["stages"])
+        if bi_agent_callback_handler is not None and hasattr(bi_agent_callback_handler, 'process_trace_summary'):
+            bi_agent_callback_handler.process_trace_summary(summary)
+
+    def _record(self, message, turn: AnsweredQuestion) -> None:
+        """Capture the SQL and artifacts of the current turn for the answer cache."""
+        if getattr(message, 'type', None) == 'ai':
+            for tool_call in getattr(message, 'tool_calls', None) or []:
+                if tool_call.get('name') == 'sql_db_query':
+                    turn.sql = tool_call.get('args', {}).get('query', turn.sql)
+        elif getattr(message, 'type', None) == 'tool':
+            if message.name == 'sql_db_query':
+                turn.result_handle = result_store.find_handle(str(message.content))
+                parsed = sql_parsing.parse(turn.sql, self.db.dialect)
+                turn.tables = sql_parsing.referenced_tables(parsed) if parsed is not None else set()
+            elif message.name == 'visualize_pandas_dataframe':
+                try:
+                    content_dict = json.loads(message.content)
+                    turn.chart_image_id = content_dict.get('image')
+                    turn.chart_code = content_dict.get('code')
+                except (json.JSONDecodeError, AttributeError):
+                    pass
+
+    def _replay(self, cached: AnsweredQuestion, query: str, config: Dict[str, Any],
+                bi_agent_callback_handler=None) -> str:
+        """Answer a question from the answer cache without invoking the language model.
+
+        The cached SQL and artifacts are sent through the callback handler in the
+        same order as a live run, and the exchange is added to the conversation.
+        """
+        logger.info(f"Answering from the question cache: {cached.question}")
+        handler = bi_agent_callback_handler
+        if handler is not None:
+            if hasattr(handler, 'process_sql'):
+                handler.process_sql(cached.sql)
+            if hasattr(handler, 'process_data'):
+                handle = result_store.find_handle(cached.result_handle or "")
+                if handle is None:
+                    output = QueryResultSQLDatabaseTool(db=self.db).invoke({"query": cached.sql})
+                    handle = result_store.find_handle(output)
+                if handle is not None:
+                    handler.process_data(f"result_handle: {handle}")
+            if cached.chart_image_id and hasattr(handler, 'process_chart'):
+                handler.process_chart(cached.chart_image_id)
+            if cached.chart_code and hasattr(handler, 'process_chart_code'):
+                handler.process_chart_code(cached.chart_code)
+            if hasattr(handler, 'process_last_message'):
+                handler.process_last_message(cached.answer)
+
+        if config["configurable"].get("thread_id") is not None:
+            self.react_agent.update_state(
+                {"configurable": config["configurable"]},
+                {"messages": [HumanMessage(content=query), AIMessage(content=cached.answer)]},
+                as_node="agent")
+        return cached.answer
 
 
+def default_db_uri() -> str:
+    """Build the database URI from the DB_* environment variables."""
+    DB_USER = os.getenv("DB_USER", "postgres")
+    DB_PASSWORD = os.getenv("DB_PASSWORD", "password12")
+    DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
+    DB_PORT = os.getenv("DB_PORT", "5432")
+    DB_NAME = os.getenv("DB_NAME", "postgres")
+    return f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
 
 def main():
     """Main entry point for the GenBI React Agent application."""
     # Load environment variables from .env file
     load_dotenv()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
     
     # Database path
     db_path = "sqlite:///" + str(pathlib.Path(__file__).parent.parent.resolve() / "chinook.db")
@@ -223,6 +533,15 @@ class PrintBICallbackHandler:
         print(chart_code)
         print("============================\n")
 
+    def process_token(self, token: str, message_id: str = None) -> None:
+        """Print a token of the answer as it is generated.
+
+        Args:
+            token: The next piece of the answer
+            message_id: The id of the message the token belongs to
+        """
+        print(token, end="", flush=True)
+
     def process_last_message(self, message_content: str) -> None:
         """Print the content of the last message.
 
@@ -237,12 +556,25 @@ class PrintBICallbackHandler:
         """Print the data content received from a 'convert_to_pandas' message.
         
         Args:
-            data_content: The data content to be printed
+            data_content: The result handle of the data, or the data as CSV text
         """
+        df = result_store.resolve(data_content)
         print("\n=== Data Content ===")
-        print(data_content)
+        print(df.to_csv(index=False) if df is not None else data_content)
         print("====================\n")
 
+    def process_trace_summary(self, summary: Dict[str, Any]) -> None:
+        """Print where the time of the request was spent.
+
+        Args:
+            summary: The per-stage timing and token summary of the request trace
+        """
+        print(f"\n=== Request Timing ({summary['total_ms']:.0f} ms) ===")
+        for stage, totals in summary["stages"].items():
+            details = ", ".join(f"{key}={value}" for key, value in totals.items() if key not in ("count", "ms"))
+            print(f"{stage:>8}: {totals['count']} call(s), {totals['ms']:.0f} ms {details}")
+        print("=================================\n")
+
 
 
 if __name__ == "__main__":
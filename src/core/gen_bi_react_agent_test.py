@@ -0,0 +1,25 @@
+import pathlib
+
+from langchain_core.messages import HumanMessage
+
+from benchmarks.scripted_llm import ScriptedChatModel
+from core.gen_bi_react_agent import GenBIReactAgent
+
+DB_URI = "sqlite:///" + str(pathlib.Path(__file__).parent.parent.resolve() / "chinook.db")
+
+
+def test_system_prompt_uses_the_schema_of_the_relevant_tables(tmp_path, monkeypatch):
+    """With the schema in the prompt, the model is not told to always list the tables first."""
+    monkeypatch.setenv("SCHEMA_INDEX_DIR", str(tmp_path))
+    agent = GenBIReactAgent(db_uri=DB_URI, llm=ScriptedChatModel(trajectories={}), answer_cache=None,
+                            schema_top_k=3)
+    system_message = agent._build_prompt({"messages": [HumanMessage("Total sales by billing country")]})[0].content
+
+    assert "ALWAYS look at the tables" not in system_message
+    assert "Do NOT skip this step" not in system_message
+    assert "The schema of the tables most relevant to the question is given below" in system_message
+    assert "Invoice(" in system_message
+
+    discovering = GenBIReactAgent(db_uri=DB_URI, llm=ScriptedChatModel(trajectories={}), answer_cache=None,
+                                  schema_top_k=None)
+    assert "ALWAYS look at the tables in the database" in discovering.system_message
@@ -1,49 +1,162 @@
-import uuid
-from typing import Dict, Optional
+import base64
+import binascii
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+from typing import Optional
+
+from core.lru_cache import LRUCache
+from core.spill_directory import SpillDirectory
 
 
 class ImageManager:
     """
-    A class to manage storage and retrieval of image data using UUIDs.
-    
-    This class provides methods to store image strings with unique identifiers
-    and retrieve them later using those identifiers.
+    A class to manage storage and retrieval of image data using content hashes.
+
+    Images are kept as raw bytes in a bounded in-memory LRU cache. Entries that
+    are evicted because of the memory budget or their age are spilled to an
+    on-disk content-addressed store and read back through a memory map. The
+    store has its own byte budget and age, see core.spill_directory. Identical
+    images are stored only once.
     """
-    
-    def __init__(self):
-        """Initialize the ImageManager with an empty dictionary to store images."""
-        self._images: Dict[str, str] = {}
-    
+
+    IMAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+    def __init__(self, max_memory_bytes: int = None, ttl_seconds: float = None, spill_dir: str = None,
+                 max_spill_bytes: int = None, spill_ttl_seconds: float = None):
+        """
+        Initialize the ImageManager.
+
+        Args:
+            max_memory_bytes: The in-memory byte budget, defaults to the IMAGE_CACHE_MAX_BYTES
+                environment variable or 64 MB.
+            ttl_seconds: How long an image stays in memory before it is spilled to disk, defaults
+                to the IMAGE_CACHE_TTL_SECONDS environment variable or one hour.
+            spill_dir: The directory of the on-disk store, defaults to the IMAGE_SPILL_DIR
+                environment variable or a directory below the system temp directory.
+            max_spill_bytes: The byte budget of the on-disk store, defaults to the
+                IMAGE_SPILL_MAX_BYTES environment variable or 1 GB.
+            spill_ttl_seconds: How long an image stays on disk after its last use, defaults to the
+                IMAGE_SPILL_TTL_SECONDS environment variable or one day.
+        """
+        if max_memory_bytes is None:
+            max_memory_bytes = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", 3600))
+        if spill_dir is None:
+            spill_dir = os.getenv("IMAGE_SPILL_DIR", os.path.join(tempfile.gettempdir(), "bi_assistant_images"))
+        if max_spill_bytes is None:
+            max_spill_bytes = int(os.getenv("IMAGE_SPILL_MAX_BYTES", 1024 * 1024 * 1024))
+        if spill_ttl_seconds is None:
+            spill_ttl_seconds = float(os.getenv("IMAGE_SPILL_TTL_SECONDS", 86400))
+
+        self._spill_dir = SpillDirectory(spill_dir, max_spill_bytes, spill_ttl_seconds)
+        self._images = LRUCache(max_bytes=max_memory_bytes, ttl_seconds=ttl_seconds,
+                                sizeof=len, on_evict=self._spill)
+
     def store(self, image_str: str) -> str:
         """
-        Store an image string and return a unique identifier for it.
-        
+        Store a base64 encoded image and return a unique identifier for it.
+
         Args:
-            image_str: The image data as a string to be stored.
-            
+            image_str: The base64 encoded image data to be stored.
+
         Returns:
-            str: A unique identifier (UUID) that can be used to retrieve the image.
+            str: A unique identifier (content hash) that can be used to retrieve the image.
         """
         if not image_str:
             raise ValueError("Image string cannot be empty")
-            
-        image_id = str(uuid.uuid4())
-        self._images[image_id] = image_str
+
+        try:
+            image_bytes = base64.b64decode(image_str, validate=True)
+        except binascii.Error as e:
+            raise ValueError(f"Image string is not valid base64: {e}")
+        return self.store_bytes(image_bytes)
+
+    def store_bytes(self, image_bytes: bytes) -> str:
+        """
+        Store raw image bytes and return a unique identifier for them.
+
+        Args:
+            image_bytes: The raw image data, typically a PNG.
+
+        Returns:
+            str: A unique identifier (content hash) that can be used to retrieve the image.
+        """
+        if not image_bytes:
+            raise ValueError("Image bytes cannot be empty")
+
+        image_id = hashlib.sha256(image_bytes).hexdigest()
+        self._images.expire()
+        if image_id not in self._images and not os.path.exists(self._spill_path(image_id)):
+            self._images.put(image_id, bytes(image_bytes))
         return image_id
-    
+
     def load(self, image_id: str) -> Optional[str]:
         """
-        Retrieve an image string using its unique identifier.
-        
+        Retrieve a base64 encoded image using its unique identifier.
+
         Args:
-            image_id: The UUID of the image to retrieve.
-            
+            image_id: The identifier of the image to retrieve.
+
         Returns:
-            Optional[str]: The stored image string if found, None otherwise.
+            Optional[str]: The base64 encoded image if found, None otherwise.
+        """
+        image_bytes = self.load_bytes(image_id)
+        return base64.b64encode(image_bytes).decode("ascii") if image_bytes is not None else None
+
+    def load_bytes(self, image_id: str) -> Optional[bytes]:
+        """
+        Retrieve raw image bytes using their unique identifier.
+
+        Args:
+            image_id: The identifier of the image to retrieve.
+
+        Returns:
+            Optional[bytes]: The raw image data if found, None otherwise.
         """
         if not image_id:
             raise ValueError("Image ID cannot be empty")
-            
-        return self._images.get(image_id)
+        if not self.IMAGE_ID_PATTERN.match(image_id):
+            return None
+
+        image_bytes = self._images.get(image_id)
+        if image_bytes is not None:
+            return image_bytes
+
+        path = self._spill_path(image_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                image_bytes = mapped[:]
+        except FileNotFoundError:
+            # Removed by a sweep in the meantime
+            return None
+        self._spill_dir.touch(self._spill_name(image_id))
+        self._images.put(image_id, image_bytes)
+        return image_bytes
+
+    @staticmethod
+    def _spill_name(image_id: str) -> str:
+        return os.path.join(image_id[:2], image_id + ".png")
+
+    def _spill_path(self, image_id: str) -> str:
+        return self._spill_dir.file(self._spill_name(image_id))
+
+    def _spill(self, image_id: str, image_bytes: bytes) -> None:
+        """Write an evicted image to the on-disk store unless it is already there."""
+        name = self._spill_name(image_id)
+        if os.path.exists(self._spill_dir.file(name)):
+            self._spill_dir.touch(name)
+            return
+
+        def write(path: str) -> None:
+            with open(path, "wb") as f:
+                f.write(image_bytes)
+
+        self._spill_dir.write(name, write)
 
-image_manager = ImageManager()
\ No newline at end of file
+image_manager = ImageManager()
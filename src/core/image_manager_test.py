@@ -0,0 +1,52 @@
+import base64
+import os
+import time
+
+from core.image_manager import ImageManager
+
+
+def test_spill_and_dedup(tmp_path):
+    """Images over the memory budget spill to disk, load back intact and are deduplicated."""
+    manager = ImageManager(max_memory_bytes=1500, ttl_seconds=3600, spill_dir=str(tmp_path))
+    images = [base64.b64encode(bytes([i]) * 1000).decode("ascii") for i in range(3)]
+
+    image_ids = [manager.store(image) for image in images]
+    assert manager.store(images[2]) == image_ids[2]
+    assert len(set(image_ids)) == 3
+
+    # Only the most recent image fits in memory, the others were spilled as raw bytes
+    spilled = [os.path.join(tmp_path, image_id[:2], image_id + ".png") for image_id in image_ids[:2]]
+    assert all(os.path.getsize(path) == 1000 for path in spilled)
+
+    assert [manager.load(image_id) for image_id in image_ids] == images
+    assert manager.load("0" * 64) is None
+
+
+def test_ttl_spills_to_disk(tmp_path):
+    """Images older than the TTL leave memory but remain loadable."""
+    manager = ImageManager(max_memory_bytes=10_000, ttl_seconds=0, spill_dir=str(tmp_path))
+    image = base64.b64encode(b"png" * 10).decode("ascii")
+
+    image_id = manager.store(image)
+    manager.store(base64.b64encode(b"other").decode("ascii"))
+
+    assert os.path.exists(os.path.join(tmp_path, image_id[:2], image_id + ".png"))
+    assert manager.load(image_id) == image
+
+
+def test_spilled_images_are_bounded_by_size_and_age(tmp_path):
+    """The least recently used images leave the disk over the budget, and all of them after the TTL."""
+    manager = ImageManager(max_memory_bytes=1000, ttl_seconds=3600, spill_dir=str(tmp_path),
+                           max_spill_bytes=3000, spill_ttl_seconds=3600)
+    image_ids = [manager.store_bytes(bytes([i]) * 1000) for i in range(4)]
+    now = time.time()
+    for age, image_id in zip([300, 200, 100], image_ids):
+        os.utime(manager._spill_path(image_id), (now - age, now - age))
+
+    # Reading the oldest image marks it as used, the image it evicts from memory takes the disk over budget
+    assert manager.load_bytes(image_ids[0]) == bytes([0]) * 1000
+    assert [manager.load_bytes(image_id) is not None for image_id in image_ids] == [True, False, False, True]
+
+    manager._spill_dir.ttl_seconds = 0
+    manager._spill_dir.sweep()
+    assert not any(files for _, _, files in os.walk(tmp_path))
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+
+class LLMCache:
+    """
+    A persistent cache of language model responses to deterministic prompts.
+
+    Responses are stored in a SQLite database keyed by a hash of the model,
+    the temperature and the prompt, so they survive restarts and are shared by
+    all processes using the same file. When the stored responses exceed the
+    byte budget the least recently used ones are deleted.
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        """Initialize the LLMCache.
+
+        Args:
+            path: The SQLite file, defaults to the LLM_CACHE_PATH environment variable
+                or ~/.cache/agentic-bi/llm_cache.sqlite at the time of use
+            max_bytes: The maximum total size of the cached responses, defaults to the
+                LLM_CACHE_MAX_BYTES environment variable or 64 MB
+        """
+        if max_bytes is None:
+            max_bytes = int(os.getenv("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+        self._path = path
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._connection_path = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+    def get(self, model: str, temperature: Optional[float], prompt: str, tool: str = "") -> Optional[str]:
+        """Return the cached response to a prompt.
+
+        Args:
+            model: The model identifier
+            temperature: The sampling temperature of the model
+            prompt: The prompt
+            tool: The calling tool, used for the hit rate statistics
+
+        Returns:
+            Optional[str]: The cached response, or None on a miss
+        """
+        key = self.key(model, temperature, prompt)
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._stats[tool]["misses"] += 1
+                return None
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+            self._stats[tool]["hits"] += 1
+            return row[0]
+
+    def put(self, model: str, temperature: Optional[float], prompt: str, content: str) -> None:
+        """Cache the response to a prompt and evict the least recently used responses over the budget.
+
+        Args:
+            model: The model identifier
+            temperature: The sampling temperature of the model
+            prompt: The prompt
+            content: The response
+        """
+        key = self.key(model, temperature, prompt)
+        size = len(content.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO responses (key, model, content, size, created_at, accessed_at) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", (key, model, content, size, now, now))
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            while total > self.max_bytes:
+                rows = connection.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 64").fetchall()
+                for old_key, old_size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    connection.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    total -= old_size
+            connection.commit()
+
+    def clear(self) -> None:
+        """Delete all cached responses."""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hits, misses and hit rate of this process per tool and in total."""
+        with self._lock:
+            tools = {tool: dict(counts) for tool, counts in self._stats.items()}
+        hits = sum(counts["hits"] for counts in tools.values())
+        misses = sum(counts["misses"] for counts in tools.values())
+        for counts in tools.values():
+            lookups = counts["hits"] + counts["misses"]
+            counts["hit_rate"] = counts["hits"] / lookups if lookups else 0.0
+        return {"hits": hits, "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0, "tools": tools}
+
+    @staticmethod
+    def key(model: str, temperature: Optional[float], prompt: str) -> str:
+        """Hash the model, temperature and prompt into a cache key."""
+        return hashlib.sha256(json.dumps([model, temperature, prompt]).encode("utf-8")).hexdigest()
+
+    @property
+    def path(self) -> str:
+        """The SQLite file, the environment is read on each use so that the shared cache can be redirected."""
+        if self._path is not None:
+            return self._path
+        default_path = pathlib.Path.home() / ".cache" / "agentic-bi" / "llm_cache.sqlite"
+        return os.getenv("LLM_CACHE_PATH", str(default_path))
+
+    @path.setter
+    def path(self, path: str) -> None:
+        self._path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        path = self.path
+        if self._connection is not None and self._connection_path != path:
+            self._connection.close()
+            self._connection = None
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            # WAL lets other processes read while one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, "
+                               "content TEXT, size INTEGER, created_at REAL, accessed_at REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            connection.commit()
+            self._connection, self._connection_path = connection, path
+        return self._connection
+
+
+def model_identity(llm) -> tuple:
+    """Return the model name and temperature of a chat model for use in cache keys."""
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+    temperature = getattr(llm, "temperature", None)
+    return str(model), temperature if isinstance(temperature, (int, float)) else None
+
+llm_cache = LLMCache()
@@ -0,0 +1,72 @@
+from unittest.mock import patch
+
+from core.llm_cache import LLMCache
+from core.tracing import tracer
+from core.viz_tools import VizTools
+
+
+def test_responses_are_keyed_by_model_temperature_and_prompt(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "llm.sqlite"), max_bytes=1024 * 1024)
+    cache.put("gpt-4", 0, "Summarize the data", "A summary")
+
+    assert cache.get("gpt-4", 0, "Summarize the data", tool="analyze_data") == "A summary"
+    assert cache.get("gpt-4", 0.7, "Summarize the data", tool="analyze_data") is None
+    assert cache.get("gpt-4o", 0, "Summarize the data", tool="chart_goal") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    assert stats["tools"]["analyze_data"]["hit_rate"] == 0.5
+
+
+def test_cache_is_shared_across_connections_and_evicts_least_recently_used(tmp_path):
+    """Another process sees the same file, and the oldest responses go first when over budget."""
+    path = str(tmp_path / "llm.sqlite")
+    writer = LLMCache(path=path, max_bytes=250)
+    writer.put("m", 0, "first", "a" * 100)
+    writer.put("m", 0, "second", "b" * 100)
+
+    reader = LLMCache(path=path, max_bytes=250)
+    assert reader.get("m", 0, "first") == "a" * 100
+
+    writer.put("m", 0, "third", "c" * 100)
+    assert reader.get("m", 0, "second") is None
+    assert reader.get("m", 0, "first") == "a" * 100
+    assert reader.get("m", 0, "third") == "c" * 100
+
+
+def test_tools_answer_repeated_prompts_from_the_cache(tmp_path):
+    """Only tools listed in LLM_CACHE_TOOLS use the cache and hits are recorded on spans."""
+    class CountingLLM:
+        model_name = "counting-model"
+        temperature = 0
+        calls = 0
+
+        def invoke(self, prompt, config=None):
+            CountingLLM.calls += 1
+            return type("Response", (), {"content": f"answer {CountingLLM.calls}"})()
+
+    VizTools.init(CountingLLM())
+    cache = LLMCache(path=str(tmp_path / "llm.sqlite"))
+    with patch("core.viz_tools.llm_cache", cache), patch.object(VizTools, "LLM_CACHE_TOOLS", {"analyze_data"}):
+        with tracer.span("request", "request") as root:
+            first = VizTools._invoke_llm("What are the sales?", "analyze_data")
+            second = VizTools._invoke_llm("What are the sales?", "analyze_data")
+            VizTools._invoke_llm("What are the sales?", "chart_goal")
+            VizTools._invoke_llm("What are the sales?", "chart_goal")
+
+    assert first.content == second.content == "answer 1"
+    assert CountingLLM.calls == 3
+    stage = tracer.summarize(root.trace_id)["stages"]["cache"]
+    assert (stage["count"], stage["cache_hits"]) == (2, 1)
+
+
+def test_default_path_is_read_from_the_environment_on_use(tmp_path, monkeypatch):
+    """The shared cache is created at import, it follows LLM_CACHE_PATH when it changes later."""
+    cache = LLMCache()
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "first.sqlite"))
+    cache.put("m", 0, "prompt", "first")
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "second.sqlite"))
+    assert cache.get("m", 0, "prompt") is None
+
+    assert cache.path == str(tmp_path / "second.sqlite")
+    assert LLMCache(path=str(tmp_path / "first.sqlite")).get("m", 0, "prompt") == "first"
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache with optional entry, byte and age limits.
+
+    Entries are evicted in least-recently-used order whenever the number of
+    entries or their total size exceeds the configured budget. Entries older
+    than the time-to-live are dropped on access.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None, sizeof: Callable[[Any], int] = None,
+                 on_evict: Callable[[Hashable, Any], None] = None):
+        """Initialize the LRUCache.
+
+        Args:
+            max_entries: Maximum number of entries to keep, unbounded if None
+            max_bytes: Maximum total size of the entries, unbounded if None
+            ttl_seconds: Maximum age of an entry in seconds, unbounded if None
+            sizeof: Function returning the size of a value, required with max_bytes
+            on_evict: Optional function called with the key and value of evicted entries
+        """
+        if max_bytes is not None and sizeof is None:
+            raise ValueError("sizeof is required when max_bytes is set")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+        self._on_evict = on_evict
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value stored for a key and mark it as recently used.
+
+        Args:
+            key: The key to look up
+            default: The value to return when the key is missing or expired
+
+        Returns:
+            Any: The cached value, or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                if entry is not None:
+                    self._remove(key, evicted=True)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store a value and evict older entries if the cache is over budget.
+
+        Args:
+            key: The key to store the value under
+            value: The value to store
+        """
+        size = self._sizeof(value) if self._sizeof else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic())
+            self._bytes += size
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a key and return its value, or default if it is not cached."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)
+
+    def clear(self) -> None:
+        """Remove all entries without calling the eviction callback."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def expire(self) -> int:
+        """Evict all entries older than the time-to-live.
+
+        Returns:
+            int: The number of evicted entries
+        """
+        if self.ttl_seconds is None:
+            return 0
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if self._expired(entry)]
+            for key in expired:
+                self._remove(key, evicted=True)
+            return len(expired)
+
+    def keys(self) -> list:
+        """Return a snapshot of the cached keys, least recently used first."""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        """The total size of the cached values."""
+        return self._bytes
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hit, miss and eviction counters together with the current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _expired(self, entry: tuple) -> bool:
+        return self.ttl_seconds is not None and time.monotonic() - entry[2] > self.ttl_seconds
+
+    def _remove(self, key: Hashable, evicted: bool = False) -> Any:
+        value, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        if evicted:
+            self.evictions += 1
+            if self._on_evict is not None:
+                self._on_evict(key, value)
+        return value
+
+    def _evict(self) -> None:
+        while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            key = next(iter(self._entries))
+            self._remove(key, evicted=True)
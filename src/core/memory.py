@@ -0,0 +1,303 @@
+"""
+Bounded conversation memory for the agent.
+
+ConversationMemory runs before every model call and rewrites the thread's
+messages in the checkpoint: tool outputs of finished turns are replaced with a
+reference to the stored result, and turns beyond the window or the byte cap are
+folded into a short extractive summary. BoundedMemorySaver keeps only the latest
+checkpoints of each thread and evicts idle threads. Setting MEMORY_SQLITE_PATH
+stores checkpoints in a local SQLite database instead.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+from core.result_store import result_store
+
+
+class ConversationMemory:
+    """
+    A pre-model hook that bounds the messages a thread keeps and resends.
+
+    The current turn is never changed. In earlier turns, tool outputs longer
+    than max_tool_output_chars are replaced with their result handle, or
+    truncated if they have none. Only the last max_turns turns are kept and
+    older ones are dropped until the thread is below max_thread_bytes; the
+    question, SQL, result handle and answer of each dropped turn are kept in a
+    summary message at the start of the thread.
+    """
+
+    SUMMARY_ID = "conversation-summary"
+    SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+    def __init__(self, max_turns: int = None, max_thread_bytes: int = None,
+                 max_tool_output_chars: int = None, max_summary_chars: int = 4000):
+        """Initialize the ConversationMemory.
+
+        Args:
+            max_turns: The number of earlier turns kept verbatim, defaults to the
+                MEMORY_MAX_TURNS environment variable or 6
+            max_thread_bytes: The size above which older turns are summarized, defaults to the
+                MEMORY_MAX_THREAD_BYTES environment variable or 200KB
+            max_tool_output_chars: The length above which tool outputs of earlier turns are compacted,
+                defaults to the MEMORY_TOOL_OUTPUT_CHARS environment variable or 500
+            max_summary_chars: The maximum length of the summary, the oldest entries are dropped first
+        """
+        self.max_turns = max_turns if max_turns is not None else int(os.getenv("MEMORY_MAX_TURNS", "6"))
+        self.max_thread_bytes = (max_thread_bytes if max_thread_bytes is not None
+                                 else int(os.getenv("MEMORY_MAX_THREAD_BYTES", str(200 * 1024))))
+        self.max_tool_output_chars = (max_tool_output_chars if max_tool_output_chars is not None
+                                      else int(os.getenv("MEMORY_TOOL_OUTPUT_CHARS", "500")))
+        self.max_summary_chars = max_summary_chars
+
+    def __call__(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Rewrite the messages of the thread if they exceed the bounds."""
+        messages = state["messages"]
+        compacted = self.compact(messages)
+        if compacted is None:
+            return {}
+        return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)] + compacted}
+
+    def compact(self, messages: List[BaseMessage]) -> Optional[List[BaseMessage]]:
+        """Bound a list of messages.
+
+        Args:
+            messages: The messages of a thread, oldest first
+
+        Returns:
+            Optional[List[BaseMessage]]: The bounded messages, or None if they are already within bounds
+        """
+        summary, turns = self._split(messages)
+        changed = False
+
+        for turn in turns[:-1]:
+            for i, message in enumerate(turn):
+                if isinstance(message, ToolMessage) and len(str(message.content)) > self.max_tool_output_chars:
+                    turn[i] = message.model_copy(update={"content": self._reference(str(message.content))})
+                    changed = True
+
+        dropped = []
+        while len(turns) > 1 and (len(turns) - 1 > self.max_turns or
+                                  sum(self._size(m) for turn in turns for m in turn) > self.max_thread_bytes):
+            dropped.append(turns.pop(0))
+        if dropped:
+            summary = self._summarize(summary, dropped)
+            changed = True
+
+        if not changed:
+            return None
+        result = [summary] if summary is not None else []
+        return result + [message for turn in turns for message in turn]
+
+    def _split(self, messages: List[BaseMessage]):
+        """Split messages into the summary message and turns that each start with a human message."""
+        summary = None
+        turns: List[List[BaseMessage]] = []
+        for message in messages:
+            if message.id == self.SUMMARY_ID:
+                summary = message
+            elif isinstance(message, HumanMessage) or not turns:
+                turns.append([message])
+            else:
+                turns[-1].append(message)
+        return summary, turns
+
+    def _reference(self, content: str) -> str:
+        """Replace a bulky tool output with a reference to its stored result."""
+        handle = result_store.find_handle(content)
+        if handle is not None:
+            return f"[{len(content)} characters omitted, the rows are stored as result_handle: {handle}]"
+        return content[:self.max_tool_output_chars] + f"... [{len(content) - self.max_tool_output_chars} characters truncated]"
+
+    def _summarize(self, summary: Optional[BaseMessage], turns: List[List[BaseMessage]]) -> SystemMessage:
+        """Add one line per dropped turn to the summary message."""
+        lines = str(summary.content).split("\n")[1:] if summary is not None else []
+        for turn in turns:
+            question = next((str(m.content) for m in turn if isinstance(m, HumanMessage)), "")
+            sql = ""
+            handle = None
+            for message in turn:
+                for tool_call in getattr(message, "tool_calls", None) or []:
+                    if tool_call.get("name") == "sql_db_query":
+                        sql = tool_call.get("args", {}).get("query", sql)
+                if isinstance(message, ToolMessage) and message.name == "sql_db_query":
+                    handle = result_store.find_handle(str(message.content)) or handle
+            answer = next((str(m.content) for m in reversed(turn)
+                           if isinstance(m, AIMessage) and m.content and not m.tool_calls), "")
+            parts = [f"Q: {self._shorten(question, 200)}"]
+            if sql:
+                parts.append(f"SQL: {self._shorten(sql, 300)}")
+            if handle:
+                parts.append(f"result_handle: {handle}")
+            if answer:
+                parts.append(f"A: {self._shorten(answer, 300)}")
+            lines.append(" | ".join(parts))
+        while len(lines) > 1 and sum(len(line) + 1 for line in lines) > self.max_summary_chars:
+            lines.pop(0)
+        return SystemMessage(content="\n".join([self.SUMMARY_HEADER] + lines), id=self.SUMMARY_ID)
+
+    @staticmethod
+    def _shorten(text: str, length: int) -> str:
+        text = " ".join(text.split())
+        return text if len(text) <= length else text[:length] + "..."
+
+    @staticmethod
+    def _size(message: BaseMessage) -> int:
+        size = len(str(message.content).encode("utf-8"))
+        tool_calls = getattr(message, "tool_calls", None)
+        if tool_calls:
+            size += len(json.dumps(tool_calls, default=str))
+        return size
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    An in-memory checkpointer that keeps only the latest checkpoints of each thread.
+
+    InMemorySaver keeps every checkpoint of every thread for the life of the
+    process. This saver prunes all but the last keep_checkpoints checkpoints of
+    a thread, with their writes and unreferenced channel values, and deletes
+    threads that have not been used for max_idle_seconds.
+    """
+
+    def __init__(self, keep_checkpoints: int = 2, max_idle_seconds: float = None, **kwargs):
+        """Initialize the BoundedMemorySaver.
+
+        Args:
+            keep_checkpoints: The number of checkpoints kept per thread
+            max_idle_seconds: The time after which unused threads are deleted, defaults to the
+                MEMORY_IDLE_SECONDS environment variable or one hour
+        """
+        super().__init__(**kwargs)
+        self.keep_checkpoints = keep_checkpoints
+        self.max_idle_seconds = (max_idle_seconds if max_idle_seconds is not None
+                                 else float(os.getenv("MEMORY_IDLE_SECONDS", "3600")))
+        self._last_access: Dict[str, float] = {}
+        self._next_eviction = 0.0
+        self._lock = threading.RLock()
+
+    def get_tuple(self, config):
+        with self._lock:
+            thread_id = config["configurable"].get("thread_id")
+            if thread_id in self._last_access:
+                self._last_access[thread_id] = time.monotonic()
+            return super().get_tuple(config)
+
+    def list(self, config, **kwargs):
+        with self._lock:
+            return iter(list(super().list(config, **kwargs)))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            self._last_access[thread_id] = time.monotonic()
+            self._prune(thread_id, config["configurable"]["checkpoint_ns"])
+            if time.monotonic() >= self._next_eviction:
+                self.evict_idle()
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._last_access.pop(thread_id, None)
+
+    async def alist(self, config, **kwargs):
+        for item in self.list(config, **kwargs):
+            yield item
+
+    def evict_idle(self) -> int:
+        """Delete the threads that have not been used for max_idle_seconds.
+
+        Returns:
+            int: The number of deleted threads
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._next_eviction = now + min(self.max_idle_seconds, 60)
+            idle = [thread_id for thread_id, last_access in self._last_access.items()
+                    if now - last_access > self.max_idle_seconds]
+            for thread_id in idle:
+                self.delete_thread(thread_id)
+            return len(idle)
+
+    def thread_bytes(self, thread_id: str) -> int:
+        """Return the serialized size of the checkpoints, writes and channel values of a thread."""
+        with self._lock:
+            size = sum(len(c[1]) + len(m[1]) for ns in self.storage.get(thread_id, {}).values()
+                       for c, m, _ in ns.values())
+            size += sum(len(value[1]) for key, value in self.blobs.items() if key[0] == thread_id)
+            size += sum(len(write[2][1]) for key, writes in self.writes.items() if key[0] == thread_id
+                        for write in writes.values())
+            return size
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        """Drop all but the latest checkpoints of a thread and the values only they referenced."""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_checkpoints:
+            return
+        # Checkpoint ids are monotonically increasing
+        for checkpoint_id in sorted(checkpoints)[:-self.keep_checkpoints]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        referenced = set()
+        for checkpoint, _, _ in checkpoints.values():
+            versions = self.serde.loads_typed(checkpoint)["channel_versions"]
+            referenced.update((thread_id, checkpoint_ns, channel, version) for channel, version in versions.items())
+        for key in [key for key in self.blobs if key[0] == thread_id and key[1] == checkpoint_ns]:
+            if key not in referenced:
+                del self.blobs[key]
+
+
+def create_checkpointer() -> BaseCheckpointSaver:
+    """Create the checkpointer for the agent's conversations.
+
+    Returns:
+        BaseCheckpointSaver: A SQLite checkpointer if the MEMORY_SQLITE_PATH environment
+        variable is set, a BoundedMemorySaver otherwise
+    """
+    path = os.getenv("MEMORY_SQLITE_PATH")
+    if not path:
+        return BoundedMemorySaver()
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError as e:
+        raise ImportError("MEMORY_SQLITE_PATH requires the langgraph-checkpoint-sqlite package") from e
+
+    class ThreadedSqliteSaver(SqliteSaver):
+        """A SqliteSaver whose async methods run the sync ones in a worker thread."""
+
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, **kwargs):
+            for item in await asyncio.to_thread(lambda: list(self.list(config, **kwargs))):
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return ThreadedSqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+conversation_memory = ConversationMemory()
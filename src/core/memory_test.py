@@ -0,0 +1,73 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from core.memory import BoundedMemorySaver, ConversationMemory
+from core.result_store import result_store
+
+
+def _turn(i, rows):
+    handle = result_store.store_rows(["n"], [(i,)])
+    return [
+        HumanMessage(content=f"question {i}", id=f"h{i}"),
+        AIMessage(content="", id=f"a{i}", tool_calls=[{"name": "sql_db_query", "args": {"query": f"SELECT {i}"},
+                                                       "id": f"call{i}"}]),
+        ToolMessage(content=rows + f"\n\nresult_handle: {handle}", name="sql_db_query",
+                    tool_call_id=f"call{i}", id=f"t{i}"),
+        AIMessage(content=f"answer {i}", id=f"r{i}"),
+    ]
+
+
+def test_compacts_tool_outputs_of_earlier_turns():
+    memory = ConversationMemory(max_turns=5, max_tool_output_chars=100)
+    messages = _turn(0, "x" * 1000) + _turn(1, "y" * 1000)
+
+    compacted = memory.compact(messages)
+    handle = result_store.find_handle(messages[2].content)
+    assert compacted[2].content == f"[1032 characters omitted, the rows are stored as result_handle: {handle}]"
+    assert compacted[2].tool_call_id == "call0"
+    assert compacted[6].content.startswith("y" * 1000)
+    assert memory.compact(compacted) is None
+
+
+def test_summarizes_turns_beyond_the_window():
+    memory = ConversationMemory(max_turns=1, max_tool_output_chars=100)
+    messages = _turn(0, "x") + _turn(1, "y") + _turn(2, "z")
+
+    compacted = memory.compact(messages)
+    handle = result_store.find_handle(messages[2].content)
+    assert compacted[0].id == ConversationMemory.SUMMARY_ID
+    assert f"Q: question 0 | SQL: SELECT 0 | result_handle: {handle} | A: answer 0" in compacted[0].content
+    assert [m.id for m in compacted[1:]] == ["h1", "a1", "t1", "r1", "h2", "a2", "t2", "r2"]
+
+    compacted = memory.compact(compacted + _turn(3, "w"))
+    assert "question 0" in compacted[0].content and "question 1" in compacted[0].content
+
+
+def test_byte_cap_drops_oldest_turns():
+    memory = ConversationMemory(max_turns=10, max_thread_bytes=3000, max_tool_output_chars=5000)
+    messages = _turn(0, "x" * 2000) + _turn(1, "y" * 2000)
+
+    compacted = memory.compact(messages)
+    assert compacted[0].id == ConversationMemory.SUMMARY_ID
+    assert compacted[1].id == "h1"
+
+
+def test_saver_keeps_latest_checkpoints_and_evicts_idle_threads():
+    from langgraph.graph import END, START, MessagesState, StateGraph
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("echo", lambda state: {"messages": [AIMessage(content="echo")]})
+    builder.add_edge(START, "echo")
+    builder.add_edge("echo", END)
+    saver = BoundedMemorySaver(keep_checkpoints=2, max_idle_seconds=3600)
+    graph = builder.compile(checkpointer=saver)
+
+    config = {"configurable": {"thread_id": "t1"}}
+    for i in range(5):
+        graph.invoke({"messages": [HumanMessage(content=f"hello {i}")]}, config)
+
+    assert len(saver.storage["t1"][""]) == 2
+    assert len(graph.get_state(config).values["messages"]) == 10
+
+    saver.max_idle_seconds = 0
+    assert saver.evict_idle() == 1
+    assert "t1" not in saver.storage
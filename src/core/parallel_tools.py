@@ -0,0 +1,82 @@
+"""
+Streaming of the tool calls of one agent step as they finish.
+
+When the model asks for several tools at once, e.g. analyze_data and
+visualize_pandas_dataframe on the same query result, langgraph's ToolNode
+already runs them concurrently, but only reports them when the slowest one is
+done. ParallelToolNode writes each result to the graph's custom stream as soon
+as its call finishes, so callers can show it before the other calls are done,
+and caps the number of calls running at the same time. The step update still
+carries every result in the order of the calls.
+
+ParallelToolNode overrides internals of ToolNode (_func, _afunc, _parse_input,
+_run_one, _combine_tool_outputs), requirements.txt pins langgraph-prebuilt to
+the release line they are written against.
+"""
+import asyncio
+import os
+from concurrent.futures import as_completed
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import get_config_list, get_executor_for_config
+from langgraph.config import get_stream_writer
+from langgraph.prebuilt import ToolNode
+from langgraph.store.base import BaseStore
+
+# The key of the tool results written to the custom stream
+TOOL_RESULT_KEY = "tool_result"
+
+
+class ParallelToolNode(ToolNode):
+    """A ToolNode streaming each tool result as it finishes and bounding the concurrent calls."""
+
+    def __init__(self, tools: list, max_concurrency: int = None, **kwargs):
+        """Initialize the ParallelToolNode.
+
+        Args:
+            tools: The tools the model can call
+            max_concurrency: The maximum number of tool calls running at the same time, defaults to
+                the TOOL_MAX_CONCURRENCY environment variable or 4
+            **kwargs: The options of ToolNode, e.g. handle_tool_errors
+        """
+        super().__init__(tools, **kwargs)
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))
+        self.max_concurrency = max(1, max_concurrency)
+
+    def _func(self, input: Any, config: RunnableConfig, *, store: Optional[BaseStore]) -> Any:
+        tool_calls, input_type = self._parse_input(input, store)
+        config_list = get_config_list(config, len(tool_calls))
+        outputs: List[Any] = [None] * len(tool_calls)
+        # The executor copies the context into its threads, the tools see the
+        # request's trace span and cancellation token
+        with get_executor_for_config({**config, "max_concurrency": self.max_concurrency}) as executor:
+            futures = {executor.submit(self._run_one, call, input_type, call_config): index
+                       for index, (call, call_config) in enumerate(zip(tool_calls, config_list))}
+            for future in as_completed(futures):
+                outputs[futures[future]] = future.result()
+                self._emit(future.result())
+        return self._combine_tool_outputs(outputs, input_type)
+
+    async def _afunc(self, input: Any, config: RunnableConfig, *, store: Optional[BaseStore]) -> Any:
+        tool_calls, input_type = self._parse_input(input, store)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(index: int, call: Dict[str, Any]):
+            async with semaphore:
+                return index, await self._arun_one(call, input_type, config)
+
+        outputs: List[Any] = [None] * len(tool_calls)
+        for finished in asyncio.as_completed([run(index, call) for index, call in enumerate(tool_calls)]):
+            index, output = await finished
+            outputs[index] = output
+            self._emit(output)
+        return self._combine_tool_outputs(outputs, input_type)
+
+    @staticmethod
+    def _emit(output: Any) -> None:
+        """Write a finished tool result to the custom stream of the graph."""
+        if isinstance(output, ToolMessage):
+            get_stream_writer()({TOOL_RESULT_KEY: output})
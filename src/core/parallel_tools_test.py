@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+from langgraph.graph import START, MessagesState, StateGraph
+
+from core.parallel_tools import TOOL_RESULT_KEY, ParallelToolNode
+
+
+@tool
+def slow_tool(seconds: float) -> str:
+    """Wait and return."""
+    time.sleep(seconds)
+    return f"slow {seconds}"
+
+
+@tool
+def fast_tool(seconds: float) -> str:
+    """Wait briefly and return."""
+    time.sleep(seconds)
+    return f"fast {seconds}"
+
+
+def _graph(max_concurrency: int = 4):
+    graph = StateGraph(MessagesState)
+    graph.add_node("tools", ParallelToolNode([slow_tool, fast_tool], max_concurrency=max_concurrency))
+    graph.add_edge(START, "tools")
+    return graph.compile()
+
+
+def _calls():
+    return {"messages": [AIMessage(content="", tool_calls=[
+        {"name": "slow_tool", "args": {"seconds": 0.6}, "id": "slow"},
+        {"name": "fast_tool", "args": {"seconds": 0.1}, "id": "fast"},
+    ])]}
+
+
+def test_tool_calls_run_concurrently_and_stream_as_they_finish():
+    start = time.perf_counter()
+    events = list(_graph().stream(_calls(), stream_mode=["updates", "custom"]))
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 1.0
+    streamed = [event[TOOL_RESULT_KEY].tool_call_id for mode, event in events if mode == "custom"]
+    assert streamed == ["fast", "slow"]
+    # The step update keeps the results in the order of the calls
+    update = next(event for mode, event in events if mode == "updates")
+    assert [message.tool_call_id for message in update["tools"]["messages"]] == ["slow", "fast"]
+
+
+def test_async_tool_calls_run_concurrently():
+    async def run():
+        return [event async for event in _graph().astream(_calls(), stream_mode=["updates", "custom"])]
+
+    start = time.perf_counter()
+    events = asyncio.run(run())
+    assert time.perf_counter() - start < 1.0
+    assert [event[TOOL_RESULT_KEY].content for mode, event in events if mode == "custom"] == ["fast 0.1", "slow 0.6"]
+
+
+def test_max_concurrency_bounds_the_calls():
+    start = time.perf_counter()
+    result = _graph(max_concurrency=1).invoke(_calls())
+    assert time.perf_counter() - start >= 0.7
+    assert [message.content for message in result["messages"][1:]] == ["slow 0.6", "fast 0.1"]
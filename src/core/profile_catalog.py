@@ -0,0 +1,470 @@
+"""
+A catalog of column profiles computed offline from the database.
+
+For every column of the usable tables the profiler records the row count,
+cardinality, null ratio, minimum and maximum, the most frequent values, a
+histogram of numeric columns and a semantic type inferred from the column name
+and these statistics. The profiles are computed with aggregate queries and
+stored in a SQLite file shared by all processes (PROFILE_CATALOG_PATH). A
+refresh only profiles the tables whose definition changed or whose profile is
+older than PROFILE_MAX_AGE_SECONDS.
+
+The catalog keeps sampling and LLM enrichment off the request path: the agent
+gets compact profile hints for the relevant tables, sql_db_schema returns them
+instead of sample rows, and chart summaries take their semantic types and
+descriptions from the catalog of the request's database (current_catalog).
+
+Usage:
+    python -m core.profile_catalog --db sqlite:///chinook.db --tables Invoice,Track --force
+"""
+import argparse
+import contextvars
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+import sqlalchemy as sa
+from langchain_community.utilities.sql_database import SQLDatabase
+
+from core.sql_engine import database_namespace
+
+logger = logging.getLogger(__name__)
+
+# Semantic types of columns by the words of their names, the first match wins
+NAME_TYPES = {
+    "string": [({"email", "mail"}, "email"), ({"country"}, "country"), ({"city"}, "city"),
+               ({"state", "province", "region"}, "state"), ({"postal", "zip"}, "postal_code"),
+               ({"phone", "fax", "mobile"}, "phone"), ({"address", "street"}, "address"),
+               ({"url", "website"}, "url"), ({"name", "title"}, "name")],
+    "number": [({"total", "price", "amount", "cost", "sales", "revenue", "spent", "income"}, "amount"),
+               ({"quantity", "qty", "count", "number", "tracks"}, "quantity"),
+               ({"milliseconds", "seconds", "duration"}, "duration"), ({"bytes", "size"}, "size"),
+               ({"year"}, "year"), ({"percent", "ratio", "rate"}, "ratio")],
+}
+# String columns with at most this many distinct values are categories
+CATEGORY_MAX_DISTINCT = 50
+# Frequent values are shown for columns with at most this many distinct values, unless their values are
+# personal or unique by nature
+EXAMPLES_MAX_DISTINCT = 100
+NO_EXAMPLE_TYPES = {"address", "email", "phone", "postal_code", "url", "text"}
+
+# The catalog of the database the request running in the current context queries
+_current_catalog: contextvars.ContextVar[Optional["ProfileCatalog"]] = contextvars.ContextVar(
+    "current_profile_catalog", default=None)
+
+
+@dataclass
+class ColumnProfile:
+    """The statistics of one column of a table."""
+    table: str
+    column: str
+    data_type: str
+    family: str
+    row_count: int
+    distinct_count: Optional[int] = None
+    null_ratio: float = 0.0
+    min: Any = None
+    max: Any = None
+    top_values: List[List[Any]] = field(default_factory=list)
+    histogram: Optional[Dict[str, List[float]]] = None
+    semantic_type: str = ""
+
+    @property
+    def description(self) -> str:
+        """Describe the column in a few words, e.g. for the prompt or a chart summary."""
+        parts = []
+        if self.semantic_type != "identifier" and self.min is not None and self.family in ("integer", "number", "date"):
+            parts.append(f"{_short(self.min)}..{_short(self.max)}")
+        if self.distinct_count is not None and self.family == "string":
+            values = ", ".join(_short(value) for value, _ in self.top_values[:3]) \
+                if self.distinct_count <= EXAMPLES_MAX_DISTINCT and self.semantic_type not in NO_EXAMPLE_TYPES else ""
+            parts.append(f"{self.distinct_count} distinct" + (f" e.g. {values}" if values else ""))
+        if self.null_ratio >= 0.01:
+            parts.append(f"{self.null_ratio:.0%} null")
+        return ", ".join(parts)
+
+
+class ProfileCatalog:
+    """
+    Profiles the columns of a database and keeps the profiles in a local catalog.
+
+    Profiles are loaded from the catalog file on first use, so processes that
+    do not profile themselves share the profiles computed by the offline job.
+    """
+
+    VERSION = 1
+
+    def __init__(self, db: SQLDatabase, path: str = None, top_k: int = None, histogram_bins: int = None,
+                 max_age_seconds: float = None):
+        """Initialize the ProfileCatalog.
+
+        Args:
+            db: The database to profile
+            path: The SQLite file of the catalog, defaults to the PROFILE_CATALOG_PATH environment
+                variable or ~/.cache/agentic-bi/profiles.sqlite
+            top_k: The number of most frequent values kept per column, defaults to the
+                PROFILE_TOP_VALUES environment variable or 10
+            histogram_bins: The number of bins of the histograms of numeric columns, defaults to the
+                PROFILE_HISTOGRAM_BINS environment variable or 10
+            max_age_seconds: The age after which a table is profiled again, defaults to the
+                PROFILE_MAX_AGE_SECONDS environment variable or one day
+        """
+        if path is None:
+            default_path = pathlib.Path.home() / ".cache" / "agentic-bi" / "profiles.sqlite"
+            path = os.getenv("PROFILE_CATALOG_PATH", str(default_path))
+        self.db = db
+        self.path = path
+        self.namespace = database_namespace(db)
+        self.top_k = top_k if top_k is not None else int(os.getenv("PROFILE_TOP_VALUES", "10"))
+        self.histogram_bins = histogram_bins if histogram_bins is not None else \
+            int(os.getenv("PROFILE_HISTOGRAM_BINS", "10"))
+        self.max_age_seconds = max_age_seconds if max_age_seconds is not None else \
+            float(os.getenv("PROFILE_MAX_AGE_SECONDS", "86400"))
+        self._profiles: Optional[Dict[str, List[ColumnProfile]]] = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def refresh(self, tables: List[str] = None, force: bool = False) -> List[str]:
+        """Profile the tables whose definition changed or whose profile is stale.
+
+        Args:
+            tables: The tables to consider, defaults to all usable tables
+            force: Whether to profile the tables even if their profiles are current
+
+        Returns:
+            List[str]: The tables that were profiled
+        """
+        inspector = sa.inspect(self.db._engine)
+        stored = self._stored_tables()
+        profiled = []
+        for table in tables or self.db.get_usable_table_names():
+            try:
+                columns = inspector.get_columns(table, schema=self.db._schema)
+                keys = set(inspector.get_pk_constraint(table, schema=self.db._schema).get("constrained_columns") or [])
+                for foreign_key in inspector.get_foreign_keys(table, schema=self.db._schema):
+                    keys.update(foreign_key["constrained_columns"])
+            except sa.exc.SQLAlchemyError as e:
+                logger.warning("Cannot reflect table %s: %s", table, e)
+                continue
+            fingerprint = self._fingerprint(columns)
+            previous = stored.get(table)
+            if (not force and previous is not None and previous[0] == fingerprint
+                    and time.time() - previous[1] < self.max_age_seconds):
+                continue
+            try:
+                profiles = self._profile_table(table, columns, keys)
+            except sa.exc.SQLAlchemyError as e:
+                logger.warning("Cannot profile table %s: %s", table, e)
+                continue
+            self._store(table, fingerprint, profiles)
+            profiled.append(table)
+        if profiled:
+            logger.info("Profiled %d tables: %s", len(profiled), ", ".join(profiled))
+            with self._lock:
+                self._profiles = None
+        return profiled
+
+    def profiles(self, table: str) -> List[ColumnProfile]:
+        """Return the column profiles of a table, empty if it was not profiled."""
+        return self._load().get(table, [])
+
+    def has_profiles(self, table: str) -> bool:
+        return bool(self.profiles(table))
+
+    def hints(self, table_names: List[str]) -> str:
+        """Describe the profiled columns of tables compactly, one line per table.
+
+        Key columns are left out, the schema describes them already.
+
+        Args:
+            table_names: The tables to describe
+
+        Returns:
+            str: The hints, empty if none of the tables was profiled
+        """
+        lines = []
+        for table in table_names:
+            columns = [f"{profile.column} {profile.semantic_type}" +
+                       (f" {profile.description}" if profile.description else "")
+                       for profile in self.profiles(table) if profile.semantic_type != "identifier"]
+            if columns:
+                lines.append(f"{table}: " + "; ".join(columns))
+        return "\n".join(lines)
+
+    def annotate(self, summary: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill the semantic types and descriptions of a LIDA data summary from the catalog.
+
+        Result columns are matched to profiled columns by name. Columns without
+        an unambiguous match, e.g. aggregates, get a semantic type inferred from
+        their name and summary statistics.
+
+        Args:
+            summary: The summary of a query result, updated in place
+
+        Returns:
+            Dict[str, Any]: The summary
+        """
+        by_name: Dict[str, List[ColumnProfile]] = {}
+        for profiles in self._load().values():
+            for profile in profiles:
+                by_name.setdefault(profile.column.lower(), []).append(profile)
+
+        tables = set()
+        for summary_field in summary.get("fields", []):
+            properties = summary_field["properties"]
+            matches = by_name.get(str(summary_field["column"]).lower(), [])
+            semantic_types = {profile.semantic_type for profile in matches}
+            if len(semantic_types) == 1:
+                properties["semantic_type"] = semantic_types.pop()
+                if len(matches) == 1:
+                    properties["description"] = f"{matches[0].table}.{matches[0].column}" + \
+                        (f", {matches[0].description}" if matches[0].description else "")
+                tables.update(profile.table for profile in matches)
+            else:
+                family = {"number": "number", "date": "date", "boolean": "boolean"}.get(properties.get("dtype"), "string")
+                properties["semantic_type"] = infer_semantic_type(
+                    str(summary_field["column"]), family, properties.get("num_unique_values"),
+                    samples=properties.get("samples"))
+        if tables:
+            summary["dataset_description"] = "A query result over the " + ", ".join(sorted(tables)) + " tables"
+        return summary
+
+    def _profile_table(self, table: str, columns: List[Dict[str, Any]], keys: set) -> List[ColumnProfile]:
+        """Profile the columns of a table with one aggregate query plus one query per frequency and histogram."""
+        sa_columns = {column["name"]: sa.column(column["name"], column["type"]) for column in columns}
+        sa_table = sa.table(table, *sa_columns.values(), schema=self.db._schema)
+        families = {column["name"]: type_family(column["type"]) for column in columns}
+
+        aggregates = [sa.func.count().label("rows")]
+        for index, (name, column) in enumerate(sa_columns.items()):
+            aggregates.append(sa.func.count(column).label(f"n{index}"))
+            if families[name] != "binary":
+                aggregates += [sa.func.count(sa.distinct(column)).label(f"d{index}"),
+                               sa.func.min(column).label(f"lo{index}"), sa.func.max(column).label(f"hi{index}")]
+
+        profiles = []
+        with self.db._engine.connect() as connection:
+            stats = connection.execute(sa.select(*aggregates).select_from(sa_table)).mappings().one()
+            row_count = stats["rows"] or 0
+            for index, column in enumerate(columns):
+                name, family = column["name"], families[column["name"]]
+                non_null = stats[f"n{index}"] or 0
+                profile = ColumnProfile(table=table, column=name, data_type=str(column["type"]), family=family,
+                                        row_count=row_count,
+                                        null_ratio=round(1 - non_null / row_count, 4) if row_count else 0.0)
+                if family != "binary" and non_null:
+                    profile.distinct_count = stats[f"d{index}"]
+                    profile.min, profile.max = _json_value(stats[f"lo{index}"]), _json_value(stats[f"hi{index}"])
+                    if profile.distinct_count < non_null:
+                        profile.top_values = self._top_values(connection, sa_table, sa_columns[name])
+                    if family in ("integer", "number") and name not in keys:
+                        profile.histogram = self._histogram(connection, sa_table, sa_columns[name],
+                                                            profile.min, profile.max)
+                profile.semantic_type = infer_semantic_type(
+                    name, family, profile.distinct_count, non_null,
+                    [value for value, _ in profile.top_values] or [profile.min, profile.max], key=name in keys)
+                profiles.append(profile)
+        return profiles
+
+    def _top_values(self, connection, sa_table, column) -> List[List[Any]]:
+        count = sa.func.count().label("count")
+        rows = connection.execute(sa.select(column, count).select_from(sa_table).where(column.is_not(None))
+                                  .group_by(column).order_by(count.desc()).limit(self.top_k)).all()
+        return [[_json_value(value), count] for value, count in rows]
+
+    def _histogram(self, connection, sa_table, column, low: Any, high: Any) -> Optional[Dict[str, List[float]]]:
+        """Count the values of a numeric column in equal-width bins between its minimum and maximum."""
+        if not isinstance(low, (int, float)) or not isinstance(high, (int, float)) or low >= high:
+            return None
+        width = (high - low) / self.histogram_bins
+        offset = (sa.cast(column, sa.Float) - low) / width
+        # SQLite truncates when casting, other databases round
+        bucket = sa.cast(offset, sa.Integer) if self.db.dialect == "sqlite" else sa.func.floor(offset)
+        rows = connection.execute(sa.select(bucket.label("bucket"), sa.func.count()).select_from(sa_table)
+                                  .where(column.is_not(None)).group_by(bucket)).all()
+        counts = [0] * self.histogram_bins
+        for index, count in rows:
+            # The maximum falls on the upper edge of the last bin
+            counts[min(max(int(index), 0), self.histogram_bins - 1)] += count
+        return {"edges": [round(low + width * i, 6) for i in range(self.histogram_bins + 1)], "counts": counts}
+
+    def _fingerprint(self, columns: List[Dict[str, Any]]) -> str:
+        definition = [self.VERSION, self.top_k, self.histogram_bins] + \
+            [[column["name"], str(column["type"])] for column in columns]
+        return hashlib.sha1(json.dumps(definition).encode("utf-8")).hexdigest()
+
+    def _load(self) -> Dict[str, List[ColumnProfile]]:
+        with self._lock:
+            if self._profiles is None:
+                rows = self._connect().execute(
+                    "SELECT table_name, profile FROM column_profiles WHERE namespace = ? "
+                    "ORDER BY table_name, position", (self.namespace,)).fetchall()
+                profiles: Dict[str, List[ColumnProfile]] = {}
+                for table, profile in rows:
+                    profiles.setdefault(table, []).append(ColumnProfile(**json.loads(profile)))
+                self._profiles = profiles
+            return self._profiles
+
+    def _stored_tables(self) -> Dict[str, tuple]:
+        with self._lock:
+            rows = self._connect().execute("SELECT table_name, fingerprint, profiled_at FROM profiled_tables "
+                                           "WHERE namespace = ?", (self.namespace,)).fetchall()
+        return {table: (fingerprint, profiled_at) for table, fingerprint, profiled_at in rows}
+
+    def _store(self, table: str, fingerprint: str, profiles: List[ColumnProfile]) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM column_profiles WHERE namespace = ? AND table_name = ?",
+                               (self.namespace, table))
+            connection.executemany("INSERT INTO column_profiles (namespace, table_name, position, profile) "
+                                   "VALUES (?, ?, ?, ?)",
+                                   [(self.namespace, table, position, json.dumps(asdict(profile)))
+                                    for position, profile in enumerate(profiles)])
+            connection.execute("INSERT OR REPLACE INTO profiled_tables (namespace, table_name, fingerprint, "
+                               "row_count, profiled_at) VALUES (?, ?, ?, ?, ?)",
+                               (self.namespace, table, fingerprint, profiles[0].row_count if profiles else 0,
+                                time.time()))
+            connection.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS profiled_tables (namespace TEXT, table_name TEXT, "
+                               "fingerprint TEXT, row_count INTEGER, profiled_at REAL, "
+                               "PRIMARY KEY (namespace, table_name))")
+            connection.execute("CREATE TABLE IF NOT EXISTS column_profiles (namespace TEXT, table_name TEXT, "
+                               "position INTEGER, profile TEXT, PRIMARY KEY (namespace, table_name, position))")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+
+def current_catalog() -> Optional[ProfileCatalog]:
+    """Return the catalog of the request running in the current context, None outside of requests."""
+    return _current_catalog.get()
+
+
+@contextmanager
+def use_catalog(catalog: Optional[ProfileCatalog]) -> Iterator[Optional[ProfileCatalog]]:
+    """Make a catalog the current catalog of the context while the block runs.
+
+    Args:
+        catalog: The catalog of the request's database, None for a database without profiles
+    """
+    reset = _current_catalog.set(catalog)
+    try:
+        yield catalog
+    finally:
+        _current_catalog.reset(reset)
+
+
+def type_family(column_type: Any) -> str:
+    """Return the family of a SQLAlchemy column type: integer, number, date, boolean, binary or string."""
+    if isinstance(column_type, sa.Boolean):
+        return "boolean"
+    if isinstance(column_type, (sa.Date, sa.DateTime, sa.Time)):
+        return "date"
+    if isinstance(column_type, sa.Integer):
+        return "integer"
+    if isinstance(column_type, (sa.Numeric, sa.Float)):
+        return "number"
+    if isinstance(column_type, (sa.LargeBinary, sa.types.BINARY, sa.types.VARBINARY)):
+        return "binary"
+    return "string"
+
+
+def infer_semantic_type(name: str, family: str, distinct_count: Optional[int], non_null_count: int = None,
+                        samples: List[Any] = None, key: bool = False) -> str:
+    """Infer the semantic type of a column from its name, type family and statistics.
+
+    Args:
+        name: The column name
+        family: The type family, see type_family
+        distinct_count: The number of distinct values, if known
+        non_null_count: The number of values that are not null, if known
+        samples: Some values of the column
+        key: Whether the column is part of a primary or foreign key
+
+    Returns:
+        str: The semantic type, e.g. identifier, amount, country, category or text
+    """
+    words = set(name_words(name))
+    numeric = family in ("integer", "number")
+    if key or (numeric and name.lower().endswith("id")):
+        return "identifier"
+    if family in ("date", "boolean", "binary"):
+        return family
+    for names, semantic_type in NAME_TYPES["number" if numeric else "string"]:
+        if words & names:
+            return semantic_type
+    if numeric:
+        return "number"
+    values = [value for value in samples or [] if isinstance(value, str)]
+    if values and all(re.fullmatch(r"\d{4}-\d{2}-\d{2}([ T][\d:.]+)?", value) for value in values):
+        return "date"
+    if distinct_count is not None and distinct_count <= CATEGORY_MAX_DISTINCT and \
+            (not non_null_count or distinct_count < non_null_count):
+        return "category"
+    return "text"
+
+
+def name_words(name: str) -> List[str]:
+    """Split a column name in camel or snake case into lower-cased words."""
+    return [word.lower() for word in re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+", name)]
+
+
+def _json_value(value: Any) -> Any:
+    """Convert a database value to a JSON value, long strings are cut short."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return None
+    return str(value)[:100]
+
+
+def _short(value: Any, length: int = 30) -> str:
+    text = f"{value:g}" if isinstance(value, float) else str(value).removesuffix("T00:00:00")
+    return text if len(text) <= length else text[:length - 3] + "..."
+
+
+def main(argv: List[str] = None) -> int:
+    """Profile a database from the command line, e.g. from a scheduled job."""
+    from core.gen_bi_react_agent import default_db_uri
+    from core.sql_engine import create_database
+
+    parser = argparse.ArgumentParser(description="Profile the columns of a database into the local catalog")
+    parser.add_argument("--db", help="The database URI, defaults to the agent's database")
+    parser.add_argument("--tables", help="A comma separated list of tables, defaults to all tables")
+    parser.add_argument("--force", action="store_true", help="Profile the tables even if their profiles are current")
+    parser.add_argument("--show", action="store_true", help="Print the profile hints of the tables")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    catalog = ProfileCatalog(create_database(args.db or default_db_uri()))
+    tables = [table.strip() for table in args.tables.split(",")] if args.tables else None
+    profiled = catalog.refresh(tables, force=args.force)
+    print(f"Profiled {len(profiled)} tables into {catalog.path}")
+    if args.show:
+        print(catalog.hints(tables or catalog.db.get_usable_table_names()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,91 @@
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from core.profile_catalog import ProfileCatalog, infer_semantic_type
+from core.sql_tools import ProfiledInfoSQLDatabaseTool
+
+
+def _create_database(path):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(text("create table customer (customer_id integer primary key, country text, "
+                                "email text)"))
+        connection.execute(text("create table invoice (invoice_id integer primary key, total real, "
+                                "invoice_date datetime, customer_id integer references customer(customer_id))"))
+        for i in range(1, 11):
+            connection.execute(text(f"insert into customer values ({i}, '{'USA' if i <= 6 else 'Canada'}', "
+                                    f"'c{i}@example.com')"))
+        for i in range(1, 101):
+            connection.execute(text(f"insert into invoice values ({i}, {i}, '2024-01-{i % 28 + 1:02d} 00:00:00', "
+                                    f"{i % 10 + 1})"))
+    return engine
+
+
+def _catalog(tmp_path, **options):
+    db = SQLDatabase.from_uri(f"sqlite:///{tmp_path / 'test.db'}")
+    return ProfileCatalog(db, path=str(tmp_path / "profiles.sqlite"), **options)
+
+
+def test_refresh_profiles_columns(tmp_path):
+    _create_database(tmp_path / "test.db")
+    catalog = _catalog(tmp_path, histogram_bins=4)
+    assert sorted(catalog.refresh()) == ["customer", "invoice"]
+
+    country, email = catalog.profiles("customer")[1:]
+    assert (country.semantic_type, country.distinct_count, country.top_values) == \
+        ("country", 2, [["USA", 6], ["Canada", 4]])
+    assert email.semantic_type == "email"
+
+    total = catalog.profiles("invoice")[1]
+    assert (total.semantic_type, total.min, total.max) == ("amount", 1, 100)
+    assert total.histogram["counts"] == [25, 25, 25, 25]
+    assert catalog.profiles("invoice")[-1].semantic_type == "identifier"
+
+    hints = catalog.hints(["customer", "invoice"])
+    assert "country country 2 distinct e.g. USA, Canada" in hints
+    assert "total amount 1..100" in hints
+    assert "customer_id" not in hints
+
+
+def test_refresh_is_incremental(tmp_path):
+    engine = _create_database(tmp_path / "test.db")
+    _catalog(tmp_path).refresh()
+    assert _catalog(tmp_path).refresh() == []
+
+    with engine.begin() as connection:
+        connection.execute(text("alter table customer add column city text"))
+    catalog = _catalog(tmp_path)
+    assert catalog.refresh() == ["customer"]
+    assert catalog.profiles("customer")[-1].column == "city"
+    assert sorted(_catalog(tmp_path, max_age_seconds=0).refresh()) == ["customer", "invoice"]
+
+
+def test_annotate_summary_and_schema_tool(tmp_path):
+    _create_database(tmp_path / "test.db")
+    catalog = _catalog(tmp_path)
+    catalog.refresh()
+
+    summary = {"fields": [
+        {"column": "country", "properties": {"dtype": "category", "samples": ["USA"], "num_unique_values": 2}},
+        {"column": "Sales", "properties": {"dtype": "number", "samples": [3.5], "num_unique_values": 2}},
+    ]}
+    catalog.annotate(summary)
+    assert summary["fields"][0]["properties"]["semantic_type"] == "country"
+    assert summary["fields"][0]["properties"]["description"].startswith("customer.country, 2 distinct")
+    assert summary["fields"][1]["properties"]["semantic_type"] == "amount"
+    assert summary["dataset_description"] == "A query result over the customer tables"
+
+    output = ProfiledInfoSQLDatabaseTool(db=catalog.db, profile_catalog=catalog).invoke("customer")
+    assert "CREATE TABLE customer" in output
+    assert "rows from customer table" not in output
+    assert "Column profiles:\ncustomer: country country" in output
+
+
+def test_infer_semantic_type():
+    assert infer_semantic_type("BillingCountry", "string", 24) == "country"
+    assert infer_semantic_type("TrackId", "integer", 3500) == "identifier"
+    assert infer_semantic_type("UnitPrice", "number", 2) == "amount"
+    assert infer_semantic_type("Milliseconds", "integer", 3000) == "duration"
+    assert infer_semantic_type("Status", "string", 3, 100) == "category"
+    assert infer_semantic_type("Notes", "string", 900, 1000) == "text"
+    assert infer_semantic_type("Created", "string", 900, 1000, samples=["2024-01-02 10:00:00"]) == "date"
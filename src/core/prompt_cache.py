@@ -0,0 +1,144 @@
+"""
+Local, versioned cache of the agent system prompt.
+
+The SQL agent system prompt is vendored with the package so that agents can be
+built without network access. A newer copy can be pulled from the LangChain hub
+into a local cache directory with:
+
+    python -m core.prompt_cache refresh
+"""
+import argparse
+import json
+import logging
+import os
+import pathlib
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+SQL_AGENT_PROMPT_NAME = "langchain-ai/sql-agent-system-prompt"
+VENDORED_PROMPT_PATH = pathlib.Path(__file__).parent / "prompts" / "sql_agent_system_prompt.txt"
+
+# The closing instructions to list the tables and query their schema before writing a query
+SCHEMA_DISCOVERY_PATTERN = re.compile(r"To start you should ALWAYS look at the tables.*?most relevant tables\.", re.DOTALL)
+SCHEMA_IN_PROMPT_INSTRUCTION = ("The schema of the tables most relevant to the question is given below. "
+                                "Only list the tables or query their schema if it is not sufficient.")
+
+# Display names of the SQLAlchemy dialects used in the prompt
+DIALECT_NAMES = {
+    "postgresql": "PostgreSQL",
+    "sqlite": "SQLite",
+    "mysql": "MySQL",
+    "mariadb": "MariaDB",
+    "mssql": "SQL Server",
+    "oracle": "Oracle",
+    "duckdb": "DuckDB",
+    "snowflake": "Snowflake",
+    "bigquery": "BigQuery",
+    "trino": "Trino",
+}
+
+
+def cache_dir() -> pathlib.Path:
+    """Return the directory of the local prompt cache."""
+    default = pathlib.Path.home() / ".cache" / "agentic-bi" / "prompts"
+    return pathlib.Path(os.getenv("PROMPT_CACHE_DIR", str(default)))
+
+
+def _cache_path(name: str) -> pathlib.Path:
+    # A pinned commit (owner/name:commit) replaces the cached copy of owner/name
+    return cache_dir() / (name.split(":")[0].replace("/", "__") + ".json")
+
+
+def load_prompt(name: str = SQL_AGENT_PROMPT_NAME) -> Dict[str, Any]:
+    """Load a prompt template from the local cache, falling back to the vendored copy.
+
+    Args:
+        name: The hub name of the prompt
+
+    Returns:
+        Dict[str, Any]: The template text together with its version and source
+    """
+    path = _cache_path(name)
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {
+        "name": name,
+        "template": VENDORED_PROMPT_PATH.read_text(encoding="utf-8"),
+        "version": "vendored",
+        "source": str(VENDORED_PROMPT_PATH),
+    }
+
+
+def refresh_prompt(name: str = SQL_AGENT_PROMPT_NAME) -> Dict[str, Any]:
+    """Pull the latest prompt from the LangChain hub and store it in the local cache.
+
+    Only the template text is cached, the pulled object is not persisted. When
+    the hub cannot be reached the cache is left as is.
+
+    Args:
+        name: The hub name of the prompt, optionally pinned as owner/name:commit
+
+    Returns:
+        Dict[str, Any]: The cached entry, or the entry load_prompt falls back to if the pull failed
+    """
+    from langchain import hub
+
+    try:
+        prompt_template = hub.pull(name)
+    except Exception as e:
+        logger.warning("Cannot pull %s from the hub, keeping the local copy: %s", name, e)
+        return load_prompt(name)
+    assert len(prompt_template.messages) == 1
+    entry = {
+        "name": name,
+        "template": prompt_template.messages[0].prompt.template,
+        "version": datetime.now(timezone.utc).isoformat(),
+        "source": "hub",
+    }
+    path = _cache_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, indent=2)
+    format_system_prompt.cache_clear()
+    return entry
+
+
+@lru_cache(maxsize=None)
+def format_system_prompt(dialect: str, top_k: int, schema_in_prompt: bool = False) -> str:
+    """Format the SQL agent system prompt for a database dialect.
+
+    Args:
+        dialect: The SQLAlchemy dialect name, e.g. self.db.dialect
+        top_k: The default maximum number of rows a query should return
+        schema_in_prompt: Whether the schema of the relevant tables follows the prompt, the
+            instruction to always list the tables and query their schema first is then replaced
+
+    Returns:
+        str: The formatted system message
+    """
+    template = load_prompt(SQL_AGENT_PROMPT_NAME)["template"]
+    if schema_in_prompt:
+        template = SCHEMA_DISCOVERY_PATTERN.sub(SCHEMA_IN_PROMPT_INSTRUCTION, template)
+    return template.format(dialect=DIALECT_NAMES.get(dialect, dialect), top_k=top_k)
+
+
+def main():
+    """Command line entry point to inspect or refresh the cached prompt."""
+    parser = argparse.ArgumentParser(description="Manage the locally cached agent system prompt.")
+    parser.add_argument("command", choices=["show", "refresh"])
+    parser.add_argument("--name", default=SQL_AGENT_PROMPT_NAME,
+                        help="The hub prompt to use, optionally pinned as owner/name:commit")
+    args = parser.parse_args()
+
+    entry = refresh_prompt(args.name) if args.command == "refresh" else load_prompt(args.name)
+    print(f"{entry['name']} ({entry['version']}, {entry['source']})")
+    print(entry["template"])
+
+
+if __name__ == "__main__":
+    main()
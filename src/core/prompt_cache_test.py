@@ -0,0 +1,38 @@
+from unittest.mock import patch
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from core import prompt_cache
+from core.prompt_cache import SQL_AGENT_PROMPT_NAME, format_system_prompt, load_prompt, refresh_prompt
+
+
+def test_format_system_prompt_substitutes_dialect_and_top_k(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPT_CACHE_DIR", str(tmp_path))
+    format_system_prompt.cache_clear()
+    template = prompt_cache.VENDORED_PROMPT_PATH.read_text(encoding="utf-8")
+    assert "{dialect}" in template and "{top_k}" in template
+
+    prompt = format_system_prompt("sqlite", 7)
+    assert prompt == template.format(dialect="SQLite", top_k=7)
+    assert load_prompt()["version"] == "vendored"
+    format_system_prompt.cache_clear()
+
+
+def test_refresh_writes_the_cache_and_falls_back_when_the_hub_is_unreachable(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPT_CACHE_DIR", str(tmp_path))
+    with patch("langchain.hub.pull", side_effect=ConnectionError("offline")):
+        entry = refresh_prompt()
+    assert entry["version"] == "vendored"
+    assert not list(tmp_path.iterdir())
+
+    pulled = ChatPromptTemplate.from_messages([("system", "Use {dialect}, at most {top_k} rows.")])
+    with patch("langchain.hub.pull", return_value=pulled):
+        entry = refresh_prompt()
+    assert (entry["source"], entry["template"]) == ("hub", "Use {dialect}, at most {top_k} rows.")
+    assert load_prompt(SQL_AGENT_PROMPT_NAME) == entry
+    assert format_system_prompt("postgresql", 5) == "Use PostgreSQL, at most 5 rows."
+
+    # The cached copy is kept when a later refresh fails
+    with patch("langchain.hub.pull", side_effect=ConnectionError("offline")):
+        assert refresh_prompt()["source"] == "hub"
+    format_system_prompt.cache_clear()
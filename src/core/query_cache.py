@@ -0,0 +1,201 @@
+import os
+import pickle
+import threading
+import weakref
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from core.lru_cache import LRUCache
+from core import sql_parsing
+
+
+class QueryCache:
+    """
+    A cache of SQL query results keyed by canonicalized SQL.
+
+    Statements are parsed and rendered in a canonical form, so queries that only
+    differ in whitespace, keyword or identifier casing, comments or the order of
+    AND/OR operands and IN lists share an entry. Results are kept in a byte
+    bounded LRU cache with a time-to-live. Every entry is indexed by the tables
+    it read, and a write to any of those tables invalidates it.
+    """
+
+    def __init__(self, max_bytes: int = None, ttl_seconds: float = None):
+        """Initialize the QueryCache.
+
+        Args:
+            max_bytes: The byte budget for cached results, defaults to the QUERY_CACHE_MAX_BYTES
+                environment variable or 128 MB.
+            ttl_seconds: How long a result stays valid, defaults to the QUERY_CACHE_TTL_SECONDS
+                environment variable or 5 minutes.
+        """
+        if max_bytes is None:
+            max_bytes = int(os.getenv("QUERY_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv("QUERY_CACHE_TTL_SECONDS", 300))
+
+        self._results = LRUCache(max_bytes=max_bytes, ttl_seconds=ttl_seconds,
+                                 sizeof=self._sizeof, on_evict=self._unindex)
+        self._tables: Dict[str, Set[Tuple[str, str]]] = {}
+        self._lock = threading.RLock()
+        self._watched_engines = weakref.WeakSet()
+        self._listeners: List[Callable[[Optional[Set[str]]], None]] = []
+        self.bypasses = 0
+        self.invalidations = 0
+
+    def get(self, namespace: str, sql: str, dialect: str) -> Optional[Tuple[List[str], Sequence[Sequence]]]:
+        """Return the cached result of a query.
+
+        Args:
+            namespace: Identifies the database the query runs against
+            sql: The SQL query
+            dialect: The SQLAlchemy dialect name of the database
+
+        Returns:
+            Optional[Tuple[List[str], Sequence[Sequence]]]: The cached column names and rows, or None
+        """
+        key = self._key(namespace, sql, dialect)
+        if key is None:
+            with self._lock:
+                self.bypasses += 1
+            return None
+        # Always take the cache lock before the LRU lock, eviction callbacks need it
+        with self._lock:
+            value = self._results.get(key[0])
+        return value[:2] if value is not None else None
+
+    def put(self, namespace: str, sql: str, dialect: str, columns: List[str], rows: Sequence[Sequence]) -> bool:
+        """Cache the result of a read-only, deterministic query.
+
+        Args:
+            namespace: Identifies the database the query ran against
+            sql: The SQL query
+            dialect: The SQLAlchemy dialect name of the database
+            columns: The column names of the result
+            rows: The rows of the result
+
+        Returns:
+            bool: True if the result was cached
+        """
+        key = self._key(namespace, sql, dialect)
+        if key is None:
+            return False
+        cache_key, tables = key
+        with self._lock:
+            self._results.put(cache_key, (list(columns), [tuple(row) for row in rows], tables))
+            for table in tables:
+                self._tables.setdefault(table, set()).add(cache_key)
+        return True
+
+    def invalidate_tables(self, tables: Iterable[str]) -> int:
+        """Drop every cached result that read any of the given tables.
+
+        Args:
+            tables: The names of the tables that changed
+
+        Returns:
+            int: The number of dropped results
+        """
+        tables = {table.lower() for table in tables}
+        dropped = 0
+        with self._lock:
+            for table in tables:
+                for cache_key in list(self._tables.get(table, ())):
+                    value = self._results.pop(cache_key)
+                    if value is not None:
+                        self._unindex(cache_key, value)
+                        dropped += 1
+                self._tables.pop(table, None)
+            self.invalidations += dropped
+        self._notify(tables)
+        return dropped
+
+    def invalidate_all(self) -> None:
+        """Drop every cached result."""
+        with self._lock:
+            self.invalidations += len(self._results)
+            self._results.clear()
+            self._tables.clear()
+        self._notify(None)
+
+    def add_invalidation_listener(self, listener: Callable[[Optional[Set[str]]], None]) -> None:
+        """Register a function to call whenever cached results are invalidated.
+
+        Args:
+            listener: Called with the set of changed table names, or None when everything was invalidated
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, tables: Optional[Set[str]]) -> None:
+        if tables is not None and not tables:
+            return
+        for listener in self._listeners:
+            listener(tables)
+
+    def observe(self, sql: str, dialect: str) -> None:
+        """Invalidate the tables written by a statement, if it writes.
+
+        Args:
+            sql: A statement that was executed against the database
+            dialect: The SQLAlchemy dialect name of the database
+        """
+        first_word = sql.split(None, 1)[0].lower() if sql.strip() else ""
+        if first_word in ("select", "explain", "pragma"):
+            return
+        expression = sql_parsing.parse(sql, dialect)
+        if expression is None:
+            # Unparseable statements could write anything
+            if not sql.lstrip().lower().startswith(("select", "with", "explain", "pragma")):
+                self.invalidate_all()
+            return
+        if not sql_parsing.is_read_only(expression):
+            self.invalidate_tables(sql_parsing.referenced_tables(expression))
+
+    def watch(self, engine: Engine) -> None:
+        """Invalidate cached results whenever a write runs through an engine.
+
+        Args:
+            engine: The SQLAlchemy engine to listen on
+        """
+        with self._lock:
+            if engine in self._watched_engines:
+                return
+            self._watched_engines.add(engine)
+
+        dialect = engine.dialect.name
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            self.observe(statement, dialect)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hit, miss, bypass and invalidation counters together with the current usage."""
+        stats = self._results.stats()
+        stats.update({"bypasses": self.bypasses, "invalidations": self.invalidations})
+        return stats
+
+    @staticmethod
+    def _key(namespace: str, sql: str, dialect: str) -> Optional[Tuple[Tuple[str, str], Set[str]]]:
+        """Return the cache key and referenced tables, or None if the query must not be cached."""
+        expression = sql_parsing.parse(sql, dialect)
+        if expression is None or not sql_parsing.is_read_only(expression) \
+                or not sql_parsing.is_deterministic(expression):
+            return None
+        return (namespace, sql_parsing.canonicalize(expression, dialect)), sql_parsing.referenced_tables(expression)
+
+    @staticmethod
+    def _sizeof(value: Any) -> int:
+        return len(pickle.dumps(value[:2], protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _unindex(self, cache_key: Tuple[str, str], value: Any) -> None:
+        with self._lock:
+            for table in value[2]:
+                keys = self._tables.get(table)
+                if keys is not None:
+                    keys.discard(cache_key)
+                    if not keys:
+                        del self._tables[table]
+
+query_cache = QueryCache()
@@ -0,0 +1,68 @@
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import create_engine, event, text
+
+from core.query_cache import QueryCache
+from core.sql_engine import database_namespace
+from core.sql_tools import QueryResultSQLDatabaseTool
+
+
+def test_equivalent_queries_share_an_entry():
+    """Whitespace, casing, comments and operand order do not change the cache key."""
+    cache = QueryCache(max_bytes=1024 * 1024, ttl_seconds=60)
+    cache.put("db", "select Country, total from Invoice where id in (3, 1, 2) and 1 = x", "sqlite",
+              ["Country", "Total"], [("USA", 1.0)])
+
+    cached = cache.get("db", "SELECT country,\n  TOTAL FROM invoice -- sales\nWHERE X = 1 AND ID IN (1,2,3)", "sqlite")
+    assert cached == (["Country", "Total"], [("USA", 1.0)])
+    assert cache.get("other_db", "select country, total from invoice", "sqlite") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_volatile_and_write_statements_are_not_cached():
+    cache = QueryCache(max_bytes=1024 * 1024, ttl_seconds=60)
+    assert not cache.put("db", "select random() from invoice", "sqlite", ["r"], [(1,)])
+    assert not cache.put("db", "delete from invoice", "sqlite", [], [])
+    assert cache.get("db", "select random() from invoice", "sqlite") is None
+    assert cache.stats()["bypasses"] == 1
+
+
+def test_writes_invalidate_tables(tmp_path):
+    """A write through a watched engine drops every result that read the table."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("create table invoice (id integer, total real)"))
+        connection.execute(text("create table customer (id integer)"))
+
+    cache = QueryCache(max_bytes=1024 * 1024, ttl_seconds=60)
+    cache.watch(engine)
+    cache.put("db", "select sum(total) from invoice", "sqlite", ["s"], [(None,)])
+    cache.put("db", "select count(*) from customer", "sqlite", ["c"], [(0,)])
+    cache.put("db", "select count(*) from invoice i join customer c on i.id = c.id", "sqlite", ["c"], [(0,)])
+
+    with engine.begin() as connection:
+        connection.execute(text("insert into invoice values (1, 10.0)"))
+
+    assert cache.get("db", "select sum(total) from invoice", "sqlite") is None
+    assert cache.get("db", "select count(*) from invoice i join customer c on i.id = c.id", "sqlite") is None
+    assert cache.get("db", "select count(*) from customer", "sqlite") == (["c"], [(0,)])
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_schemas_of_the_same_database_do_not_share_results(tmp_path):
+    """Two databases on the same URL with different schemas are cached apart."""
+    def regional_database(region, rows):
+        path = tmp_path / f"{region}.db"
+        with create_engine(f"sqlite:///{path}").begin() as connection:
+            connection.execute(text("create table invoice (id integer)"))
+            for i in range(rows):
+                connection.execute(text(f"insert into invoice values ({i})"))
+        engine = create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+        event.listen(engine, "connect", lambda connection, record: connection.execute(
+            f"ATTACH DATABASE '{path}' AS {region}"))
+        return SQLDatabase(engine, schema=region)
+
+    north, south = regional_database("north", 2), regional_database("south", 3)
+    assert database_namespace(north) != database_namespace(south)
+    query = "SELECT COUNT(*) AS invoices FROM invoice"
+    assert QueryResultSQLDatabaseTool(db=north).invoke(query).startswith("[(2,)]")
+    assert QueryResultSQLDatabaseTool(db=south).invoke(query).startswith("[(3,)]")
@@ -0,0 +1,165 @@
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import FrozenSet, List, Optional, Set
+
+import numpy as np
+
+from core.embeddings import HashingEmbedder
+from core.query_cache import query_cache
+
+# Words that make a question depend on the earlier conversation
+CONTEXT_DEPENDENT_WORDS = {"it", "its", "that", "those", "these", "them", "this", "previous", "above",
+                           "same", "instead", "again", "also", "now"}
+# Words that change the answer while barely changing the embedding, questions only match if they agree on them
+QUALIFIER_WORDS = {
+    "top", "bottom", "first", "last", "highest", "lowest", "most", "least", "best", "worst", "largest",
+    "smallest", "biggest", "longest", "shortest", "max", "maximum", "min", "minimum", "average", "avg", "mean",
+    "median", "total", "sum", "count", "number", "percentage", "percent", "share", "ratio", "distinct", "unique",
+    "ascending", "descending", "increasing", "decreasing", "more", "less", "fewer", "below", "over",
+    "under", "before", "after", "between", "not", "without", "except", "daily", "weekly", "monthly", "quarterly",
+    "yearly", "annual", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "twenty",
+    "hundred", "january", "february", "march", "april", "may", "june", "july", "august", "september",
+    "october", "november", "december",
+}
+
+
+@dataclass
+class AnsweredQuestion:
+    """A question that the agent answered, with the artifacts needed to replay the answer."""
+    namespace: str
+    question: str
+    sql: str
+    answer: str
+    tables: Set[str] = field(default_factory=set)
+    result_handle: Optional[str] = None
+    chart_image_id: Optional[str] = None
+    chart_code: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+
+
+class QuestionCache:
+    """
+    A similarity index of answered natural-language questions.
+
+    Each answered question is embedded and stored with the SQL that answered it
+    and the produced artifacts. A new question whose embedding is similar enough
+    to a stored one can be answered by replaying these artifacts instead of
+    running the agent. Entries are dropped when a table they read changes.
+    """
+
+    def __init__(self, embedder=None, threshold: float = None, max_entries: int = 1000):
+        """Initialize the QuestionCache.
+
+        Args:
+            embedder: An object with an embed_query method, defaults to a local HashingEmbedder
+            threshold: The minimum cosine similarity for a hit, defaults to the
+                QUESTION_CACHE_THRESHOLD environment variable or 0.8
+            max_entries: The maximum number of stored questions, the oldest are dropped first
+        """
+        if threshold is None:
+            threshold = float(os.getenv("QUESTION_CACHE_THRESHOLD", 0.8))
+
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: List[AnsweredQuestion] = []
+        self._vectors: List[np.ndarray] = []
+        self._terms: List[FrozenSet[str]] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def is_cacheable(question: str) -> bool:
+        """Return False for questions that refer to the earlier conversation."""
+        words = set(re.findall(r"[a-z]+", question.lower()))
+        return not (words & CONTEXT_DEPENDENT_WORDS)
+
+    @staticmethod
+    def key_terms(question: str) -> FrozenSet[str]:
+        """Return the numbers, years, quoted literals and qualifier words of a question.
+
+        Questions differing in these, e.g. top 5 and top 10 or 2010 and 2012, ask for
+        different answers however similar their embeddings are.
+        """
+        quoted = re.findall(r"'([^']*)'|\"([^\"]*)\"", question)
+        unquoted = re.sub(r"'[^']*'|\"[^\"]*\"", " ", question.lower())
+        numbers = re.findall(r"\d+(?:[.,]\d+)*", unquoted)
+        words = set(re.findall(r"[a-z]+", unquoted)) & QUALIFIER_WORDS
+        return frozenset([f"'{single or double}'" for single, double in quoted] + numbers + sorted(words))
+
+    def lookup(self, namespace: str, question: str) -> Optional[AnsweredQuestion]:
+        """Find the most similar answered question above the threshold.
+
+        Args:
+            namespace: Identifies the database the question is asked against
+            question: The natural-language question
+
+        Returns:
+            Optional[AnsweredQuestion]: The matching entry, or None
+        """
+        if not self.is_cacheable(question):
+            return None
+        vector = self._embed(question)
+        terms = self.key_terms(question)
+        with self._lock:
+            best, best_score = None, self.threshold
+            for entry, entry_vector, entry_terms in zip(self._entries, self._vectors, self._terms):
+                if entry.namespace != namespace or entry_terms != terms:
+                    continue
+                score = float(np.dot(vector, entry_vector))
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return best
+
+    def add(self, entry: AnsweredQuestion) -> bool:
+        """Store an answered question.
+
+        Args:
+            entry: The answered question and its artifacts
+
+        Returns:
+            bool: True if the question was stored
+        """
+        if not entry.sql or not entry.answer or not self.is_cacheable(entry.question):
+            return False
+        vector = self._embed(entry.question)
+        with self._lock:
+            self._entries.append(entry)
+            self._vectors.append(vector)
+            self._terms.append(self.key_terms(entry.question))
+            if len(self._entries) > self.max_entries:
+                del self._entries[0]
+                del self._vectors[0]
+                del self._terms[0]
+        return True
+
+    def invalidate_tables(self, tables: Optional[Set[str]]) -> None:
+        """Drop the answers that read any of the given tables, or all answers if tables is None."""
+        with self._lock:
+            keep = [i for i, entry in enumerate(self._entries)
+                    if tables is not None and not (entry.tables & tables)]
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = [self._vectors[i] for i in keep]
+            self._terms = [self._terms[i] for i in keep]
+
+    def stats(self) -> dict:
+        """Return the hit and miss counters together with the number of stored questions."""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries)}
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embedder.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+question_cache = QuestionCache()
+query_cache.add_invalidation_listener(question_cache.invalidate_tables)
@@ -0,0 +1,53 @@
+from core.question_cache import AnsweredQuestion, QuestionCache
+
+
+def _answered(question, tables):
+    return AnsweredQuestion(namespace="db", question=question, answer="USA leads with 523.06",
+                            sql="SELECT BillingCountry, SUM(Total) FROM Invoice GROUP BY BillingCountry",
+                            tables=set(tables))
+
+
+def test_similar_questions_hit():
+    cache = QuestionCache()
+    assert cache.add(_answered("total sales by country", {"invoice"}))
+
+    assert cache.lookup("db", "Show me the total sales per country").question == "total sales by country"
+    assert cache.lookup("db", "total sales by city") is None
+    assert cache.lookup("other_db", "total sales by country") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_questions_differing_in_key_terms_miss():
+    """Near misses score above the threshold but ask for different answers."""
+    # Every pair scores above 0.75 on the hashed trigram embeddings
+    pairs = [("top 5 artists by sales", "top 10 artists by sales"),
+             ("total sales by country in 2010", "total sales by country in 2012"),
+             ("total sales by country", "total sales by country in 2012"),
+             ("top customers by total spend", "bottom customers by total spend"),
+             ("average invoice amount by country", "total invoice amount by country"),
+             ("sales of genre 'Rock' by country", "sales of genre 'Jazz' by country")]
+    for stored, asked in pairs:
+        cache = QuestionCache(threshold=0.75)
+        cache.add(_answered(stored, {"invoice"}))
+        assert cache.lookup("db", asked) is None, (stored, asked)
+        assert cache.lookup("db", stored) is not None
+
+
+def test_context_dependent_questions_are_skipped():
+    cache = QuestionCache()
+    assert not cache.add(_answered("draw it as a pie chart", {"invoice"}))
+    cache.add(_answered("total sales by country", {"invoice"}))
+    assert cache.lookup("db", "now show total sales by country as a pie chart") is None
+
+
+def test_table_invalidation():
+    cache = QuestionCache()
+    cache.add(_answered("total sales by country", {"invoice"}))
+    cache.add(_answered("number of customers by country", {"customer"}))
+
+    cache.invalidate_tables({"invoice"})
+    assert cache.lookup("db", "total sales by country") is None
+    assert cache.lookup("db", "number of customers by country") is not None
+
+    cache.invalidate_tables(None)
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,272 @@
+import os
+import re
+import tempfile
+import uuid
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from core.lru_cache import LRUCache
+from core.spill_directory import SpillDirectory
+
+
+class ResultStore:
+    """
+    A class to manage query results as Arrow tables keyed by compact handles.
+
+    Query results are captured directly from the database cursor so that tools
+    can exchange a short handle instead of passing the stringified rows through
+    the language model. Tables are kept in a bounded in-memory LRU cache and
+    spilled to uncompressed Feather files when evicted, which are read back
+    through a memory map without copying. The spilled files have their own byte
+    budget and age, see core.spill_directory. Slices for display are zero-copy,
+    and the Pandas views of recently used results are cached.
+    """
+
+    HANDLE_PREFIX = "df_"
+    HANDLE_PATTERN = re.compile(r"\bdf_[0-9a-f]{12}\b")
+    ISO_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+    def __init__(self, max_memory_bytes: int = None, spill_dir: str = None, max_frames: int = 16,
+                 max_spill_bytes: int = None, spill_ttl_seconds: float = None):
+        """
+        Initialize the ResultStore.
+
+        Args:
+            max_memory_bytes: The in-memory byte budget of the Arrow tables, defaults to the
+                RESULT_STORE_MAX_BYTES environment variable or 256 MB.
+            spill_dir: The directory evicted tables are written to, defaults to the RESULT_SPILL_DIR
+                environment variable or a directory below the system temp directory.
+            max_frames: The number of Pandas views of recently used results to keep, they share
+                a quarter of the in-memory byte budget.
+            max_spill_bytes: The byte budget of the spilled tables, defaults to the
+                RESULT_SPILL_MAX_BYTES environment variable or 2 GB.
+            spill_ttl_seconds: How long a spilled table is kept after its last use, defaults to the
+                RESULT_SPILL_TTL_SECONDS environment variable or one day.
+        """
+        if max_memory_bytes is None:
+            max_memory_bytes = int(os.getenv("RESULT_STORE_MAX_BYTES", 256 * 1024 * 1024))
+        if spill_dir is None:
+            spill_dir = os.getenv("RESULT_SPILL_DIR", os.path.join(tempfile.gettempdir(), "bi_assistant_results"))
+        if max_spill_bytes is None:
+            max_spill_bytes = int(os.getenv("RESULT_SPILL_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+        if spill_ttl_seconds is None:
+            spill_ttl_seconds = float(os.getenv("RESULT_SPILL_TTL_SECONDS", 86400))
+
+        self._spill_dir = SpillDirectory(spill_dir, max_spill_bytes, spill_ttl_seconds)
+        self._tables = LRUCache(max_bytes=max_memory_bytes, sizeof=lambda table: table.nbytes,
+                                on_evict=self._spill)
+        self._frames = LRUCache(max_entries=max_frames, max_bytes=max_memory_bytes // 4,
+                                sizeof=lambda df: int(df.memory_usage(index=False).sum()))
+
+    def store(self, df: pd.DataFrame) -> str:
+        """
+        Store a dataframe and return a unique handle for it.
+
+        Args:
+            df: The dataframe to be stored.
+
+        Returns:
+            str: A compact handle that can be used to retrieve the dataframe.
+        """
+        if df is None:
+            raise ValueError("Dataframe cannot be None")
+
+        handle = self.HANDLE_PREFIX + uuid.uuid4().hex[:12]
+        self._tables.put(handle, self._to_table(df))
+        self._frames.put(handle, df)
+        return handle
+
+    def store_rows(self, columns: Sequence[str], rows: Sequence[Sequence]) -> str:
+        """
+        Build a dataframe from raw cursor rows and store it.
+
+        Args:
+            columns: The column names reported by the cursor.
+            rows: The rows fetched from the cursor.
+
+        Returns:
+            str: A compact handle that can be used to retrieve the dataframe.
+        """
+        return self.store(self.to_dataframe(columns, rows))
+
+    def load(self, handle: str) -> Optional[pd.DataFrame]:
+        """
+        Retrieve a dataframe using its handle.
+
+        Args:
+            handle: The handle of the dataframe to retrieve.
+
+        Returns:
+            Optional[pd.DataFrame]: The stored dataframe if found, None otherwise.
+        """
+        if not handle:
+            raise ValueError("Handle cannot be empty")
+
+        df = self._frames.get(handle)
+        if df is None:
+            table = self.load_table(handle)
+            if table is None:
+                return None
+            df = table.to_pandas()
+            self._frames.put(handle, df)
+        return df
+
+    def load_table(self, handle: str) -> Optional[pa.Table]:
+        """
+        Retrieve a result as an Arrow table.
+
+        Args:
+            handle: The handle of the result to retrieve.
+
+        Returns:
+            Optional[pa.Table]: The stored table, memory mapped if it was spilled, None if not found.
+        """
+        if not handle or not self.HANDLE_PATTERN.fullmatch(handle):
+            return None
+        table = self._tables.get(handle)
+        if table is not None:
+            return table
+        path = self._spill_path(handle)
+        try:
+            table = feather.read_table(path, memory_map=True)
+        except FileNotFoundError:
+            # Never spilled, or removed by a sweep
+            return None
+        self._spill_dir.touch(self._spill_name(handle))
+        return table
+
+    def slice(self, handle: str, offset: int = 0, length: int = None) -> Optional[pa.Table]:
+        """
+        Return a zero-copy slice of a stored result.
+
+        Args:
+            handle: The handle of the result.
+            offset: The first row of the slice.
+            length: The number of rows, all remaining rows if None.
+
+        Returns:
+            Optional[pa.Table]: The slice, None if the result is not found.
+        """
+        table = self.load_table(handle)
+        return table.slice(offset, length) if table is not None else None
+
+    def num_rows(self, handle: str) -> Optional[int]:
+        """Return the number of rows of a stored result, or None if it is not found."""
+        table = self.load_table(handle)
+        return table.num_rows if table is not None else None
+
+    def find_handle(self, text: str) -> Optional[str]:
+        """
+        Find the last known result handle mentioned in a piece of text.
+
+        Args:
+            text: Free text, typically a tool argument written by the agent.
+
+        Returns:
+            Optional[str]: The handle if one is found and known, None otherwise.
+        """
+        if not text:
+            return None
+        for handle in reversed(self.HANDLE_PATTERN.findall(text)):
+            if handle in self._tables or os.path.exists(self._spill_path(handle)):
+                return handle
+        return None
+
+    def resolve(self, text: str) -> Optional[pd.DataFrame]:
+        """
+        Resolve the dataframe referenced by a handle mentioned in a piece of text.
+
+        Args:
+            text: Free text, typically a tool argument written by the agent.
+
+        Returns:
+            Optional[pd.DataFrame]: The referenced dataframe if found, None otherwise.
+        """
+        handle = self.find_handle(text)
+        return self.load(handle) if handle else None
+
+    @staticmethod
+    def describe(handle: str, df: pd.DataFrame) -> str:
+        """
+        Build a compact, model-friendly description of a stored result.
+
+        Args:
+            handle: The handle of the stored dataframe.
+            df: The stored dataframe.
+
+        Returns:
+            str: The handle followed by the row count and column types.
+        """
+        columns = ", ".join(f"{name} ({dtype})" for name, dtype in df.dtypes.astype(str).items())
+        return f"result_handle: {handle}\nrows: {len(df)}\ncolumns: {columns}"
+
+    @classmethod
+    def to_dataframe(cls, columns: Sequence[str], rows: Sequence[Sequence]) -> pd.DataFrame:
+        """
+        Build a dataframe from cursor rows with dtype inference.
+
+        Decimal values are converted to floats and ISO formatted date strings
+        (as returned by SQLite) are parsed to datetimes.
+
+        Args:
+            columns: The column names reported by the cursor.
+            rows: The rows fetched from the cursor.
+
+        Returns:
+            pd.DataFrame: The typed dataframe.
+        """
+        df = pd.DataFrame.from_records([tuple(row) for row in rows], columns=cls._unique_columns(columns))
+        df = df.infer_objects()
+        for column in df.columns:
+            if not (pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])):
+                continue
+            values = df[column].dropna()
+            if values.empty:
+                continue
+            if values.map(lambda v: isinstance(v, (Decimal, int, float)) and not isinstance(v, bool)).all():
+                df[column] = pd.to_numeric(df[column].map(lambda v: float(v) if v is not None else None))
+            elif values.map(lambda v: isinstance(v, str) and cls.ISO_DATE_PATTERN.match(v) is not None).all():
+                df[column] = pd.to_datetime(df[column], format="ISO8601", errors="coerce")
+        return df
+
+    @staticmethod
+    def _unique_columns(columns: Sequence[str]) -> List[str]:
+        """Make duplicated column names (e.g. from joins) unique by suffixing them."""
+        seen: Dict[str, int] = {}
+        unique = []
+        for column in columns:
+            column = str(column)
+            if column in seen:
+                seen[column] += 1
+                unique.append(f"{column}_{seen[column]}")
+            else:
+                seen[column] = 0
+                unique.append(column)
+        return unique
+
+    @staticmethod
+    def _to_table(df: pd.DataFrame) -> pa.Table:
+        """Convert a dataframe to an Arrow table, stringifying columns of mixed Python objects."""
+        try:
+            return pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            mixed = {column: str for column in df.columns if pd.api.types.is_object_dtype(df[column])}
+            return pa.Table.from_pandas(df.astype(mixed), preserve_index=False)
+
+    @staticmethod
+    def _spill_name(handle: str) -> str:
+        return handle + ".feather"
+
+    def _spill_path(self, handle: str) -> str:
+        return self._spill_dir.file(self._spill_name(handle))
+
+    def _spill(self, handle: str, table: pa.Table) -> None:
+        """Write an evicted table to an uncompressed Feather file that can be memory mapped."""
+        self._spill_dir.write(self._spill_name(handle),
+                              lambda path: feather.write_feather(table, path, compression="uncompressed"))
+
+result_store = ResultStore()
@@ -0,0 +1,85 @@
+import os
+import pathlib
+import time
+from decimal import Decimal
+
+import pandas as pd
+from langchain_community.utilities.sql_database import SQLDatabase
+
+from core.result_store import ResultStore, result_store
+from core.sql_tools import QueryResultSQLDatabaseTool
+from core.viz_tools import VizTools
+
+
+DB_URI = "sqlite:///" + str(pathlib.Path(__file__).parent.parent.resolve() / "chinook.db")
+
+
+def test_to_dataframe_infers_dtypes():
+    """Decimals become floats, ISO dates become datetimes and duplicate columns are kept."""
+    df = ResultStore.to_dataframe(
+        ["Name", "Total", "InvoiceDate", "Name"],
+        [("Jane", Decimal("833.04"), "2009-01-01 00:00:00", "Peacock"),
+         ("Steve", Decimal("720.16"), "2009-02-01 00:00:00", "Johnson")])
+
+    assert list(df.columns) == ["Name", "Total", "InvoiceDate", "Name_1"]
+    assert pd.api.types.is_float_dtype(df["Total"])
+    assert pd.api.types.is_datetime64_any_dtype(df["InvoiceDate"])
+    assert df["Name_1"].tolist() == ["Peacock", "Johnson"]
+
+
+def test_sql_query_tool_returns_handle():
+    """The query tool captures cursor rows and the conversion tool answers without an LLM."""
+    tool = QueryResultSQLDatabaseTool(db=SQLDatabase.from_uri(DB_URI))
+    output = tool.invoke({"query": "SELECT BillingCountry, SUM(Total) AS Sales FROM Invoice "
+                                   "GROUP BY BillingCountry ORDER BY Sales DESC"})
+
+    handle = result_store.find_handle(output)
+    assert handle is not None
+    df = result_store.load(handle)
+    assert list(df.columns) == ["BillingCountry", "Sales"]
+    assert len(df) == 24
+    assert pd.api.types.is_float_dtype(df["Sales"])
+
+    VizTools.init(None)
+    converted = VizTools.convert_to_pandas.invoke({"prompt": "sales by country", "sql_query_result": output})
+    assert converted.startswith(f"result_handle: {handle}")
+    assert VizTools._load_dataframe(converted) is df
+
+
+def test_evicted_results_spill_to_feather(tmp_path):
+    """Results over the memory budget are written to disk and read back memory mapped."""
+    store = ResultStore(max_memory_bytes=10_000, spill_dir=str(tmp_path), max_frames=1)
+    first = store.store(pd.DataFrame({"n": range(1000), "name": [f"row {i}" for i in range(1000)]}))
+    second = store.store(pd.DataFrame({"n": range(1000)}))
+
+    assert (tmp_path / f"{first}.feather").exists()
+    assert store.find_handle(f"result_handle: {first}") == first
+    assert store.load(first)["name"].iloc[999] == "row 999"
+    assert store.num_rows(second) == 1000
+
+    page = store.slice(first, 990, 20)
+    assert page.num_rows == 10
+    assert page.column("n").to_pylist()[0] == 990
+    assert store.load_table("df_000000000000") is None
+
+
+def test_spilled_results_are_bounded_by_size_and_age(tmp_path):
+    """Spilled tables are removed over the budget and after the TTL, like spilled charts."""
+    store = ResultStore(max_memory_bytes=10_000, spill_dir=str(tmp_path), max_frames=1,
+                        max_spill_bytes=1_000_000, spill_ttl_seconds=3600)
+    handles = [store.store(pd.DataFrame({"n": range(1000)})) for _ in range(4)]
+    assert all((tmp_path / f"{handle}.feather").exists() for handle in handles[:3])
+
+    # Over the budget the least recently used tables go, a read marks a table as used
+    now = time.time()
+    for age, handle in zip([300, 200, 100], handles):
+        os.utime(tmp_path / f"{handle}.feather", (now - age, now - age))
+    assert store.num_rows(handles[0]) == 1000
+    store._spill_dir.max_bytes = 2.5 * os.path.getsize(tmp_path / f"{handles[0]}.feather")
+    store.store(pd.DataFrame({"n": range(1000)}))
+    assert [store.num_rows(handle) for handle in handles] == [1000, None, None, 1000]
+    assert store.find_handle(f"result_handle: {handles[1]}") is None
+
+    store._spill_dir.ttl_seconds = 0
+    store._spill_dir.sweep()
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,620 @@
+"""
+Materialized rollups of frequently asked aggregations.
+
+The agent asks the same aggregations again and again, e.g. sales by country or
+by month. Every aggregation query it runs is reduced to a pattern: its tables,
+joins and filter, its GROUP BY dimensions and the decomposable aggregates it
+needs (SUM, COUNT, MIN and MAX, AVG as SUM and COUNT). A pattern seen
+ROLLUP_MIN_OCCURRENCES times is materialized into a table of a local SQLite
+file, aggregated by its dimensions, in a background thread.
+
+A later query with the same tables, joins and filter whose dimensions and
+aggregates are covered by a rollup is rewritten to re-aggregate the rollup and
+answered locally, without touching the database. Rollups are refreshed every
+ROLLUP_REFRESH_SECONDS, and are not used when they are older than
+ROLLUP_MAX_STALENESS_SECONDS or when a write through the engine touched one of
+their tables since their last refresh.
+
+Usage:
+    python -m core.rollups --db sqlite:///chinook.db [--refresh]
+"""
+import argparse
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import sqlglot
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import event, text
+from sqlglot import exp
+
+from core import sql_parsing
+from core.lru_cache import LRUCache
+from core.sql_engine import STATEMENT_TIMEOUT_SECONDS, database_namespace, statement_connection
+
+logger = logging.getLogger(__name__)
+
+# The measures the aggregate functions are computed from
+DECOMPOSABLE_AGGREGATES = {exp.Sum: ["sum"], exp.Count: ["count"], exp.Min: ["min"], exp.Max: ["max"],
+                           exp.Avg: ["sum", "count"]}
+# Expressions that can be grouped by and are replaced by a dimension column of a rollup
+DIMENSION_EXPRESSIONS = (exp.Column, exp.Func, exp.Binary, exp.Cast, exp.Paren, exp.Case, exp.Unary)
+
+
+@dataclass
+class AggregationPattern:
+    """The aggregation a query computes, independent of how it orders or limits the groups."""
+    source: str
+    source_key: str
+    dimensions: List[str]
+    dimension_keys: List[str]
+    measures: List[List[str]] = field(default_factory=list)
+    tables: List[str] = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        text_key = self.source_key + "|" + "|".join(sorted(self.dimension_keys))
+        return hashlib.sha1(text_key.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def measure_keys(self) -> List[Tuple[str, str]]:
+        """The measures as (function, canonical argument) pairs."""
+        return [(function, argument_key) for function, _, argument_key in self.measures]
+
+
+@dataclass
+class Rollup:
+    """A mined aggregation pattern and the state of its materialized table."""
+    pattern: AggregationPattern
+    occurrences: int = 0
+    status: str = "candidate"
+    rows: int = 0
+    refreshed_at: float = 0.0
+    hits: int = 0
+    stale: bool = False
+    outdated_measures: bool = False
+
+    @property
+    def key(self) -> str:
+        return self.pattern.key
+
+    @property
+    def table(self) -> str:
+        return f"rollup_{self.key}"
+
+
+def analyze(sql: str, dialect: str) -> Optional[Tuple[AggregationPattern, exp.Select]]:
+    """Reduce an aggregation query to its pattern.
+
+    Only single SELECT statements with a GROUP BY and without subqueries, CTEs,
+    window functions, DISTINCT or non-decomposable aggregates qualify.
+
+    Args:
+        sql: The query
+        dialect: The SQLAlchemy dialect name of the database
+
+    Returns:
+        Optional[Tuple[AggregationPattern, exp.Select]]: The pattern and the parsed query, or None
+    """
+    expression = sql_parsing.parse(sql, dialect)
+    if not isinstance(expression, exp.Select) or not expression.args.get("group"):
+        return None
+    if any(expression.args.get(arg) for arg in ("with_", "distinct", "qualify", "windows", "sample")):
+        return None
+    group = expression.args["group"]
+    if any(group.args.get(arg) for arg in ("grouping_sets", "cube", "rollup", "totals")):
+        return None
+    if any(select is not expression for select in expression.find_all(exp.Select)) or \
+            any(expression.find_all(exp.Window)) or not sql_parsing.is_deterministic(expression):
+        return None
+
+    read = sql_parsing.sqlglot_dialect(dialect)
+    projections = expression.expressions
+    aliases = {projection.alias.lower(): projection.this for projection in projections
+               if isinstance(projection, exp.Alias)}
+    dimensions = []
+    for item in group.expressions:
+        if isinstance(item, exp.Literal) and item.is_int:
+            position = int(item.name) - 1
+            if not 0 <= position < len(projections):
+                return None
+            item = projections[position].unalias()
+        elif isinstance(item, exp.Column) and not item.table and item.name.lower() in aliases:
+            item = aliases[item.name.lower()]
+        if not isinstance(item, DIMENSION_EXPRESSIONS) or item.find(exp.AggFunc):
+            return None
+        dimensions.append(item)
+
+    measures = {}
+    for part in [*projections, expression.args.get("having"), expression.args.get("order")]:
+        for aggregate in part.find_all(exp.AggFunc) if part is not None else []:
+            functions = DECOMPOSABLE_AGGREGATES.get(type(aggregate))
+            argument = aggregate.this
+            if functions is None or argument is None or isinstance(argument, exp.Distinct) or \
+                    argument.find(exp.AggFunc) or aggregate.expressions:
+                return None
+            argument_sql = "*" if isinstance(argument, exp.Star) else argument.sql(dialect=read)
+            argument_key = "*" if isinstance(argument, exp.Star) else sql_parsing.canonicalize(argument, dialect)
+            for function in functions:
+                measures[(function, argument_key)] = [function, argument_sql, argument_key]
+
+    source = expression.copy()
+    for arg in ("group", "having", "order", "limit", "offset"):
+        source.set(arg, None)
+    source.set("expressions", [exp.Star()])
+    pattern = AggregationPattern(
+        source=source.sql(dialect=read), source_key=sql_parsing.canonicalize(source, dialect),
+        dimensions=[dimension.sql(dialect=read) for dimension in dimensions],
+        dimension_keys=[sql_parsing.canonicalize(dimension, dialect) for dimension in dimensions],
+        measures=sorted(measures.values()), tables=sorted(sql_parsing.referenced_tables(expression)))
+    return pattern, expression
+
+
+def rewrite(expression: exp.Select, pattern: AggregationPattern, rollup: Rollup, dialect: str) -> Optional[str]:
+    """Rewrite an aggregation query to re-aggregate a rollup whose dimensions and measures cover it.
+
+    Queries with unaliased computed columns are not rewritten, their column names depend on the database.
+
+    Args:
+        expression: The parsed query
+        pattern: The pattern of the query, see analyze
+        rollup: The rollup to read from
+        dialect: The SQLAlchemy dialect name of the database
+
+    Returns:
+        Optional[str]: The query against the rollup table in SQLite, or None if it cannot be rewritten
+    """
+    rollup_dimensions = {key: f"d{index}" for index, key in enumerate(rollup.pattern.dimension_keys)}
+    # Only the dimensions of the query, columns it does not group by stay unresolved
+    dimensions = {key: rollup_dimensions[key] for key in pattern.dimension_keys}
+    measures = {key: f"m{index}" for index, key in enumerate(rollup.pattern.measure_keys)}
+
+    def measure(function: str, argument: exp.Expression) -> exp.Column:
+        argument_key = "*" if isinstance(argument, exp.Star) else sql_parsing.canonicalize(argument, dialect)
+        return exp.column(measures[(function, argument_key)])
+
+    def replace(node: exp.Expression) -> exp.Expression:
+        if isinstance(node, exp.AggFunc):
+            if isinstance(node, exp.Avg):
+                total = exp.Cast(this=exp.Sum(this=measure("sum", node.this)), to=exp.DataType.build("REAL"))
+                return exp.Paren(this=exp.Div(this=total, expression=exp.Sum(this=measure("count", node.this))))
+            function = DECOMPOSABLE_AGGREGATES[type(node)][0]
+            # Counts add up, sums, minimums and maximums aggregate to themselves
+            combine = exp.Sum if function == "count" else type(node)
+            return combine(this=measure(function, node.this))
+        if isinstance(node, DIMENSION_EXPRESSIONS):
+            key = sql_parsing.canonicalize(node, dialect)
+            if key in dimensions:
+                return exp.column(dimensions[key])
+        return node
+
+    rewritten = exp.Select()
+    projections = []
+    for projection in expression.expressions:
+        if not isinstance(projection, (exp.Alias, exp.Column)):
+            # The database names computed columns in its own way, e.g. "AVG(total)" or "avg"
+            return None
+        new_projection = projection.copy().transform(replace)
+        if new_projection.alias_or_name != projection.alias_or_name:
+            # Keep the column names of the original result
+            new_projection = exp.alias_(new_projection.unalias(), projection.alias_or_name)
+        projections.append(new_projection)
+    rewritten.set("expressions", projections)
+    rewritten.set("from_", exp.From(this=exp.to_table(rollup.table)))
+    rewritten.set("group", exp.Group(expressions=[exp.column(dimensions[key]) for key in pattern.dimension_keys]))
+    for arg in ("having", "order", "limit", "offset"):
+        if expression.args.get(arg) is not None:
+            rewritten.set(arg, expression.args[arg].copy().transform(replace))
+
+    # Every column must now be a rollup column or an output alias
+    allowed = {name.lower() for name in list(dimensions.values()) + list(measures.values())}
+    allowed.update(projection.alias.lower() for projection in expression.expressions
+                   if isinstance(projection, exp.Alias))
+    if any(column.table or column.name.lower() not in allowed for column in rewritten.find_all(exp.Column)):
+        return None
+    return rewritten.sql(dialect="sqlite")
+
+
+class RollupManager:
+    """
+    Mines the aggregation queries run against a database, materializes the
+    frequent ones into local rollup tables and answers covered queries from them.
+
+    The rollups and their statistics are kept in a SQLite file per database,
+    so they survive restarts.
+    """
+
+    def __init__(self, db: SQLDatabase, path: str = None, min_occurrences: int = None, max_rows: int = None,
+                 refresh_seconds: float = None, max_staleness_seconds: float = None, background: bool = True,
+                 statement_timeout_seconds: float = None):
+        """Initialize the RollupManager.
+
+        Args:
+            db: The database whose queries are mined
+            path: The SQLite file of the rollups, defaults to a file per database below the
+                ROLLUP_DIR environment variable or ~/.cache/agentic-bi/rollups
+            min_occurrences: The number of times a pattern is run before it is materialized, defaults
+                to the ROLLUP_MIN_OCCURRENCES environment variable or 3
+            max_rows: The maximum number of groups of a rollup, defaults to the ROLLUP_MAX_ROWS
+                environment variable or 100000
+            refresh_seconds: The interval of the scheduled refresh, defaults to the
+                ROLLUP_REFRESH_SECONDS environment variable or 900
+            max_staleness_seconds: The age after which a rollup is no longer used, defaults to the
+                ROLLUP_MAX_STALENESS_SECONDS environment variable or 3600
+            background: Whether rollups are materialized in a background thread
+            statement_timeout_seconds: The time after which a materialization is cancelled, defaults
+                to the SQL_STATEMENT_TIMEOUT_SECONDS environment variable or 30 seconds
+        """
+        self.db = db
+        namespace = database_namespace(db)
+        if path is None:
+            default_dir = pathlib.Path.home() / ".cache" / "agentic-bi" / "rollups"
+            rollup_dir = pathlib.Path(os.getenv("ROLLUP_DIR", str(default_dir)))
+            path = str(rollup_dir / (hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:16] + ".sqlite"))
+        self.path = path
+        self.min_occurrences = min_occurrences if min_occurrences is not None else \
+            int(os.getenv("ROLLUP_MIN_OCCURRENCES", "3"))
+        self.max_rows = max_rows if max_rows is not None else int(os.getenv("ROLLUP_MAX_ROWS", "100000"))
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else \
+            float(os.getenv("ROLLUP_REFRESH_SECONDS", "900"))
+        self.max_staleness_seconds = max_staleness_seconds if max_staleness_seconds is not None else \
+            float(os.getenv("ROLLUP_MAX_STALENESS_SECONDS", "3600"))
+        self.background = background
+        self.statement_timeout_seconds = statement_timeout_seconds if statement_timeout_seconds is not None else \
+            STATEMENT_TIMEOUT_SECONDS
+        self.lookups = 0
+        self.hits = 0
+        self._analyses = LRUCache(max_entries=256)
+        self._rollups: Optional[Dict[str, Rollup]] = None
+        self._materializing = set()
+        self._connection = None
+        self._lock = threading.RLock()
+        self._executor = None
+        self._scheduler = None
+        self._stop = threading.Event()
+        self._watch()
+
+    def answer(self, sql: str) -> Optional[Tuple[List[str], List[tuple], Rollup]]:
+        """Answer an aggregation query from a fresh rollup that covers it.
+
+        Args:
+            sql: The query
+
+        Returns:
+            Optional[Tuple[List[str], List[tuple], Rollup]]: The column names, rows and the rollup
+            used, or None if no rollup covers the query
+        """
+        analysis = self._analyze(sql)
+        if analysis is None:
+            return None
+        pattern, expression = analysis
+        with self._lock:
+            self.lookups += 1
+            candidates = [rollup for rollup in self._load().values()
+                          if self._usable(rollup) and rollup.pattern.source_key == pattern.source_key
+                          and set(pattern.dimension_keys) <= set(rollup.pattern.dimension_keys)
+                          and set(pattern.measure_keys) <= set(rollup.pattern.measure_keys)]
+        for rollup in sorted(candidates, key=lambda candidate: candidate.rows):
+            rewritten = rewrite(expression, pattern, rollup, self.db.dialect)
+            if rewritten is None:
+                continue
+            with self._lock:
+                cursor = self._connect().execute(rewritten)
+                columns = [description[0] for description in cursor.description]
+                rows = cursor.fetchall()
+                self.hits += 1
+                rollup.hits += 1
+                self._connect().execute("UPDATE rollups SET hits = hits + 1 WHERE key = ?", (rollup.key,))
+                self._connect().commit()
+            logger.debug("Answered from rollup %s: %s", rollup.key, rewritten)
+            return columns, rows, rollup
+        return None
+
+    def record(self, sql: str) -> Optional[Rollup]:
+        """Count an executed query towards its aggregation pattern, materializing frequent patterns.
+
+        Args:
+            sql: A query that ran successfully
+
+        Returns:
+            Optional[Rollup]: The rollup of the query's pattern, or None if it is not an aggregation
+        """
+        analysis = self._analyze(sql)
+        if analysis is None:
+            return None
+        pattern = analysis[0]
+        with self._lock:
+            rollups = self._load()
+            rollup = rollups.setdefault(pattern.key, Rollup(pattern=pattern))
+            rollup.occurrences += 1
+            known = set(rollup.pattern.measure_keys)
+            new_measures = [measure for measure in pattern.measures if (measure[0], measure[2]) not in known]
+            if new_measures:
+                # The next materialization also computes the measures of this query
+                rollup.pattern.measures = sorted(rollup.pattern.measures + new_measures)
+                rollup.outdated_measures = rollup.status == "ready"
+            due = rollup.occurrences >= self.min_occurrences and rollup.key not in self._materializing and \
+                (rollup.status == "candidate" or rollup.outdated_measures)
+            self._save(rollup)
+        if due:
+            self._submit(rollup.key)
+        return rollup
+
+    def refresh(self, force: bool = False) -> List[str]:
+        """Rematerialize the rollups that are due for a refresh.
+
+        Args:
+            force: Whether to refresh every materialized rollup
+
+        Returns:
+            List[str]: The keys of the refreshed rollups
+        """
+        now = time.time()
+        with self._lock:
+            due = [rollup.key for rollup in self._load().values() if rollup.status == "ready" and
+                   (force or rollup.stale or rollup.outdated_measures or
+                    now - rollup.refreshed_at >= self.refresh_seconds)]
+        return [key for key in due if self.materialize(key)]
+
+    def materialize(self, key: str) -> bool:
+        """Compute a rollup on the database and replace its local table.
+
+        Args:
+            key: The key of the rollup
+
+        Returns:
+            bool: True if the rollup was materialized
+        """
+        with self._lock:
+            rollup = self._load().get(key)
+            if rollup is None or key in self._materializing:
+                return False
+            self._materializing.add(key)
+            pattern = AggregationPattern(**asdict(rollup.pattern))
+        try:
+            start = time.time()
+            columns = [f"d{index}" for index in range(len(pattern.dimensions))] + \
+                      [f"m{index}" for index in range(len(pattern.measures))]
+            with statement_connection(self.db, self.statement_timeout_seconds) as connection:
+                cursor = connection.execute(text(self._materialization_sql(pattern)))
+                rows = cursor.fetchmany(self.max_rows + 1)
+            if len(rows) > self.max_rows:
+                logger.info("Rollup %s has more than %d groups and is not kept", key, self.max_rows)
+                self._finish(key, "too_large", 0, start)
+                return False
+            table = f"rollup_{key}"
+            with self._lock:
+                connection = self._connect()
+                connection.execute(f'DROP TABLE IF EXISTS "{table}_new"')
+                connection.execute(f'CREATE TABLE "{table}_new" ({", ".join(columns)})')
+                connection.executemany(f'INSERT INTO "{table}_new" VALUES ({", ".join("?" * len(columns))})',
+                                       [tuple(_sqlite_value(value) for value in row) for row in rows])
+                connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+                connection.execute(f'ALTER TABLE "{table}_new" RENAME TO "{table}"')
+                rollup.pattern.measures = pattern.measures
+                self._finish(key, "ready", len(rows), start)
+            logger.info("Materialized rollup %s with %d groups in %.0f ms", key, len(rows),
+                        (time.time() - start) * 1000)
+            return True
+        except Exception as e:
+            logger.warning("Cannot materialize rollup %s: %s", key, e)
+            self._finish(key, "failed", 0, time.time())
+            return False
+        finally:
+            with self._lock:
+                self._materializing.discard(key)
+
+    def observe(self, sql: str) -> None:
+        """Mark the rollups over the tables written by a statement as stale.
+
+        Args:
+            sql: A statement that was executed against the database
+        """
+        first_word = sql.split(None, 1)[0].lower() if sql.strip() else ""
+        if first_word in ("select", "explain", "pragma", "with"):
+            return
+        expression = sql_parsing.parse(sql, self.db.dialect)
+        if expression is not None and sql_parsing.is_read_only(expression):
+            return
+        written = sql_parsing.referenced_tables(expression) if expression is not None else None
+        with self._lock:
+            for rollup in self._load().values():
+                # Unparseable statements could write any table
+                if rollup.status == "ready" and not rollup.stale and \
+                        (written is None or written & set(rollup.pattern.tables)):
+                    rollup.stale = True
+                    self._save(rollup)
+
+    def start(self) -> None:
+        """Start refreshing the rollups every refresh_seconds in a background thread."""
+        with self._lock:
+            if self._scheduler is not None or self.refresh_seconds <= 0:
+                return
+            self._stop.clear()
+            self._scheduler = threading.Thread(target=self._run_scheduler, name="rollup-refresh", daemon=True)
+            self._scheduler.start()
+
+    def close(self) -> None:
+        """Stop the scheduled refresh and wait for running materializations."""
+        self._stop.set()
+        with self._lock:
+            scheduler, self._scheduler = self._scheduler, None
+            executor, self._executor = self._executor, None
+        if scheduler is not None:
+            scheduler.join()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hit rate of this process and the state and staleness of every rollup."""
+        now = time.time()
+        with self._lock:
+            rollups = [{"key": rollup.key, "status": rollup.status, "tables": rollup.pattern.tables,
+                        "dimensions": rollup.pattern.dimensions,
+                        "measures": [f"{function}({argument})" for function, argument, _ in rollup.pattern.measures],
+                        "occurrences": rollup.occurrences, "rows": rollup.rows, "hits": rollup.hits,
+                        "age_seconds": round(now - rollup.refreshed_at, 1) if rollup.refreshed_at else None,
+                        "stale": rollup.status == "ready" and not self._usable(rollup)}
+                       for rollup in self._load().values()]
+            return {"lookups": self.lookups, "hits": self.hits,
+                    "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                    "rollups": sorted(rollups, key=lambda rollup: -rollup["occurrences"])}
+
+    def _usable(self, rollup: Rollup) -> bool:
+        return rollup.status == "ready" and not rollup.stale and \
+            time.time() - rollup.refreshed_at <= self.max_staleness_seconds
+
+    def _analyze(self, sql: str) -> Optional[Tuple[AggregationPattern, exp.Select]]:
+        cached = self._analyses.get(sql)
+        if cached is None:
+            cached = analyze(sql, self.db.dialect) or False
+            self._analyses.put(sql, cached)
+        return cached or None
+
+    def _materialization_sql(self, pattern: AggregationPattern) -> str:
+        """Build the query computing a rollup on the database."""
+        read = sql_parsing.sqlglot_dialect(self.db.dialect)
+        select = sqlglot.parse_one(pattern.source, read=read)
+        dimensions = [sqlglot.parse_one(dimension, read=read) for dimension in pattern.dimensions]
+        aggregates = {"sum": exp.Sum, "count": exp.Count, "min": exp.Min, "max": exp.Max}
+        measures = [aggregates[function](this=exp.Star() if argument == "*" else sqlglot.parse_one(argument, read=read))
+                    for function, argument, _ in pattern.measures]
+        select.set("expressions", [exp.alias_(dimension, f"d{index}") for index, dimension in enumerate(dimensions)] +
+                   [exp.alias_(measure, f"m{index}") for index, measure in enumerate(measures)])
+        select.set("group", exp.Group(expressions=[dimension.copy() for dimension in dimensions]))
+        return select.sql(dialect=read)
+
+    def _submit(self, key: str) -> None:
+        if not self.background:
+            self.materialize(key)
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rollup-materialize")
+            self._executor.submit(self.materialize, key)
+
+    def _run_scheduler(self) -> None:
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Scheduled rollup refresh failed: %s", e)
+
+    def _finish(self, key: str, status: str, rows: int, refreshed_at: float) -> None:
+        with self._lock:
+            rollup = self._load()[key]
+            rollup.status, rollup.rows = status, rows
+            if status == "ready":
+                rollup.refreshed_at, rollup.stale, rollup.outdated_measures = refreshed_at, False, False
+            self._save(rollup)
+
+    def _watch(self) -> None:
+        engine = self.db._engine
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            self.observe(statement)
+
+    def _load(self) -> Dict[str, Rollup]:
+        with self._lock:
+            if self._rollups is None:
+                rows = self._connect().execute("SELECT pattern, occurrences, status, rows, refreshed_at, hits, "
+                                               "stale FROM rollups").fetchall()
+                rollups = {}
+                for pattern, occurrences, status, rows_count, refreshed_at, hits, stale in rows:
+                    rollup = Rollup(pattern=AggregationPattern(**json.loads(pattern)), occurrences=occurrences,
+                                    status=status, rows=rows_count, refreshed_at=refreshed_at, hits=hits,
+                                    stale=bool(stale))
+                    rollups[rollup.key] = rollup
+                self._rollups = rollups
+            return self._rollups
+
+    def _save(self, rollup: Rollup) -> None:
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO rollups (key, pattern, occurrences, status, rows, refreshed_at, hits, stale) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (rollup.key, json.dumps(asdict(rollup.pattern)), rollup.occurrences, rollup.status, rollup.rows,
+                 rollup.refreshed_at, rollup.hits, int(rollup.stale)))
+            self._connect().commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS rollups (key TEXT PRIMARY KEY, pattern TEXT, "
+                               "occurrences INTEGER, status TEXT, rows INTEGER, refreshed_at REAL, hits INTEGER, "
+                               "stale INTEGER)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+
+def _sqlite_value(value: Any) -> Any:
+    """Convert a database value to a value SQLite can store."""
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value.isoformat()
+    return str(value)
+
+
+_managers: Dict[str, RollupManager] = {}
+_managers_lock = threading.Lock()
+
+
+def rollup_manager(db: SQLDatabase) -> Optional[RollupManager]:
+    """Return the rollup manager shared by the tools of a database, None if ROLLUPS is 0.
+
+    The manager is created and its scheduled refresh started on first use.
+
+    Args:
+        db: The database
+
+    Returns:
+        Optional[RollupManager]: The manager
+    """
+    if os.getenv("ROLLUPS", "1") == "0":
+        return None
+    namespace = database_namespace(db)
+    with _managers_lock:
+        manager = _managers.get(namespace)
+        if manager is None:
+            manager = _managers[namespace] = RollupManager(db)
+            manager.start()
+        return manager
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """Report the rollups of a database and their hit counts and staleness, optionally refreshing them."""
+    from core.gen_bi_react_agent import default_db_uri
+    from core.sql_engine import create_database
+
+    parser = argparse.ArgumentParser(description="Report and refresh the materialized rollups of a database")
+    parser.add_argument("--db", help="The database URI, defaults to the agent's database")
+    parser.add_argument("--refresh", action="store_true", help="Rematerialize every rollup")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    manager = RollupManager(create_database(args.db or default_db_uri()), background=False)
+    if args.refresh:
+        print(f"Refreshed {len(manager.refresh(force=True))} rollups")
+    print(json.dumps(manager.stats()["rollups"], indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
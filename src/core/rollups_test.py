@@ -0,0 +1,135 @@
+import time
+
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import create_engine, event, text
+
+from core.rollups import RollupManager, analyze
+from core.sql_tools import QueryResultSQLDatabaseTool
+
+
+def _create_database(path):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(text("create table invoice (invoice_id integer primary key, country text, "
+                                "city text, total real)"))
+        for i in range(1, 61):
+            connection.execute(text(f"insert into invoice values ({i}, '{['USA', 'Canada', 'France'][i % 3]}', "
+                                    f"'city{i % 5}', {i})"))
+    return engine
+
+
+def _manager(tmp_path, **options):
+    db = SQLDatabase.from_uri(f"sqlite:///{tmp_path / 'test.db'}")
+    return RollupManager(db, path=str(tmp_path / "rollups.sqlite"), min_occurrences=2, background=False, **options)
+
+
+def _run(engine, sql):
+    with engine.connect() as connection:
+        result = connection.execute(text(sql))
+        return list(result.keys()), [tuple(row) for row in result.fetchall()]
+
+
+def test_analyze_decomposes_aggregations():
+    pattern, _ = analyze("SELECT country AS c, AVG(total), COUNT(*) FROM invoice WHERE total > 5 GROUP BY 1 "
+                         "ORDER BY 2 DESC LIMIT 3", "sqlite")
+    assert pattern.dimensions == ["country"]
+    assert pattern.measure_keys == [("count", "*"), ("count", "total"), ("sum", "total")]
+    same, _ = analyze("select country, count(*) from invoice where total > 5 group by country", "sqlite")
+    assert same.key == pattern.key
+
+    assert analyze("SELECT country, COUNT(DISTINCT city) FROM invoice GROUP BY country", "sqlite") is None
+    assert analyze("SELECT country, total FROM invoice", "sqlite") is None
+    assert analyze("SELECT country, COUNT(*) FROM invoice WHERE total > (SELECT AVG(total) FROM invoice) "
+                   "GROUP BY country", "sqlite") is None
+
+
+def test_frequent_aggregation_is_materialized_and_answered(tmp_path):
+    engine = _create_database(tmp_path / "test.db")
+    manager = _manager(tmp_path)
+    query = "SELECT country, city, SUM(total) AS revenue, AVG(total) AS average FROM invoice " \
+            "GROUP BY country, city"
+    assert manager.answer(query) is None
+    manager.record(query)
+    assert manager.stats()["rollups"][0]["status"] == "candidate"
+    manager.record(query)
+    assert manager.stats()["rollups"][0]["status"] == "ready"
+
+    columns, rows, rollup = manager.answer(query + " ORDER BY 1, 2")
+    assert (columns, rows) == _run(engine, query + " ORDER BY 1, 2")
+
+    # Coarser groupings of the same rows re-aggregate the rollup
+    coarser = "SELECT country, AVG(total) AS average FROM invoice GROUP BY country " \
+              "HAVING SUM(total) > 500 ORDER BY average DESC"
+    columns, rows, coarse_rollup = manager.answer(coarser)
+    assert coarse_rollup.key == rollup.key
+    expected_columns, expected_rows = _run(engine, coarser)
+    assert columns == expected_columns
+    assert [row[0] for row in rows] == [row[0] for row in expected_rows]
+    assert [round(row[1], 6) for row in rows] == [round(row[1], 6) for row in expected_rows]
+
+    # Unaliased computed columns are named by the database
+    assert manager.answer("SELECT country, SUM(total) FROM invoice GROUP BY country") is None
+    # A different filter is a different aggregation
+    assert manager.answer("SELECT country, SUM(total) FROM invoice WHERE total > 10 GROUP BY country") is None
+
+    stats = manager.stats()
+    assert (stats["lookups"], stats["hits"], stats["hit_rate"]) == (5, 2, 0.4)
+    assert stats["rollups"][0]["hits"] == 2
+
+
+def test_writes_make_rollups_stale_until_refreshed(tmp_path):
+    _create_database(tmp_path / "test.db")
+    manager = _manager(tmp_path)
+    query = "SELECT country, COUNT(*) AS invoices FROM invoice GROUP BY country ORDER BY country"
+    manager.record(query)
+    manager.record(query)
+    assert manager.answer(query)[1] == [("Canada", 20), ("France", 20), ("USA", 20)]
+
+    with manager.db._engine.begin() as connection:
+        connection.execute(text("insert into invoice values (100, 'USA', 'city1', 10)"))
+    assert manager.answer(query) is None
+    assert manager.stats()["rollups"][0]["stale"] is True
+    # The flag survives restarts
+    assert _manager(tmp_path).answer(query) is None
+
+    assert len(manager.refresh()) == 1
+    assert manager.answer(query)[1] == [("Canada", 20), ("France", 20), ("USA", 21)]
+    assert _manager(tmp_path, max_staleness_seconds=0).answer(query) is None
+
+
+def test_tool_output_mentions_the_age_of_the_rollup(tmp_path):
+    _create_database(tmp_path / "test.db")
+    manager = _manager(tmp_path)
+    tool = QueryResultSQLDatabaseTool(db=manager.db, rollups=manager)
+    query = "SELECT country, COUNT(*) AS invoices FROM invoice GROUP BY country"
+    assert "rollup" not in tool.invoke(query)
+    manager.record(query)
+
+    # Other queries than the recorded one, which the query cache answers
+    output = tool.invoke(query + " ORDER BY country")
+    assert "('Canada', 20), ('France', 20), ('USA', 20)" in output
+    assert "answered from a rollup refreshed less than a minute ago" in output
+    for rollup in manager._load().values():
+        rollup.refreshed_at -= 600
+    assert "refreshed 10 minutes ago" in tool.invoke(query + " ORDER BY country DESC")
+
+
+def test_rollups_are_materialized_in_the_schema_of_the_database_with_a_timeout(tmp_path):
+    _create_database(tmp_path / "sales.db")
+    engine = create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+    event.listen(engine, "connect", lambda connection, record: connection.execute(
+        f"ATTACH DATABASE '{tmp_path / 'sales.db'}' AS sales"))
+    manager = RollupManager(SQLDatabase(engine, schema="sales"), path=str(tmp_path / "rollups.sqlite"),
+                            min_occurrences=1, background=False)
+    query = "SELECT country, COUNT(*) AS invoices FROM invoice GROUP BY country ORDER BY country"
+    manager.record(query)
+    assert manager.answer(query)[1] == [("Canada", 20), ("France", 20), ("USA", 20)]
+
+    # Materializations running longer than the statement timeout are cancelled
+    manager.statement_timeout_seconds = 0.2
+    endless = "SELECT a.country, COUNT(*) AS n FROM invoice a, invoice b, invoice c, invoice d, invoice e " \
+              "GROUP BY a.country"
+    start = time.monotonic()
+    manager.record(endless)
+    assert time.monotonic() - start < 5
+    assert [rollup["status"] for rollup in manager.stats()["rollups"]].count("failed") == 1
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import pathlib
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import inspect
+
+from core.embeddings import HashingEmbedder
+from core.lru_cache import LRUCache
+from core.sql_engine import database_namespace
+
+
+class SchemaIndex:
+    """
+    A retrieval index over the tables of a database.
+
+    The index is built once from SQLAlchemy reflection and holds, per table, the
+    column names and types, comments, primary and foreign keys and an embedding
+    of all of them. It is persisted to disk, and rebuilding it only re-embeds
+    tables whose reflected definition changed. For a question, the top-k most
+    similar tables and their foreign-key neighbours can be described compactly
+    so that only the relevant part of the schema reaches the prompt.
+    """
+
+    VERSION = 1
+
+    def __init__(self, db: SQLDatabase, path: str = None, embedder=None):
+        """Initialize the SchemaIndex.
+
+        Args:
+            db: The database to index
+            path: The file to persist the index to, defaults to a file per database below the
+                SCHEMA_INDEX_DIR environment variable or ~/.cache/agentic-bi/schema_index
+            embedder: An object with an embed_query method, defaults to a local HashingEmbedder
+        """
+        self.db = db
+        self.embedder = embedder or HashingEmbedder()
+        if path is None:
+            namespace = database_namespace(db)
+            default_dir = pathlib.Path.home() / ".cache" / "agentic-bi" / "schema_index"
+            index_dir = pathlib.Path(os.getenv("SCHEMA_INDEX_DIR", str(default_dir)))
+            path = str(index_dir / (hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:16] + ".json"))
+        self.path = path
+        self._tables: Dict[str, Dict[str, Any]] = {}
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._retrievals = LRUCache(max_entries=256)
+        self._lock = threading.Lock()
+
+    def build(self) -> int:
+        """Reflect the database and update the index, re-embedding only changed tables.
+
+        Returns:
+            int: The number of tables that were (re-)embedded
+        """
+        persisted = self._load()
+        inspector = inspect(self.db._engine)
+        schema = self.db._schema
+        tables = {}
+        embedded = 0
+        for table_name in self.db.get_usable_table_names():
+            table = self._reflect(inspector, table_name, schema)
+            previous = persisted.get(table_name)
+            if previous is not None and previous["fingerprint"] == table["fingerprint"]:
+                table["embedding"] = previous["embedding"]
+            else:
+                table["embedding"] = self.embedder.embed_query(self._document(table))
+                embedded += 1
+            tables[table_name] = table
+
+        with self._lock:
+            self._tables = tables
+            self._vectors = {name: self._normalize(table["embedding"]) for name, table in tables.items()}
+            self._retrievals.clear()
+        if embedded or set(tables) != set(persisted):
+            self._save()
+        return embedded
+
+    def retrieve(self, question: str, k: int = 5) -> List[str]:
+        """Return the k tables most relevant to a question followed by their foreign-key neighbours.
+
+        At most k neighbours are added, so hub tables do not pull in the whole schema.
+
+        Args:
+            question: The natural-language question
+            k: The number of tables to select by similarity
+
+        Returns:
+            List[str]: The table names, most relevant first
+        """
+        cached = self._retrievals.get((question, k))
+        if cached is not None:
+            return cached
+
+        vector = self._normalize(self.embedder.embed_query(question))
+        with self._lock:
+            scores = {name: float(np.dot(vector, table_vector)) for name, table_vector in self._vectors.items()}
+            selected = sorted(scores, key=scores.get, reverse=True)[:k]
+            neighbours = []
+            for name in selected:
+                for candidate in self._neighbours(name):
+                    if candidate not in selected and candidate not in neighbours:
+                        neighbours.append(candidate)
+        tables = selected + neighbours[:k]
+        self._retrievals.put((question, k), tables)
+        return tables
+
+    def describe(self, table_names: List[str]) -> str:
+        """Describe tables compactly, one line per table with typed columns and key references.
+
+        Args:
+            table_names: The tables to describe
+
+        Returns:
+            str: The description
+        """
+        lines = []
+        for name in table_names:
+            table = self._tables.get(name)
+            if table is None:
+                continue
+            references = {column: target for fk in table["foreign_keys"]
+                          for column, target in zip(fk["columns"],
+                                                    (f"{fk['referred_table']}.{c}" for c in fk["referred_columns"]))}
+            columns = []
+            for column in table["columns"]:
+                text = f"{column['name']} {column['type']}"
+                if column["name"] in table["primary_key"]:
+                    text += " PK"
+                if column["name"] in references:
+                    text += f" -> {references[column['name']]}"
+                if column.get("comment"):
+                    text += f" '{column['comment']}'"
+                columns.append(text)
+            comment = f" -- {table['comment']}" if table.get("comment") else ""
+            lines.append(f"{name}({', '.join(columns)}){comment}")
+        return "\n".join(lines)
+
+    def table(self, name: str) -> Optional[Dict[str, Any]]:
+        """Return the reflected definition of a table, or None if it is not indexed."""
+        return self._tables.get(name)
+
+    @property
+    def table_names(self) -> List[str]:
+        """The names of the indexed tables."""
+        return list(self._tables)
+
+    def _neighbours(self, name: str) -> List[str]:
+        referenced = [fk["referred_table"] for fk in self._tables[name]["foreign_keys"]]
+        referencing = [other for other, table in self._tables.items()
+                       if any(fk["referred_table"] == name for fk in table["foreign_keys"])]
+        return [table for table in referenced + referencing if table in self._tables and table != name]
+
+    @staticmethod
+    def _reflect(inspector, table_name: str, schema: Optional[str]) -> Dict[str, Any]:
+        columns = [{"name": column["name"], "type": str(column["type"]), "comment": column.get("comment") or ""}
+                   for column in inspector.get_columns(table_name, schema=schema)]
+        foreign_keys = [{"columns": fk["constrained_columns"], "referred_table": fk["referred_table"],
+                         "referred_columns": fk["referred_columns"]}
+                        for fk in inspector.get_foreign_keys(table_name, schema=schema)]
+        primary_key = inspector.get_pk_constraint(table_name, schema=schema).get("constrained_columns") or []
+        try:
+            comment = inspector.get_table_comment(table_name, schema=schema).get("text") or ""
+        except NotImplementedError:
+            comment = ""
+        table = {"name": table_name, "columns": columns, "foreign_keys": foreign_keys,
+                 "primary_key": primary_key, "comment": comment}
+        table["fingerprint"] = hashlib.sha1(json.dumps(table, sort_keys=True).encode("utf-8")).hexdigest()
+        return table
+
+    @staticmethod
+    def _document(table: Dict[str, Any]) -> str:
+        """Build the text that is embedded for a table."""
+        parts = [table["name"], table["comment"]]
+        parts += [f"{column['name']} {column['comment']}" for column in table["columns"]]
+        parts += [fk["referred_table"] for fk in table["foreign_keys"]]
+        return " ".join(part for part in parts if part)
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                persisted = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if persisted.get("version") != self.VERSION:
+            return {}
+        return persisted.get("tables", {})
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "tables": self._tables}, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,36 @@
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from core.schema_index import SchemaIndex
+
+
+def _create_database(path):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(text("create table customer (customer_id integer primary key, country text)"))
+        connection.execute(text("create table invoice (invoice_id integer primary key, total real, "
+                                "customer_id integer references customer(customer_id))"))
+        connection.execute(text("create table track (track_id integer primary key, name text, genre text)"))
+    return engine
+
+
+def test_retrieve_adds_foreign_key_neighbours(tmp_path):
+    _create_database(tmp_path / "test.db")
+    index = SchemaIndex(SQLDatabase.from_uri(f"sqlite:///{tmp_path / 'test.db'}"), path=str(tmp_path / "index.json"))
+    index.build()
+
+    assert index.retrieve("invoice totals", k=1) == ["invoice", "customer"]
+    assert "customer_id INTEGER -> customer.customer_id" in index.describe(["invoice"])
+
+
+def test_rebuild_is_incremental(tmp_path):
+    engine = _create_database(tmp_path / "test.db")
+    index_path = str(tmp_path / "index.json")
+    assert SchemaIndex(SQLDatabase.from_uri(f"sqlite:///{tmp_path / 'test.db'}"), path=index_path).build() == 3
+
+    with engine.begin() as connection:
+        connection.execute(text("alter table track add column composer text"))
+
+    index = SchemaIndex(SQLDatabase.from_uri(f"sqlite:///{tmp_path / 'test.db'}"), path=index_path)
+    assert index.build() == 1
+    assert "composer" in index.describe(["track"])
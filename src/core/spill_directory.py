@@ -0,0 +1,124 @@
+"""
+A directory of files spilled from in-memory caches, bounded by size and age.
+
+Images and query results evicted from memory are written to disk so they can
+still be read back. A long-running server would otherwise move its growth from
+memory to disk, so the spill directory drops files older than its time-to-live
+and, when its files exceed the byte budget, the least recently used ones until
+they fit in LOW_WATERMARK of the budget. Reads touch a file to mark it as used.
+Sweeps run when a write crosses the budget and at least every
+sweep_interval_seconds, so files left by earlier processes are removed too.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class SpillDirectory:
+    """Writes spilled files atomically and keeps the directory within a byte budget and an age."""
+
+    # The fraction of the budget a sweep leaves, so that the next writes do not sweep again at once
+    LOW_WATERMARK = 0.8
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: float, sweep_interval_seconds: float = 300):
+        """Initialize the SpillDirectory.
+
+        Args:
+            path: The directory
+            max_bytes: The maximum total size of the files
+            ttl_seconds: The age after which a file is removed, counted from its last use
+            sweep_interval_seconds: The longest time between two sweeps while files are written
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        # The size of the files is only known after the first sweep
+        self._bytes = 0
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def file(self, name: str) -> str:
+        """Return the path of a file, name may contain subdirectories."""
+        return os.path.join(self.path, name)
+
+    def write(self, name: str, write: Callable[[str], None]) -> str:
+        """Write a file through a temporary file, so that readers never see a partial file.
+
+        Args:
+            name: The name of the file below the directory
+            write: A function writing the content to the path it is given
+
+        Returns:
+            str: The path of the file
+        """
+        path = self.file(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._bytes += os.path.getsize(path)
+            due = self._bytes > self.max_bytes or time.monotonic() >= self._next_sweep
+        if due:
+            self.sweep()
+        return path
+
+    def touch(self, name: str) -> None:
+        """Mark a file as used, it is then removed last."""
+        try:
+            os.utime(self.file(name))
+        except OSError:
+            pass
+
+    def sweep(self) -> int:
+        """Remove the expired files, then the least recently used ones while over the budget.
+
+        Returns:
+            int: The number of files removed
+        """
+        with self._lock:
+            now = time.time()
+            files = []
+            for directory, _, names in os.walk(self.path):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    # Files being written are left alone unless a writer died long ago
+                    if name.endswith(".tmp") and now - stat.st_mtime <= self.ttl_seconds:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            target = self.max_bytes * self.LOW_WATERMARK if total > self.max_bytes else self.max_bytes
+            removed = 0
+            for mtime, size, path in files:
+                if now - mtime <= self.ttl_seconds and total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    # e.g. a file still mapped by a reader on Windows, it goes in a later sweep
+                    logger.debug("Cannot remove spilled file %s: %s", path, e)
+                    continue
+                total -= size
+                removed += 1
+            self._bytes = total
+            self._next_sweep = time.monotonic() + self.sweep_interval_seconds
+        if removed:
+            logger.info("Removed %d spilled files from %s, %d bytes remain", removed, self.path, total)
+        return removed
@@ -0,0 +1,80 @@
+import pathlib
+import threading
+import time
+from unittest.mock import MagicMock
+
+from core.cancellation import cancellation
+from core.sql_engine import apply_schema, create_database, engine_options
+from core.sql_tools import QueryResultSQLDatabaseTool
+
+DB_URI = "sqlite:///" + str(pathlib.Path(__file__).parent.parent.resolve() / "chinook.db")
+ENDLESS_QUERY = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c"
+
+
+def test_engine_options_bound_the_pool_and_set_server_timeouts():
+    options = engine_options("postgresql+psycopg2://user:secret@db/sales", statement_timeout_seconds=5)
+    assert options["pool_pre_ping"] is True
+    assert options["pool_size"] == 5
+    assert options["connect_args"] == {"options": "-c statement_timeout=5000"}
+
+    assert engine_options(DB_URI) == {"pool_pre_ping": True}
+    assert "connect_args" not in engine_options("postgresql+psycopg2://db/sales", statement_timeout_seconds=0)
+
+
+def test_queries_are_limited_to_max_rows():
+    """The limit is added to the statement and the model is told the result was truncated."""
+    tool = QueryResultSQLDatabaseTool(db=create_database(DB_URI), max_rows=10)
+    output = tool.invoke({"query": "SELECT TrackId, Name FROM Track ORDER BY TrackId"})
+
+    assert "truncated to the first 10 rows" in output
+    assert output.count("), (") == 9
+    small = tool.invoke({"query": "SELECT TrackId FROM Track ORDER BY TrackId LIMIT 3"})
+    assert "truncated" not in small
+
+
+def test_long_running_queries_time_out():
+    tool = QueryResultSQLDatabaseTool(db=create_database(DB_URI), statement_timeout_seconds=0.5)
+    start = time.monotonic()
+    output = tool.invoke({"query": ENDLESS_QUERY})
+
+    assert output.startswith("Error: The query ran longer than 0.5 seconds")
+    assert time.monotonic() - start < 5
+
+
+def test_cancelling_a_session_interrupts_its_query():
+    tool = QueryResultSQLDatabaseTool(db=create_database(DB_URI), statement_timeout_seconds=30)
+    outputs = []
+
+    def run():
+        with cancellation.request("session-1"):
+            outputs.append(tool.invoke({"query": ENDLESS_QUERY}))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.3)
+    assert cancellation.cancel("session-1")
+    thread.join(timeout=5)
+
+    assert outputs == ["Error: The query was cancelled"]
+    assert not cancellation.cancel("session-1")
+
+
+def test_writes_are_rolled_back(tmp_path):
+    db = create_database(f"sqlite:///{tmp_path / 'test.db'}")
+    with db._engine.begin() as connection:
+        connection.exec_driver_sql("create table t (x integer)")
+    tool = QueryResultSQLDatabaseTool(db=db)
+    tool.invoke({"query": "INSERT INTO t VALUES (1)"})
+
+    assert tool.invoke({"query": "SELECT COUNT(*) FROM t"}).startswith("[(0,)]")
+
+
+def test_the_schema_of_the_database_is_applied():
+    db = MagicMock(_schema="sales", dialect="postgresql")
+    connection = MagicMock()
+    apply_schema(db, connection)
+    connection.exec_driver_sql.assert_called_once_with("SET search_path TO %s", ("sales",))
+
+    connection.reset_mock()
+    apply_schema(MagicMock(_schema=None, dialect="postgresql"), connection)
+    connection.exec_driver_sql.assert_not_called()
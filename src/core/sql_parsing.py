@@ -0,0 +1,135 @@
+"""
+SQL parsing helpers shared by the query cache and the other SQL stages.
+
+Statements are parsed with sqlglot using the dialect of the connected database.
+"""
+from typing import Optional, Set
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.normalize_identifiers import normalize_identifiers
+
+# sqlglot names of the SQLAlchemy dialects
+SQLGLOT_DIALECTS = {
+    "postgresql": "postgres",
+    "sqlite": "sqlite",
+    "mysql": "mysql",
+    "mariadb": "mysql",
+    "mssql": "tsql",
+    "oracle": "oracle",
+    "duckdb": "duckdb",
+    "snowflake": "snowflake",
+    "bigquery": "bigquery",
+    "trino": "trino",
+}
+
+# Statements that modify data or schema
+WRITE_STATEMENTS = (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Drop, exp.Create, exp.Alter,
+                    exp.TruncateTable)
+
+# Expressions whose value changes between executions
+VOLATILE_EXPRESSIONS = (exp.Rand, exp.CurrentDate, exp.CurrentTime, exp.CurrentTimestamp)
+VOLATILE_FUNCTIONS = {"random", "now", "sysdate", "getdate", "uuid", "gen_random_uuid", "newid"}
+
+
+def sqlglot_dialect(dialect: str) -> Optional[str]:
+    """Return the sqlglot dialect name for a SQLAlchemy dialect name."""
+    return SQLGLOT_DIALECTS.get(dialect, dialect or None)
+
+
+def parse(sql: str, dialect: str) -> Optional[exp.Expression]:
+    """Parse a single SQL statement, returning None if it cannot be parsed.
+
+    Args:
+        sql: The SQL statement
+        dialect: The SQLAlchemy dialect name of the database
+
+    Returns:
+        Optional[exp.Expression]: The parsed statement, or None
+    """
+    try:
+        statements = sqlglot.parse(sql, read=sqlglot_dialect(dialect))
+    except sqlglot.errors.SqlglotError:
+        return None
+    statements = [statement for statement in statements if statement is not None]
+    return statements[0] if len(statements) == 1 else None
+
+
+def canonicalize(expression: exp.Expression, dialect: str) -> str:
+    """Render a statement in a canonical form.
+
+    Unquoted identifiers are case-normalized for the dialect, keywords are
+    uppercased, whitespace and comments are dropped, and the operands of AND/OR
+    predicates and literal IN lists are sorted, so that equivalent statements
+    render identically.
+
+    Args:
+        expression: The parsed statement
+        dialect: The SQLAlchemy dialect name of the database
+
+    Returns:
+        str: The canonical SQL text
+    """
+    read = sqlglot_dialect(dialect)
+    expression = normalize_identifiers(expression.copy(), dialect=read)
+
+    for node in expression.find_all(exp.In):
+        if node.expressions and all(isinstance(value, exp.Literal) for value in node.expressions):
+            node.set("expressions", sorted(node.expressions, key=lambda value: value.sql(dialect=read)))
+    for node in expression.find_all(exp.EQ):
+        if isinstance(node.this, exp.Literal) and not isinstance(node.expression, exp.Literal):
+            this, other = node.this, node.expression
+            node.set("this", other)
+            node.set("expression", this)
+
+    # Deepest connectives first, so outer ones sort already canonical operands
+    for node in reversed(list(expression.find_all(exp.And, exp.Or))):
+        operands = sorted(node.flatten(), key=lambda operand: operand.sql(dialect=read))
+        combine = exp.and_ if isinstance(node, exp.And) else exp.or_
+        canonical = combine(*operands, copy=False)
+        if node is expression:
+            expression = canonical
+        else:
+            node.replace(canonical)
+
+    return expression.sql(dialect=read, comments=False)
+
+
+def referenced_tables(expression: exp.Expression) -> Set[str]:
+    """Return the lower-cased names of the tables a statement reads or writes, excluding CTE names."""
+    ctes = {cte.alias_or_name.lower() for cte in expression.find_all(exp.CTE)}
+    return {table.name.lower() for table in expression.find_all(exp.Table) if table.name} - ctes
+
+
+def is_read_only(expression: exp.Expression) -> bool:
+    """Return True if the statement is a query that does not modify data or schema."""
+    return isinstance(expression, exp.Query) and not any(expression.find_all(*WRITE_STATEMENTS))
+
+
+def is_deterministic(expression: exp.Expression) -> bool:
+    """Return False if the statement calls functions whose value changes between executions."""
+    if any(expression.find_all(*VOLATILE_EXPRESSIONS)):
+        return False
+    return not any(function.name.lower() in VOLATILE_FUNCTIONS for function in expression.find_all(exp.Anonymous))
+
+
+def limit_rows(expression: exp.Expression, dialect: str, max_rows: int) -> Optional[str]:
+    """Limit the number of rows a query returns.
+
+    Args:
+        expression: The parsed statement
+        dialect: The SQLAlchemy dialect name of the database
+        max_rows: The maximum number of rows
+
+    Returns:
+        Optional[str]: The query with a LIMIT of max_rows, or None if it is not a query
+        or already returns at most max_rows rows
+    """
+    if not isinstance(expression, exp.Query):
+        return None
+    limit = expression.args.get("limit")
+    if limit is not None:
+        count = limit.expression if isinstance(limit, exp.Limit) else None
+        if not (isinstance(count, exp.Literal) and count.is_int) or int(count.name) <= max_rows:
+            return None
+    return expression.copy().limit(max_rows).sql(dialect=sqlglot_dialect(dialect))
@@ -0,0 +1,246 @@
+import copy
+import os
+import time
+from typing import Any, List, Optional, Sequence, Tuple
+
+from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import BaseSQLDatabaseTool, InfoSQLDatabaseTool, \
+    QuerySQLDatabaseTool, _QuerySQLCheckerToolInput
+from langchain_community.utilities.sql_database import truncate_word
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+
+from core import sql_parsing
+from core.cancellation import RequestCancelled
+from core.cost_guard import CostGuard, decision_summary
+from core.downsampling import preview
+from core.profile_catalog import ProfileCatalog
+from core.query_cache import query_cache
+from core.result_store import result_store
+from core.rollups import RollupManager, rollup_manager
+from core.schema_index import SchemaIndex
+from core.sql_engine import MAX_ROWS, STATEMENT_TIMEOUT_SECONDS, database_namespace, statement_connection
+from core.sql_validator import SQLValidator
+from core.tracing import tracer
+
+
+class QueryResultSQLDatabaseTool(QuerySQLDatabaseTool):
+    """Tool for querying a SQL database that also captures the result as a dataframe.
+
+    The rows and column names are taken straight from the database cursor and
+    stored in the result store. The model receives the usual stringified rows
+    followed by a compact result handle that other tools can reference.
+    Results of read-only queries are served from the query cache when possible.
+    Results above large_result_rows rows are described to the model by a sample
+    and per-column statistics instead of every row.
+
+    Queries return at most max_rows rows, the limit is added to the statement so
+    the database stops early. A statement running longer than
+    statement_timeout_seconds, or whose request is cancelled, is cancelled on
+    its connection. With a cost guard, queries are planned first and expensive
+    ones are limited or rejected before they run. Aggregations covered by a
+    materialized rollup are answered from the rollup instead of the database,
+    with a note on the age of the rollup.
+    """
+
+    description: str = """
+    Execute a SQL query against the database and get back the result..
+    If the query is not correct, an error message will be returned.
+    If an error is returned, rewrite the query, check the query, and try again.
+    The output ends with a result_handle line. Pass the result_handle to
+    convert_to_pandas and visualize_pandas_dataframe instead of copying the rows.
+    Large results are returned as a sample of rows with column statistics.
+    """
+    large_result_rows: int = Field(default_factory=lambda: int(os.getenv("LARGE_RESULT_ROWS", "500")))
+    large_result_sample_rows: int = 20
+    max_rows: int = Field(default_factory=lambda: MAX_ROWS)
+    statement_timeout_seconds: float = Field(default_factory=lambda: STATEMENT_TIMEOUT_SECONDS)
+    cost_guard: Optional[CostGuard] = Field(default=None, exclude=True)
+    rollups: Optional[RollupManager] = Field(default=None, exclude=True)
+
+    def _run(
+        self,
+        query: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Execute the query, store the results and return them with their handle."""
+        namespace = database_namespace(self.db)
+        with tracer.span("sql_db_query", "sql", sql=query) as span:
+            cached = query_cache.get(namespace, query, self.db.dialect)
+            span.set(cache_hit=cached is not None)
+            note = ""
+            answered = self.rollups.answer(query) if cached is None and self.rollups is not None else None
+            if cached is not None:
+                columns, rows = cached
+            elif answered is not None:
+                columns, rows, rollup = answered
+                age = time.time() - rollup.refreshed_at
+                span.set(rollup_hit=True, rollup=rollup.key, rollup_age_seconds=round(age, 1))
+                # The model is told how old the rollup is, so that the answer can mention it
+                minutes = round(age / 60)
+                refreshed = "less than a minute" if minutes < 1 else f"{minutes} minute{'s' if minutes > 1 else ''}"
+                note = f"This result was answered from a rollup refreshed {refreshed} ago, " \
+                       f"rows written since then are not included."
+            else:
+                sql, decision = query, None
+                if self.cost_guard is not None:
+                    decision = self.cost_guard.check(query)
+                    span.set(**decision_summary(decision))
+                    if not decision.allowed:
+                        return f"Error: {decision.message}"
+                    sql = decision.sql
+                try:
+                    columns, rows = self._fetch(sql)
+                except Exception as e:
+                    span.status = "ERROR"
+                    span.set(error=str(e), cancelled=isinstance(e, RequestCancelled) or None)
+                    return f"Error: {e}"
+                # The guard fetches one row more than its limit, the model is only told when it was reached
+                if decision is not None and decision.limit is not None and len(rows) > decision.limit:
+                    rows, note = rows[:decision.limit], decision.message
+                    span.set(guard_truncated=True)
+                # Truncated results would be wrong for a tool with other limits
+                if columns and len(rows) <= self.max_rows and not note:
+                    query_cache.put(namespace, query, self.db.dialect, columns, rows)
+                if self.rollups is not None and not note:
+                    self.rollups.record(query)
+
+            if not columns:
+                span.set(rows=0, bytes=0)
+                return ""
+
+            truncated = len(rows) > self.max_rows
+            if truncated:
+                rows = rows[:self.max_rows]
+                span.set(truncated=True)
+            handle = result_store.store_rows(columns, rows)
+            if len(rows) > self.large_result_rows:
+                # Large results reach the model as a sample with statistics, the tools use the handle
+                span.set(large_result=True)
+                output = preview(result_store.load(handle), self.large_result_sample_rows)
+            else:
+                output = self._format_rows(rows)
+            if truncated:
+                output += f"\n\nThe result was truncated to the first {self.max_rows} rows."
+            if note:
+                output += f"\n\n{note}"
+            output += f"\n\nresult_handle: {handle}"
+            span.set(rows=len(rows), bytes=len(output.encode("utf-8")), result_handle=handle)
+            return output
+
+    def _fetch(self, query: str) -> Tuple[List[str], Sequence[Sequence]]:
+        """Execute the query and return the cursor column names and up to max_rows + 1 rows.
+
+        Raises:
+            RequestCancelled: If the request was cancelled while the query ran
+            TimeoutError: If the query ran longer than statement_timeout_seconds
+        """
+        parsed = sql_parsing.parse(query, self.db.dialect)
+        # One more row than the limit tells a truncated result from a complete one
+        limited = sql_parsing.limit_rows(parsed, self.db.dialect, self.max_rows + 1) if parsed is not None else None
+        # The statement runs in a transaction that is always rolled back, writes are never committed
+        with statement_connection(self.db, self.statement_timeout_seconds) as connection:
+            cursor = connection.execute(text(limited or query))
+            if not cursor.returns_rows:
+                return [], []
+            return list(cursor.keys()), cursor.fetchmany(self.max_rows + 1)
+
+    def _format_rows(self, rows: Sequence[Sequence]) -> str:
+        """Format rows the same way SQLDatabase.run does for the model."""
+        res = [
+            tuple(truncate_word(value, length=self.db._max_string_length) for value in row)
+            for row in rows
+        ]
+        return str(res) if res else "[]"
+
+
+class LocalQuerySQLCheckerTool(BaseSQLDatabaseTool, BaseTool):
+    """Tool for checking a query locally, without an LLM call.
+
+    The query is parsed for the database dialect and resolved against the
+    schema, and the database is asked to EXPLAIN it. A valid query is returned
+    unchanged, followed by warnings about common pitfalls as SQL comments.
+    """
+
+    validator: Any = Field(exclude=True)
+    name: str = "sql_db_query_checker"
+    description: str = """
+    Use this tool to double check if your query is correct before executing it.
+    Always use this tool before executing a query with sql_db_query!
+    """
+    args_schema: type[BaseModel] = _QuerySQLCheckerToolInput
+
+    def _run(
+        self,
+        query: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Validate the query and return it, or the reasons it is invalid."""
+        result = self.validator.validate(query)
+        if not result.ok:
+            return "Error: " + " ".join(result.errors) + " Rewrite the query and check it again."
+        return "\n".join([result.sql] + [f"-- Warning: {warning}" for warning in result.warnings])
+
+
+class ProfiledInfoSQLDatabaseTool(InfoSQLDatabaseTool):
+    """Tool for getting the schema of tables with column profiles instead of sample rows.
+
+    Tables that were not profiled yet are described with sample rows as usual.
+    """
+
+    profile_catalog: Any = Field(exclude=True)
+    description: str = "Get the schema and column profiles for the specified SQL tables."
+
+    def _run(
+        self,
+        table_names: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Get the schema and column profiles for tables in a comma-separated list."""
+        names = [name.strip() for name in table_names.split(",")]
+        if not all(self.profile_catalog.has_profiles(name) for name in names):
+            return super()._run(table_names, run_manager)
+        # A shallow copy shares the engine and metadata but skips the sample rows query
+        db = copy.copy(self.db)
+        db._sample_rows_in_table_info = 0
+        info = db.get_table_info_no_throw(names)
+        if info.startswith("Error:"):
+            return info
+        return f"{info}\n\n/*\nColumn profiles:\n{self.profile_catalog.hints(names)}\n*/"
+
+
+class SQLTools:
+    """A class assembling the SQL database tools used by the agent."""
+
+    @staticmethod
+    def get_tools(toolkit: SQLDatabaseToolkit, schema_index: SchemaIndex = None,
+                  profile_catalog: ProfileCatalog = None) -> list:
+        """Get the toolkit tools with sql_db_query replaced by the result capturing variant
+        guarded by a CostGuard and answered from rollups, and sql_db_query_checker replaced by the local checker.
+        With a profile catalog, sql_db_schema returns column profiles instead of sample rows.
+
+        Args:
+            toolkit: The SQL database toolkit to take the tools from
+            schema_index: The schema the checker resolves identifiers against, built if None
+            profile_catalog: The column profiles of the database, None to keep the sample rows
+
+        Returns:
+            list: A list containing the SQL tools
+        """
+        # Writes through the engine, from any caller, invalidate cached results
+        query_cache.watch(toolkit.db._engine)
+        replacements = {
+            "sql_db_query": lambda: QueryResultSQLDatabaseTool(db=toolkit.db, cost_guard=CostGuard(toolkit.db),
+                                                               rollups=rollup_manager(toolkit.db)),
+            "sql_db_query_checker": lambda: LocalQuerySQLCheckerTool(
+                db=toolkit.db, validator=SQLValidator(toolkit.db, schema_index)),
+        }
+        if profile_catalog is not None:
+            replacements["sql_db_schema"] = lambda: ProfiledInfoSQLDatabaseTool(db=toolkit.db,
+                                                                              profile_catalog=profile_catalog)
+        return [
+            replacements[tool.name]() if tool.name in replacements else tool
+            for tool in toolkit.get_tools()
+        ]
@@ -0,0 +1,163 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import text
+from sqlglot import exp
+from sqlglot.errors import OptimizeError
+from sqlglot.optimizer.qualify import qualify
+
+from core import sql_parsing
+from core.schema_index import SchemaIndex
+from core.sql_engine import statement_connection
+
+# Statement prefixes that ask the database for a plan without running the query
+EXPLAIN_PREFIXES = {
+    "sqlite": "EXPLAIN QUERY PLAN",
+    "postgresql": "EXPLAIN",
+    "mysql": "EXPLAIN",
+    "mariadb": "EXPLAIN",
+    "duckdb": "EXPLAIN",
+    "trino": "EXPLAIN",
+    "snowflake": "EXPLAIN",
+}
+
+
+@dataclass
+class ValidationResult:
+    """The outcome of validating a SQL query."""
+    sql: str
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def explain(db: SQLDatabase, sql: str) -> Optional[list]:
+    """Ask the database for the plan of a query without running it.
+
+    Args:
+        db: The database to plan the query on
+        sql: The query
+
+    Returns:
+        Optional[list]: The plan rows, or None if the dialect has no supported EXPLAIN
+    """
+    prefix = EXPLAIN_PREFIXES.get(db.dialect)
+    if prefix is None:
+        return None
+    with statement_connection(db) as connection:
+        return [tuple(row) for row in connection.execute(text(f"{prefix} {sql}")).fetchall()]
+
+
+class SQLValidator:
+    """
+    A local replacement for the LLM based query checker.
+
+    Queries are parsed for the database dialect, must be a single read-only
+    statement, and every table and column must resolve against the indexed
+    schema. Common mistakes are reported as warnings, and the database is
+    asked to EXPLAIN the query to catch anything the parser cannot.
+    """
+
+    def __init__(self, db: SQLDatabase, schema_index: SchemaIndex = None, use_explain: bool = True):
+        """Initialize the SQLValidator.
+
+        Args:
+            db: The database the queries run against
+            schema_index: The schema to resolve identifiers against, built from the database if None
+            use_explain: Whether to run EXPLAIN on queries that pass the local checks
+        """
+        self.db = db
+        if schema_index is None:
+            schema_index = SchemaIndex(db)
+            schema_index.build()
+        self.schema_index = schema_index
+        self.use_explain = use_explain
+
+    def validate(self, sql: str) -> ValidationResult:
+        """Validate a query.
+
+        Args:
+            sql: The query to validate
+
+        Returns:
+            ValidationResult: The query with the errors that make it fail and the warnings to consider
+        """
+        sql = self._strip(sql)
+        result = ValidationResult(sql=sql)
+        expression = sql_parsing.parse(sql, self.db.dialect)
+        if expression is None:
+            result.errors.append(f"The query could not be parsed as a single {self.db.dialect} statement.")
+            return result
+        if not sql_parsing.is_read_only(expression):
+            result.errors.append("Only SELECT queries are allowed, the query must not modify data or schema.")
+            return result
+
+        schema = self._schema()
+        unknown = sorted(sql_parsing.referenced_tables(expression) - set(schema))
+        if unknown:
+            result.errors.append(f"Unknown table(s): {', '.join(unknown)}. "
+                                 f"Available tables: {', '.join(self.schema_index.table_names)}.")
+            return result
+
+        try:
+            qualified = qualify(expression.copy(), schema=schema,
+                                dialect=sql_parsing.sqlglot_dialect(self.db.dialect),
+                                validate_qualify_columns=True, identify=False)
+        except OptimizeError as e:
+            result.errors.append(str(e))
+            return result
+
+        result.warnings.extend(self._pitfalls(qualified))
+
+        if self.use_explain:
+            try:
+                explain(self.db, sql)
+            except Exception as e:
+                result.errors.append(f"EXPLAIN failed: {e}")
+        return result
+
+    def _schema(self) -> Dict[str, Dict[str, str]]:
+        """Map the lower-cased table names to their lower-cased column names and types."""
+        return {name.lower(): {column["name"].lower(): column["type"]
+                               for column in self.schema_index.table(name)["columns"]}
+                for name in self.schema_index.table_names}
+
+    @staticmethod
+    def _strip(sql: str) -> str:
+        """Remove markdown fences and a trailing semicolon the model may have added."""
+        sql = sql.strip()
+        if sql.startswith("```"):
+            sql = sql.strip("`")
+            if sql.lower().startswith("sql"):
+                sql = sql[3:]
+        return sql.strip().rstrip(";").strip()
+
+    @staticmethod
+    def _pitfalls(expression: exp.Expression) -> List[str]:
+        """Find common mistakes in a qualified query."""
+        warnings = []
+        for node in expression.find_all(exp.Not):
+            if isinstance(node.this, exp.In) and node.this.args.get("query") is not None:
+                warnings.append("NOT IN with a subquery returns no rows if the subquery yields a NULL, "
+                                "use NOT EXISTS or filter NULLs in the subquery.")
+        for node in expression.find_all(exp.EQ, exp.NEQ):
+            if isinstance(node.expression, exp.Null) or isinstance(node.this, exp.Null):
+                warnings.append(f"'{node.sql()}' is never true, use IS NULL or IS NOT NULL.")
+
+        for select in expression.find_all(exp.Select):
+            group = select.args.get("group")
+            grouped = {e.sql() for e in group.expressions} if group else set()
+            projections = [p.unalias() for p in select.expressions]
+            aggregated = [p for p in projections if p.find(exp.AggFunc) and not p.find(exp.Window)]
+            if not group and not aggregated:
+                continue
+            for projection in projections:
+                if projection.find(exp.AggFunc) or projection.find(exp.Window) or not projection.find(exp.Column):
+                    continue
+                if projection.sql() not in grouped:
+                    warnings.append(f"'{projection.sql()}' is neither aggregated nor in the GROUP BY clause.")
+        return warnings
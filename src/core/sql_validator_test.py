@@ -0,0 +1,49 @@
+import pathlib
+
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import event
+
+from core import sql_engine
+from core.schema_index import SchemaIndex
+from core.sql_tools import LocalQuerySQLCheckerTool
+from core.sql_validator import SQLValidator, explain
+
+
+DB_URI = "sqlite:///" + str(pathlib.Path(__file__).parent.parent.resolve() / "chinook.db")
+
+
+def _checker(tmp_path):
+    db = SQLDatabase.from_uri(DB_URI)
+    schema_index = SchemaIndex(db, path=str(tmp_path / "index.json"))
+    schema_index.build()
+    return LocalQuerySQLCheckerTool(db=db, validator=SQLValidator(db, schema_index))
+
+
+def test_valid_query_is_returned_with_warnings(tmp_path):
+    output = _checker(tmp_path).invoke({"query": "```sql\nSELECT BillingCountry, BillingCity, SUM(Total) "
+                                                 "FROM Invoice GROUP BY BillingCountry;\n```"})
+
+    lines = output.splitlines()
+    assert lines[0] == "SELECT BillingCountry, BillingCity, SUM(Total) FROM Invoice GROUP BY BillingCountry"
+    assert lines[1].startswith("-- Warning: 'invoice.billingcity' is neither aggregated")
+
+
+def test_invalid_queries_are_rejected(tmp_path):
+    checker = _checker(tmp_path)
+    assert "Only SELECT" in checker.invoke({"query": "DELETE FROM Invoice"})
+    assert "Unknown table(s): invoices" in checker.invoke({"query": "SELECT Total FROM invoices"})
+    assert "could not be resolved" in checker.invoke({"query": "SELECT Totl FROM Invoice"})
+
+
+def test_explain_runs_in_the_schema_of_the_database(tmp_path, monkeypatch):
+    """An unqualified query is planned on a connection that uses the configured schema."""
+    db = SQLDatabase.from_uri(DB_URI, schema="main")
+    applied, explained = [], []
+    monkeypatch.setattr(sql_engine, "apply_schema",
+                        lambda db, connection: applied.append((db._schema, connection.connection.dbapi_connection)))
+    event.listen(db._engine, "before_cursor_execute",
+                 lambda connection, cursor, statement, *args: explained.append(connection.connection.dbapi_connection)
+                 if statement.startswith("EXPLAIN") else None)
+
+    assert explain(db, "SELECT Total FROM Invoice")
+    assert applied == [("main", explained[0])]
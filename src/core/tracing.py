@@ -0,0 +1,262 @@
+"""
+Structured tracing for the BI agent.
+
+Every request gets a trace made of spans for LLM calls, tool calls, SQL
+statements and chart rendering. A span records its wall time and attributes
+such as tokens in/out, rows returned and bytes produced. Finished spans are
+kept in an in-process collector with OpenTelemetry-shaped records and can also
+be appended to a JSONL file by setting the TRACE_JSONL_PATH environment variable.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+# The span that new spans are attached to in the current context
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    """A timed operation within a request trace."""
+    name: str
+    kind: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    start_time: float = field(default_factory=time.time)
+    end_time: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "OK"
+
+    @property
+    def duration_ms(self) -> float:
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return (end_time - self.start_time) * 1000
+
+    def set(self, **attributes) -> None:
+        """Set attributes on the span, ignoring None values."""
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def to_otel(self) -> Dict[str, Any]:
+        """Return the span as an OpenTelemetry-shaped record."""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": int(self.start_time * 1e9),
+            "end_time_unix_nano": int((self.end_time or time.time()) * 1e9),
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+
+class InMemoryCollector:
+    """Keeps the most recent finished spans in memory."""
+
+    def __init__(self, max_spans: int = 10000):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self, trace_id: str = None) -> List[Span]:
+        """Return the collected spans, optionally only those of one trace."""
+        with self._lock:
+            return [span for span in self._spans if trace_id is None or span.trace_id == trace_id]
+
+
+class JSONLExporter:
+    """Appends finished spans to a JSONL file, one OpenTelemetry-shaped record per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_otel(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class Tracer:
+    """Creates spans and sends them to the collector and the configured exporters."""
+
+    def __init__(self, exporters: List[Any] = None):
+        """Initialize the Tracer.
+
+        Args:
+            exporters: Additional objects with an export(span) method
+        """
+        self.collector = InMemoryCollector()
+        self.exporters = [self.collector] + list(exporters or [])
+
+    def start_span(self, name: str, kind: str, parent: Optional[Span] = None, **attributes) -> Span:
+        """Start a span that is finished explicitly with end_span.
+
+        Args:
+            name: The name of the operation
+            kind: The kind of operation, e.g. request, llm, tool, sql or chart
+            parent: The parent span, defaults to the current span of the context
+
+        Returns:
+            Span: The started span
+        """
+        parent = parent or _current_span.get()
+        span = Span(name=name, kind=kind,
+                    trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+                    parent_id=parent.span_id if parent else None)
+        span.set(**attributes)
+        return span
+
+    def end_span(self, span: Span, error: BaseException = None) -> None:
+        """Finish a span and export it."""
+        span.end_time = time.time()
+        if error is not None:
+            span.status = "ERROR"
+            span.set(error=str(error))
+        logger.debug("span %s (%s) %.1f ms %s", span.name, span.kind, span.duration_ms, span.attributes)
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning("Exporting span failed: %s", e)
+
+    @contextmanager
+    def span(self, name: str, kind: str, **attributes) -> Iterator[Span]:
+        """Run a block within a span that becomes the current span of the context."""
+        span = self.start_span(name, kind, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, error=e)
+            raise
+        else:
+            self.end_span(span)
+        finally:
+            _current_span.reset(token)
+
+    def summarize(self, trace_id: str) -> Dict[str, Any]:
+        """Aggregate the spans of a trace per kind.
+
+        Args:
+            trace_id: The trace to summarize
+
+        Returns:
+            Dict[str, Any]: The total wall time and, per span kind, the count, time, tokens, rows,
+            bytes and cache hits
+        """
+        spans = self.collector.spans(trace_id)
+        summary: Dict[str, Any] = {"trace_id": trace_id, "total_ms": 0.0, "stages": {}}
+        for span in spans:
+            if span.parent_id is None:
+                summary["total_ms"] = round(span.duration_ms, 1)
+                continue
+            stage = summary["stages"].setdefault(span.kind, {"count": 0, "ms": 0.0})
+            stage["count"] += 1
+            stage["ms"] = round(stage["ms"] + span.duration_ms, 1)
+            for key in ("tokens_in", "tokens_out", "rows", "bytes"):
+                if isinstance(span.attributes.get(key), (int, float)):
+                    stage[key] = stage.get(key, 0) + span.attributes[key]
+            if span.attributes.get("cache_hit") is True:
+                stage["cache_hits"] = stage.get("cache_hits", 0) + 1
+            if span.attributes.get("rollup_hit") is True:
+                stage["rollup_hits"] = stage.get("rollup_hits", 0) + 1
+        return summary
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Records LLM and tool calls made by the agent graph as spans of a request trace."""
+
+    # Run in the event loop of async runs instead of a worker thread
+    run_inline = True
+
+    def __init__(self, tracer: Tracer, root: Span):
+        """Initialize the TracingCallbackHandler.
+
+        Args:
+            tracer: The tracer to record spans with
+            root: The request span the recorded spans belong to
+        """
+        self.tracer = tracer
+        self.root = root
+        self._spans: Dict[UUID, Span] = {}
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, kind: str, **attributes) -> None:
+        parent = self._spans.get(parent_run_id) or self.root
+        self._spans[run_id] = self.tracer.start_span(name, kind, parent=parent, **attributes)
+
+    def _end(self, run_id: UUID, error: BaseException = None, **attributes) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.set(**attributes)
+            self.tracer.end_span(span, error=error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start(run_id, parent_run_id, kwargs.get("name") or (serialized or {}).get("name", "chat_model"), "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start(run_id, parent_run_id, kwargs.get("name") or (serialized or {}).get("name", "llm"), "llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        tokens_in, tokens_out = token_usage(response)
+        self._end(run_id, tokens_in=tokens_in, tokens_out=tokens_out)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error=error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start(run_id, parent_run_id, kwargs.get("name") or (serialized or {}).get("name", "tool"), "tool",
+                    input_bytes=len(str(input_str).encode("utf-8")))
+
+    def on_tool_end(self, output, *, run_id, **kwargs) -> None:
+        content = getattr(output, "content", output)
+        self._end(run_id, bytes=len(str(content).encode("utf-8")))
+
+    def on_tool_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error=error)
+
+
+def token_usage(response) -> tuple:
+    """Return the input and output token counts of an LLM result or message, if reported."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    llm_output = getattr(response, "llm_output", None) or {}
+    usage = llm_output.get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    tokens_in = tokens_out = None
+    for generations in getattr(response, "generations", None) or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                tokens_in = (tokens_in or 0) + usage.get("input_tokens", 0)
+                tokens_out = (tokens_out or 0) + usage.get("output_tokens", 0)
+    return tokens_in, tokens_out
+
+
+def _default_exporters() -> List[Any]:
+    path = os.getenv("TRACE_JSONL_PATH")
+    return [JSONLExporter(path)] if path else []
+
+tracer = Tracer(_default_exporters())
@@ -0,0 +1,39 @@
+import json
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+from core.tracing import JSONLExporter, Tracer, TracingCallbackHandler, token_usage
+
+
+def test_summary_aggregates_child_spans_per_kind(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracer = Tracer([JSONLExporter(str(path))])
+    with tracer.span("agent.request", "request") as root:
+        with tracer.span("sql_db_query", "sql") as span:
+            span.set(rows=3, bytes=120)
+        with tracer.span("sql_db_query", "sql") as span:
+            span.set(rows=2, bytes=80)
+
+    summary = tracer.summarize(root.trace_id)
+    assert summary["stages"]["sql"]["count"] == 2
+    assert summary["stages"]["sql"]["rows"] == 5
+    assert summary["stages"]["sql"]["bytes"] == 200
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["name"] for record in records] == ["sql_db_query", "sql_db_query", "agent.request"]
+    assert records[0]["parent_span_id"] == root.span_id
+
+
+def test_callback_handler_records_llm_tokens():
+    tracer = Tracer()
+    with tracer.span("agent.request", "request") as root:
+        handler = TracingCallbackHandler(tracer, root)
+        handler.on_chat_model_start({"name": "ChatOpenAI"}, [], run_id="llm-1")
+        message = AIMessage(content="hi", usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15})
+        handler.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]), run_id="llm-1")
+
+    stages = tracer.summarize(root.trace_id)["stages"]
+    assert stages["llm"]["tokens_in"] == 12
+    assert stages["llm"]["tokens_out"] == 3
+    assert token_usage(message) == (12, 3)
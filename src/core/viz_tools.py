@@ -1,13 +1,29 @@
 from typing import Annotated, Dict, Any
+import copy
+import hashlib
+import logging
+import threading
+from langchain_core.messages import AIMessage
 from langchain_core.tools import tool
 from langchain.chat_models import init_chat_model
 from lida import Manager, TextGenerationConfig, llm
+from lida.components.executor import preprocess_code
 from lida.datamodel import Goal
 import os
 import pandas as pd
 from io import StringIO
 
+from core import chart_templates
+from core.chart_pool import ChartRenderError, chart_pool
+from core.downsampling import reduce_for_chart
 from core.image_manager import image_manager
+from core.llm_cache import llm_cache, model_identity
+from core.lru_cache import LRUCache
+from core.profile_catalog import current_catalog
+from core.result_store import result_store
+from core.tracing import tracer
+
+logger = logging.getLogger(__name__)
 
 
 class VizTools:
@@ -15,6 +31,27 @@ class VizTools:
     
     # Class variable to store the language model
     langchain_llm = None
+
+    # Process-wide LIDA manager shared by all sessions
+    _lida = None
+    _lida_lock = threading.Lock()
+    _textgen_config = None
+
+    # Summaries keyed by schema and content, LLM enrichments keyed by schema only
+    _summary_cache = LRUCache(max_entries=128)
+    _enrichment_cache = LRUCache(max_entries=128)
+
+    # Frames within these limits are summarized without an LLM call
+    SIMPLE_SUMMARY_MAX_ROWS = 50
+    SIMPLE_SUMMARY_MAX_COLUMNS = 4
+    # The number of rows the model sees when phrasing the chart goal
+    CHART_GOAL_SAMPLE_ROWS = 20
+    # Draw common chart shapes with templates, LIDA is used for everything else
+    USE_CHART_TEMPLATES = os.getenv("CHART_TEMPLATES", "1") != "0"
+    # Tools whose LLM responses are served from the persistent response cache
+    LLM_CACHE_TOOLS = {name.strip() for name in
+                       os.getenv("LLM_CACHE_TOOLS", "analyze_data,convert_to_pandas,chart_goal").split(",")
+                       if name.strip()}
     
     # Prompt templates
     DATA_ANALYSIS_PROMPT = """
@@ -64,69 +101,239 @@ class VizTools:
             raise ValueError("VizTools not initialized. Call VizTools.init() first.")
             
         formatted_prompt = VizTools.DATA_ANALYSIS_PROMPT.format(sql_query_result=sql_query_result, prompt=prompt)
-        print(f"Prompt:{formatted_prompt}")
-        response = VizTools.langchain_llm.invoke(formatted_prompt)
+        logger.debug(f"Prompt:{formatted_prompt}")
+        response = VizTools._invoke_llm(formatted_prompt, "analyze_data")
         return response.content if response.content else "No analysis could be generated"
     
     @staticmethod
     @tool
     def convert_to_pandas(
             prompt: Annotated[str, "The original HumanMessage prompt"],
-            sql_query_result: Annotated[str, "The output LLM answer after the sql_db_query is run "]) -> str:
+            sql_query_result: Annotated[str, "The output of sql_db_query including its result_handle line"]) -> str:
         """Convert data to a format compatible with a Pandas dataframe"""
+        handle = result_store.find_handle(sql_query_result)
+        if handle is not None:
+            # The rows were captured from the cursor, no need to ask the model to rewrite them
+            return result_store.describe(handle, result_store.load(handle))
+
         if VizTools.langchain_llm is None:
             raise ValueError("VizTools not initialized. Call VizTools.init() first.")
-            
+
         formatted_prompt = VizTools.DATA_CONVERSION_PROMPT.format(sql_query_result=sql_query_result, prompt=prompt)
-        response = VizTools.langchain_llm.invoke(formatted_prompt)
-        print(f"Converted data:{response.content}")
+        response = VizTools._invoke_llm(formatted_prompt, "convert_to_pandas")
+        logger.debug(f"Converted data:{response.content}")
         return response.content if response.content else "CONVERT_ERROR"
     
     @staticmethod
     @tool
     def visualize_pandas_dataframe(
             prompt: Annotated[str, "The original HumanMessage prompt"],
-            sql_query_result: Annotated[str, "The output CSV string after the convert_to_pandas tool is run "]) -> Dict[str, Any]:
+            sql_query_result: Annotated[str, "The result_handle of the data, or the output CSV string after the convert_to_pandas tool is run "]) -> Dict[str, Any]:
         """Visualize a Pandas dataframe by drawing a chart"""
+        return VizTools._visualize(prompt, sql_query_result)
+
+    @staticmethod
+    def _visualize(prompt: str, sql_query_result: str) -> Dict[str, Any]:
+        """Draw a chart for the referenced data, with a template if one fits and LIDA otherwise."""
+        data = VizTools._load_dataframe(sql_query_result)
+        # Bound the rendering time by the number of points instead of the size of the result
+        with tracer.span("chart.reduce", "summary", rows=len(data)) as span:
+            data, reduction = reduce_for_chart(data)
+            span.set(reduced_rows=len(data), reduction=reduction)
+        if reduction:
+            logger.info(f"Chart data {reduction}")
+        logger.debug(f"Dataframe:{data}")
+
+        if VizTools.USE_CHART_TEMPLATES:
+            spec, prepared = chart_templates.infer_chart(data, prompt)
+            if spec is not None:
+                with tracer.span("chart.template", "chart", rows=len(prepared), chart=spec.kind) as span:
+                    try:
+                        code, image = chart_templates.render(prepared, spec)
+                    except ChartRenderError as e:
+                        logger.warning(f"Template chart failed: {e}")
+                        return f"VIZ_ERROR: {e}"
+                    span.set(bytes=len(image))
+                return {"code": code, "image": image_manager.store_bytes(image)}
+        return VizTools._visualize_with_lida(prompt, data)
+
+    @staticmethod
+    def _visualize_with_lida(prompt: str, data: pd.DataFrame) -> Dict[str, Any]:
+        """Draw a chart with the shared LIDA manager."""
         if VizTools.langchain_llm is None:
             raise ValueError("VizTools not initialized. Call VizTools.init() first.")
-            
 
-        api_key = os.getenv("OPENAI_API_KEY")
-        lida = Manager(text_gen=llm("openai", api_key=api_key))
-        textgen_config = TextGenerationConfig(
-            n=1,
-            temperature=0.0,
-            model="gpt-4",
-            use_cache=True)
-        data = pd.read_csv(StringIO(sql_query_result))
-        print(f"Dataframe:{data}")
-        summary = lida.summarize(
-            data,
-            summary_method="llm",
-            textgen_config=textgen_config)
-        print(f"Summary:{summary}")
-
-        prompt = VizTools._extract_chart_goal(sql_query_result, prompt)
-        print(f"Chart Prompt:{prompt}")
-
-        charts = lida.visualize(
-            summary=summary,
-            goal=(Goal(question=prompt, visualization=prompt, rationale="")),
-            textgen_config=textgen_config,
-            library="seaborn")
-
-        if not charts:
+        lida = VizTools._get_lida()
+        with tracer.span("lida.summarize", "summary", rows=len(data), columns=len(data.columns)):
+            summary = VizTools._summarize(data)
+        logger.debug(f"Summary:{summary}")
+
+        prompt = VizTools._extract_chart_goal(data.head(VizTools.CHART_GOAL_SAMPLE_ROWS).to_csv(index=False), prompt)
+        logger.debug(f"Chart Prompt:{prompt}")
+
+        # Pass the dataframe explicitly instead of relying on the manager's data attribute,
+        # the manager is shared by all sessions
+        with tracer.span("lida.vizgen", "llm", model=VizTools._textgen_config.model):
+            code_specs = lida.vizgen.generate(
+                summary=summary,
+                goal=(Goal(question=prompt, visualization=prompt, rationale="")),
+                textgen_config=VizTools._textgen_config,
+                text_gen=lida.text_gen,
+                library="seaborn")
+        if not code_specs:
             return "VIZ_ERROR"
 
-        image_id = image_manager.store(charts[0].raster)
+        # Execute the generated code in the chart pool instead of the server process
+        code = preprocess_code(code_specs[0])
+        with tracer.span("chart.render", "chart", rows=len(data)) as span:
+            try:
+                image = chart_pool.render(code, data)
+            except ChartRenderError as e:
+                logger.warning(f"Generated chart code failed: {e}")
+                return f"VIZ_ERROR: {e}"
+            span.set(bytes=len(image))
+
         #return a reference to the image to avoid session bloat
-        return {"code": charts[0].code, "image": image_id}
+        return {"code": code, "image": image_manager.store_bytes(image)}
+
+    @staticmethod
+    def _invoke_llm(prompt: str, name: str):
+        """Invoke the language model on behalf of a tool.
+
+        The call inherits the callbacks of the running tool, so the request
+        trace records it as an LLM span with its token usage. Tools listed in
+        LLM_CACHE_TOOLS are answered from the persistent response cache when the
+        same model was already asked the same prompt.
+
+        Args:
+            prompt: The prompt to send
+            name: The name of the calling tool
+
+        Returns:
+            The response message of the language model
+        """
+        if name not in VizTools.LLM_CACHE_TOOLS:
+            logger.debug(f"Invoking the language model for {name}")
+            return VizTools.langchain_llm.invoke(prompt, config={"run_name": f"{name}.llm"})
+
+        model, temperature = model_identity(VizTools.langchain_llm)
+        with tracer.span(f"{name}.llm_cache", "cache", tool=name, model=model) as span:
+            content = llm_cache.get(model, temperature, prompt, tool=name)
+            span.set(cache_hit=content is not None)
+        if content is not None:
+            logger.debug(f"Answered {name} from the LLM response cache")
+            return AIMessage(content=content)
+
+        logger.debug(f"Invoking the language model for {name}")
+        response = VizTools.langchain_llm.invoke(prompt, config={"run_name": f"{name}.llm"})
+        if isinstance(getattr(response, "content", None), str) and response.content:
+            llm_cache.put(model, temperature, prompt, response.content)
+        return response
+
+    @staticmethod
+    def _get_lida() -> Manager:
+        """Return the process-wide LIDA manager, creating it on first use."""
+        if VizTools._lida is None:
+            with VizTools._lida_lock:
+                if VizTools._lida is None:
+                    api_key = os.getenv("OPENAI_API_KEY")
+                    VizTools._textgen_config = TextGenerationConfig(
+                        n=1,
+                        temperature=0.0,
+                        model="gpt-4",
+                        use_cache=True)
+                    VizTools._lida = Manager(text_gen=llm("openai", api_key=api_key))
+        return VizTools._lida
+
+    @staticmethod
+    def _summarize(data: pd.DataFrame) -> Dict[str, Any]:
+        """Summarize a dataframe for LIDA, reusing cached summaries where possible.
+
+        Summaries are cached by schema and content. When the request's database
+        has a profile catalog, the semantic types and descriptions come from its
+        column profiles. Otherwise
+        small or simple frames get the default statistical summary without an LLM
+        call, and for other frames the LLM enrichment is cached by schema only, so
+        results with the same columns but different rows reuse it.
+        """
+        catalog = current_catalog()
+        key = VizTools._fingerprint(data)
+        if catalog is not None:
+            key = f"{catalog.namespace}:{key}"
+        summary = VizTools._summary_cache.get(key)
+        if summary is not None:
+            return copy.deepcopy(summary)
+
+        lida = VizTools._get_lida()
+        summary = lida.summarizer.summarize(
+            data=data,
+            text_gen=lida.text_gen,
+            textgen_config=VizTools._textgen_config,
+            summary_method="default")
+
+        if catalog is not None:
+            catalog.annotate(summary)
+        elif not VizTools._is_simple_frame(data):
+            schema_key = VizTools._schema_fingerprint(data)
+            annotations = VizTools._enrichment_cache.get(schema_key)
+            if annotations is None:
+                enriched = lida.summarizer.enrich(
+                    copy.deepcopy(summary),
+                    text_gen=lida.text_gen,
+                    textgen_config=VizTools._textgen_config)
+                annotations = {
+                    "dataset_description": enriched.get("dataset_description", ""),
+                    "fields": {
+                        field.get("column"): {
+                            name: field.get("properties", {}).get(name, "")
+                            for name in ("semantic_type", "description")
+                        }
+                        for field in enriched.get("fields", [])
+                    }
+                }
+                VizTools._enrichment_cache.put(schema_key, annotations)
+            summary["dataset_description"] = annotations["dataset_description"]
+            for field in summary["fields"]:
+                field["properties"].update(annotations["fields"].get(field["column"], {}))
+
+        VizTools._summary_cache.put(key, summary)
+        return copy.deepcopy(summary)
+
+    @staticmethod
+    def _is_simple_frame(data: pd.DataFrame) -> bool:
+        """Return True if the frame is small or narrow enough for the default summary."""
+        return (len(data) <= VizTools.SIMPLE_SUMMARY_MAX_ROWS or
+                len(data.columns) <= VizTools.SIMPLE_SUMMARY_MAX_COLUMNS)
+
+    @staticmethod
+    def _schema_fingerprint(data: pd.DataFrame) -> str:
+        """Hash the column names and dtypes of a dataframe."""
+        schema = ";".join(f"{name}:{dtype}" for name, dtype in data.dtypes.astype(str).items())
+        return hashlib.sha1(schema.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _fingerprint(data: pd.DataFrame) -> str:
+        """Hash the schema and content of a dataframe."""
+        digest = hashlib.sha1(VizTools._schema_fingerprint(data).encode("utf-8"))
+        try:
+            digest.update(pd.util.hash_pandas_object(data, index=False).values.tobytes())
+        except TypeError:
+            # Unhashable cell values, fall back to the textual representation
+            digest.update(data.to_csv(index=False).encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _load_dataframe(sql_query_result: str) -> pd.DataFrame:
+        """Load the dataframe referenced by a result handle, falling back to parsing CSV text."""
+        df = result_store.resolve(sql_query_result)
+        if df is not None:
+            return df
+        return pd.read_csv(StringIO(sql_query_result))
 
     @staticmethod
     def _extract_chart_goal(data, prompt):
         formatted_chart_prompt = VizTools.CHART_PROMPT.format(sql_query_result=data, prompt=prompt)
-        response = VizTools.langchain_llm.invoke(formatted_chart_prompt)
+        response = VizTools._invoke_llm(formatted_chart_prompt, "chart_goal")
         prompt = response.content if response.content else prompt
         return prompt
 
@@ -149,37 +356,4 @@ class VizTools:
             prompt: Annotated[str, "The original HumanMessage prompt"],
             sql_query_result: Annotated[str, "The output CSV string after the convert_to_pandas tool is run "]) -> Dict[str, Any]:
         """Visualize a Pandas dataframe by drawing a chart"""
-        if VizTools.langchain_llm is None:
-            raise ValueError("VizTools not initialized. Call VizTools.init() first.")
-
-
-        api_key = os.getenv("OPENAI_API_KEY")
-        lida = Manager(text_gen=llm("openai", api_key=api_key))
-        textgen_config = TextGenerationConfig(
-            n=1,
-            temperature=0.0,
-            model="gpt-4",
-            use_cache=True)
-        df = pd.read_csv(StringIO(sql_query_result))
-        print(f"Dataframe:{df}")
-        summary = lida.summarize(
-            df,
-            summary_method="llm",
-            textgen_config=textgen_config)
-        print(f"Summary:{summary}")
-
-        prompt = VizTools._extract_chart_goal(sql_query_result, prompt)
-        print(f"Chart Prompt:{prompt}")
-
-        charts = lida.visualize(
-            summary=summary,
-            goal=(Goal(question=prompt, visualization=prompt, rationale="")),
-            textgen_config=textgen_config,
-            library="seaborn")
-
-        if not charts:
-            return "VIZ_ERROR"
-
-        image_id = image_manager.store(charts[0].raster)
-        #return a reference to the image to avoid session bloat
-        return {"code": charts[0].code, "image": image_id}
\ No newline at end of file
+        return VizTools._visualize(prompt, sql_query_result)
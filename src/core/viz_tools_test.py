@@ -1,7 +1,11 @@
 import os
 from dotenv import load_dotenv
 from unittest.mock import MagicMock, patch
+import json
+import pandas as pd
 import pytest
+from lida import Manager, TextGenerationConfig
+from core.profile_catalog import current_catalog, use_catalog
 from core.viz_tools import VizTools
 from core.image_manager import image_manager
 
@@ -23,7 +27,7 @@ def test_visualization():
     
     # Create a mock LLM that returns a predefined response for the chart goal
     class MockLLM:
-        def invoke(self, prompt):
+        def invoke(self, prompt, config=None):
             # Return a simple chart goal based on the prompt
             return MagicMock(content="Plot bar chart: Name vs Total_Sales from dataframe")  # Echo back the prompt as the goal
     
@@ -53,6 +57,91 @@ def test_visualization():
     return result
 
 
+def test_summary_cache():
+    """
+    Test that LIDA summaries are memoized by content and LLM enrichments by schema.
+    """
+    class CountingTextGen:
+        provider = "fake"
+        calls = 0
+
+        def generate(self, messages, config):
+            CountingTextGen.calls += 1
+            summary = {"dataset_description": "Sales per employee",
+                       "fields": [{"column": "Employee", "properties": {"semantic_type": "name", "description": "Employee"}}]}
+            return MagicMock(text=[{"content": json.dumps(summary)}])
+
+    VizTools._lida = Manager(text_gen=CountingTextGen())
+    VizTools._textgen_config = TextGenerationConfig(n=1, temperature=0.0, provider="fake")
+    VizTools._summary_cache.clear()
+    VizTools._enrichment_cache.clear()
+    try:
+        def frame(offset):
+            return pd.DataFrame({column: [f"{column}{(i + offset) % 7}" for i in range(60)]
+                                 for column in ["Employee", "Country", "City", "Genre", "Album"]})
+
+        small = pd.DataFrame({"Country": ["USA", "Canada"], "Sales": [523.06, 303.96]})
+        assert VizTools._summarize(small)["field_names"] == ["Country", "Sales"]
+        assert CountingTextGen.calls == 0
+
+        first = VizTools._summarize(frame(0))
+        assert CountingTextGen.calls == 1
+        assert first["dataset_description"] == "Sales per employee"
+        assert first["fields"][0]["properties"]["semantic_type"] == "name"
+
+        VizTools._summarize(frame(0))
+        assert VizTools._summary_cache.hits == 1
+
+        VizTools._summarize(frame(3))
+        assert CountingTextGen.calls == 1
+    finally:
+        VizTools._lida = None
+        VizTools._textgen_config = None
+
+
+
+def test_summary_from_profile_catalog():
+    """
+    Test that summaries are annotated from the profile catalog without LLM enrichment.
+    """
+    class FailingTextGen:
+        provider = "fake"
+
+        def generate(self, messages, config):
+            raise AssertionError("The summary should not call the LLM")
+
+    class EnrichingTextGen:
+        provider = "fake"
+
+        def generate(self, messages, config):
+            return MagicMock(text=[{"content": json.dumps({"dataset_description": "Enriched by the LLM",
+                                                           "fields": []})}])
+
+    class Catalog:
+        namespace = "sqlite:///test.db"
+
+        def annotate(self, summary):
+            summary["dataset_description"] = "From the catalog"
+            return summary
+
+    VizTools._lida = Manager(text_gen=FailingTextGen())
+    VizTools._textgen_config = TextGenerationConfig(n=1, temperature=0.0, provider="fake")
+    VizTools._summary_cache.clear()
+    try:
+        wide = pd.DataFrame({column: [f"{column}{i % 7}" for i in range(60)]
+                             for column in ["Employee", "Country", "City", "Genre", "Album"]})
+        with use_catalog(Catalog()):
+            assert VizTools._summarize(wide)["dataset_description"] == "From the catalog"
+        # The catalog is only used by the requests of its database
+        assert current_catalog() is None
+        VizTools._lida = Manager(text_gen=EnrichingTextGen())
+        VizTools._enrichment_cache.clear()
+        assert VizTools._summarize(wide)["dataset_description"] == "Enriched by the LLM"
+    finally:
+        VizTools._lida = None
+        VizTools._textgen_config = None
+
+
 if __name__ == "__main__":
     # This allows running the test directly with Python
     result = test_visualization()
@@ -0,0 +1,64 @@
+import hashlib
+import os
+from typing import Any, Callable, Hashable
+
+import pandas as pd
+
+from core.lru_cache import LRUCache
+
+
+class RenderCache:
+    """
+    A process-wide cache of the artifacts prepared for rendering chat messages.
+
+    Streamlit reruns the whole script on every interaction and replays the
+    chat history, so the parsed tables of earlier messages are memoized by
+    message id and evicted under a byte budget. Chart images are not cached
+    here, the image manager already keeps them in memory.
+    """
+
+    def __init__(self, max_bytes: int = None):
+        """Initialize the RenderCache.
+
+        Args:
+            max_bytes: The byte budget of the cached artifacts, defaults to the
+                UI_RENDER_CACHE_MAX_BYTES environment variable or 128 MB
+        """
+        if max_bytes is None:
+            max_bytes = int(os.getenv("UI_RENDER_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+        self._artifacts = LRUCache(max_bytes=max_bytes, sizeof=self._sizeof)
+
+    def get_or_render(self, key: Hashable, prepare: Callable[[], Any]) -> Any:
+        """Return the cached artifact for a key, preparing and caching it on a miss.
+
+        Args:
+            key: The message id and artifact kind
+            prepare: The function preparing the artifact, artifacts that are None are not cached
+
+        Returns:
+            Any: The artifact
+        """
+        artifact = self._artifacts.get(key)
+        if artifact is None:
+            artifact = prepare()
+            if artifact is not None:
+                self._artifacts.put(key, artifact)
+        return artifact
+
+    def stats(self):
+        return self._artifacts.stats()
+
+    @staticmethod
+    def content_key(content: str) -> str:
+        """Key messages stored before they had an id by their content."""
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _sizeof(artifact: Any) -> int:
+        if isinstance(artifact, pd.DataFrame):
+            return int(artifact.memory_usage(index=True, deep=True).sum())
+        if isinstance(artifact, (bytes, bytearray, str)):
+            return len(artifact)
+        return 1024
+
+render_cache = RenderCache()
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from ui.render_cache import RenderCache
+
+
+def test_artifacts_are_prepared_once_and_evicted_under_the_budget():
+    cache = RenderCache(max_bytes=9_000)
+    calls = []
+
+    def prepare(n):
+        calls.append(n)
+        return pd.DataFrame({"n": range(n)})
+
+    first = cache.get_or_render(("csv", "m1"), lambda: prepare(100))
+    assert cache.get_or_render(("csv", "m1"), lambda: prepare(100)) is first
+    assert calls == [100]
+
+    cache.get_or_render(("csv", "m2"), lambda: prepare(1000))
+    cache.get_or_render(("csv", "m1"), lambda: prepare(100))
+    assert calls == [100, 1000, 100]
+
+
+def test_missing_artifacts_are_not_cached():
+    cache = RenderCache()
+    assert cache.get_or_render(("table", "gone"), lambda: None) is None
+    assert cache.get_or_render(("table", "gone"), lambda: b"png") == b"png"
@@ -1,10 +1,16 @@
-import base64
 import streamlit as st
-from io import BytesIO
 import csv
 import io
+import logging
+import math
+import uuid
 import pandas as pd
+from typing import Any, Dict, Optional
 from core.image_manager import image_manager
+from core.result_store import result_store
+from ui.render_cache import RenderCache, render_cache
+
+logger = logging.getLogger(__name__)
 
 
 class StreamlitBIMessageRenderer:
@@ -12,6 +18,9 @@ class StreamlitBIMessageRenderer:
     This handler can be used for rendering the results of the BI agent in Streamlit
     """
 
+    # The number of rows of a table shown per page
+    TABLE_PAGE_ROWS = 100
+
     def __init__(self, v_store_in_session: bool = False):
         """Initialize the StreamlitBICallbackHandler.
 
@@ -19,20 +28,24 @@ class StreamlitBIMessageRenderer:
             store_in_session: Whether to store messages in Streamlit session state
         """
         self._store_in_session = v_store_in_session
+        self._token_container = None
+        self._token_message_id = None
+        self._tokens = ""
         
-    def process_message(self, content: str, message_type: str) -> None:
+    def process_message(self, content: str, message_type: str, message_id: str = None) -> None:
         """Route the content to the appropriate handler method based on message_type.
 
         Args:
             content: The content to be processed
             message_type: The type of message, determines which handler to use
+            message_id: The id of the stored message, the rendered artifacts are cached under it
         """
         handler_map = {
             'sql': self.process_sql,
             'image': self.process_chart,
             'chart_code': self.process_chart_code,
             'text': self.process_last_message,
-            'table': self.process_data
+            'table': lambda data_content: self.process_data(data_content, message_id)
         }
         
         handler = handler_map.get(message_type)
@@ -40,7 +53,7 @@ class StreamlitBIMessageRenderer:
             handler(content)
         else:
             st.warning(f"No handler found for message type: {message_type}")
-            print(f"Warning: No handler found for message type: {message_type}")
+            logger.warning(f"No handler found for message type: {message_type}")
 
     def process_sql(self, sql_query: str) -> None:
         """Print the SQL query being executed.
@@ -52,30 +65,36 @@ class StreamlitBIMessageRenderer:
             response_container = st.empty()
             response_container.markdown(sql_query)
             self.store_in_session(sql_query, "sql")
-        print("\n=== SQL Query ===")
-        print(sql_query)
-        print("=================\n")
+        logger.debug(f"SQL Query:{sql_query}")
 
-    def store_in_session(self, content, message_type):
+    def store_in_session(self, content, message_type) -> Optional[str]:
+        """Append a message to the chat history of the session and return its id."""
         if self._store_in_session:
+            message_id = uuid.uuid4().hex[:12]
             st.session_state.messages.append({
+                "id": message_id,
                 "role": "assistant",
                 "type": message_type,
                 "content": content
             })
+            return message_id
+        return None
 
 
     def process_chart(self, image_id: str) -> None:
-        """Print a message indicating chart image data was received.
+        """Render a chart image.
 
         Args:
-            image_data: The base64 encoded image data (only the length is printed)
+            image_id: The id of the image in the image manager, which keeps the decoded bytes in its own LRU
         """
         response_container = st.empty()
-        image_data = image_manager.load(image_id)
-        response_container.image(self._decode_base64_image(image_data))
+        image_bytes = image_manager.load_bytes(image_id)
+        if image_bytes is not None:
+            response_container.image(image_bytes)
+        else:
+            response_container.info("This chart is no longer available, ask the question again to redraw it.")
         self.store_in_session(image_id, "image")
-        print(f"\n=== Chart Image Data (length: {len(image_data) if image_data else 0}) ===\n")
+        logger.debug(f"Chart Image Data (length: {len(image_bytes) if image_bytes else 0})")
 
     def process_chart_code(self, chart_code: str) -> None:
         """Print the chart generation code.
@@ -87,9 +106,28 @@ class StreamlitBIMessageRenderer:
             response_container = st.empty()
             response_container.code(chart_code)
             self.store_in_session(chart_code, "chart_code")
-        print("\n=== Chart Generation Code ===")
-        print(chart_code)
-        print("============================\n")
+        logger.debug(f"Chart Generation Code:{chart_code}")
+
+    def process_token(self, token: str, message_id: str = None) -> None:
+        """Render a token of the answer as it is generated.
+
+        The tokens of a new message start a new container below the tool results,
+        and the text streamed so far is cleared as it was a preliminary message
+        before a tool call.
+
+        Args:
+            token: The next piece of the answer
+            message_id: The id of the message the token belongs to
+        """
+        if self._token_container is None or message_id != self._token_message_id:
+            if self._token_container is not None:
+                self._token_container.empty()
+            with st.chat_message("assistant"):
+                self._token_container = st.empty()
+            self._token_message_id = message_id
+            self._tokens = ""
+        self._tokens += token
+        self._token_container.markdown(self._tokens + "▌")
 
     def process_last_message(self, message_content: str) -> None:
         """Print the content of the last message.
@@ -97,42 +135,79 @@ class StreamlitBIMessageRenderer:
         Args:
             message_content: The content of the last message
         """
+        if self._token_container is not None:
+            # Replace the streamed tokens with the complete message
+            self._token_container.markdown(message_content)
+            self._token_container = None
+            self._token_message_id = None
+            self._tokens = ""
+            self.store_in_session(message_content, "text")
+            return
         with st.chat_message("assistant"):
             response_container = st.empty()
             response_container.markdown(message_content)
             self.store_in_session(message_content, "text")
-        print("\n=== Last Message Content ===")
-        print(message_content)
-        print("=============================\n")
+        logger.debug(f"Last Message Content:{message_content}")
 
-    def process_data(self, data_content: str) -> None:
+    def process_data(self, data_content: str, message_id: str = None) -> None:
         """Print the data content received from a 'convert_to_pandas' message.
 
+        Only the result handle is kept in the session, the rows of the visible
+        page are read from the result store when the table is rendered.
+
         Args:
-            data_content: The data content to be printed
+            data_content: The result handle of the data, or the data as CSV text
+            message_id: The id of the stored message, the parsed table and page are kept under it
         """
         with st.chat_message("assistant"):
-            self._render_table_from_csv(data_content)
-            self.store_in_session(data_content, "table")
-
-        print("\n=== Data Content ===")
-        print(data_content)
+            handle = result_store.find_handle(data_content)
+            stored_id = self.store_in_session(f"result_handle: {handle}" if handle is not None else data_content,
+                                              "table")
+            key = message_id or stored_id or RenderCache.content_key(data_content)
+            if handle is not None:
+                self._render_table_from_handle(handle, key)
+            elif result_store.HANDLE_PATTERN.search(data_content):
+                st.info("This result is no longer available, ask the question again to reload it.")
+            else:
+                self._render_table_from_csv(data_content, key)
+        logger.debug(f"Data Content:{data_content}")
+
+    def process_trace_summary(self, summary: Dict[str, Any]) -> None:
+        """Show where the time of the request was spent below the answer.
 
-        print("====================\n")
-
-    def _decode_base64_image(self, encoded: str):
-        try:
-            return BytesIO(base64.b64decode(encoded))
-        except Exception as e:
-            st.error(f"Error decoding image: {e}")
-            return None
-    def _render_table_from_csv(self, csv_text: str):
+        Args:
+            summary: The per-stage timing and token summary of the request trace
+        """
+        stages = " · ".join(f"{stage} {totals['ms']:.0f} ms" for stage, totals in summary["stages"].items())
+        st.caption(f"Answered in {summary['total_ms']:.0f} ms" + (f" ({stages})" if stages else ""))
+
+    def _page(self, total: int, key: str) -> int:
+        """Render a page selector for tables longer than a page and return the first row of the page."""
+        pages = math.ceil(total / self.TABLE_PAGE_ROWS)
+        if pages <= 1:
+            return 0
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1,
+                               key=f"table-page-{key}")
+        offset = (int(page) - 1) * self.TABLE_PAGE_ROWS
+        st.caption(f"Rows {offset + 1}-{min(offset + self.TABLE_PAGE_ROWS, total)} of {total}")
+        return offset
+
+    def _render_table_from_handle(self, handle: str, key: str):
+        offset = self._page(result_store.num_rows(handle), key)
+        # A zero-copy slice of the Arrow table, Streamlit renders Arrow data directly
+        st.dataframe(result_store.slice(handle, offset, self.TABLE_PAGE_ROWS), use_container_width=True)
+
+    def _render_table_from_csv(self, csv_text: str, key: str):
         try:
-            reader = csv.reader(io.StringIO(csv_text.strip()))
-            rows = list(reader)
-            df = pd.DataFrame(rows[1:], columns=rows[0])
+            df = render_cache.get_or_render(("csv", key), lambda: self._parse_csv(csv_text))
+            offset = self._page(len(df), key)
             response_container = st.empty()
-            response_container.dataframe(df, use_container_width=True)
+            response_container.dataframe(df.iloc[offset:offset + self.TABLE_PAGE_ROWS], use_container_width=True)
         except Exception as e:
             st.error(f"Table rendering failed: {e}")
             st.text(csv_text)
+
+    @staticmethod
+    def _parse_csv(csv_text: str) -> pd.DataFrame:
+        rows = list(csv.reader(io.StringIO(csv_text.strip())))
+        return pd.DataFrame(rows[1:], columns=rows[0])